@@ -10,12 +10,16 @@ from flask import Flask, render_template, request
 from waitress.server import create_server
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 
+from backend.bandwidth import bandwidth, get_bandwidth_limits
 from backend.db import close_db, get_db, set_db_location, setup_db
 from backend.files import folder_path
 from backend.logging import set_log_level, setup_logging
-from backend.settings import default_settings, private_settings
-from frontend.api import (about_data, api, download_handler, settings,
-                          task_handler, ui_vars)
+from backend.metrics import (end_request_profile, set_metrics_enabled,
+                             start_request_profile)
+from backend.settings import default_settings
+from frontend.api import (about_data, api, download_handler,
+                          set_hosting_threads, settings, task_handler,
+                          ui_vars)
 from frontend.ui import ui
 
 DB_FILENAME = 'db', 'Kapowarr.db'
@@ -33,8 +37,12 @@ def _create_app() -> Flask:
 		static_url_path='/static'
 	)
 	app.config['SECRET_KEY'] = urandom(32)
-	app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+	app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
 	app.config['JSON_SORT_KEYS'] = False
+	if hasattr(app, 'json'):
+		# Newer versions of Flask ignore the two config keys above
+		app.json.compact = True
+		app.json.sort_keys = False
 
 	# Add error handlers
 	@app.errorhandler(404)
@@ -62,6 +70,10 @@ def _create_app() -> Flask:
 	# Setup db handling
 	app.teardown_appcontext(close_db)
 
+	# Setup request profiling (only records when metrics are enabled)
+	app.before_request(start_request_profile)
+	app.after_request(end_request_profile)
+
 	return app
 
 def Kapowarr() -> None:
@@ -95,6 +107,8 @@ def Kapowarr() -> None:
 
 		# Setup db
 		setup_db()
+		set_metrics_enabled(settings.get_settings()['enable_metrics'])
+		bandwidth.set_limits(get_bandwidth_limits())
 		
 		# Set url base if needed
 		url_base = settings.get_settings()['url_base']
@@ -112,11 +126,14 @@ def Kapowarr() -> None:
 
 	# Create waitress server and run
 	logging.debug('Creating server')
+	set_hosting_threads(settings.cache['hosting_threads'])
 	server = create_server(
 		app,
 		host=settings.cache['host'],
 		port=settings.cache['port'],
-		threads=private_settings['hosting_threads']
+		threads=settings.cache['hosting_threads'],
+		connection_limit=settings.cache['connection_limit'],
+		channel_timeout=settings.cache['channel_timeout']
 	)
 	logging.info(f'Kapowarr running on http://{settings.cache["host"]}:{settings.cache["port"]}{settings.cache["url_base"]}/')
 	# Below is run endlessly until CTRL+C
@@ -0,0 +1,327 @@
+#-*- coding: utf-8 -*-
+
+"""This file contains functions regarding limiting the download speed.
+Limits can apply to all downloads together or to the downloads of one source,
+and can be restricted to a time of day.
+"""
+
+import logging
+from datetime import datetime
+from re import compile
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Dict, List
+
+from backend.custom_exceptions import BandwidthLimitNotFound, InvalidKeyValue
+from backend.db import get_db
+from backend.settings import supported_source_strings
+
+time_regex = compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+
+# How often (in seconds) the limits of the time of day are determined
+refresh_interval = 30.0
+# The smallest amount of bytes to download before throttling
+min_chunk_size = 16384
+
+class TokenBucket:
+	"""Limits the rate at which bytes pass. Tokens build up at the rate,
+	up to one second worth of tokens. Taking more tokens than available
+	results in a wait that's proportional to the shortage.
+	"""
+	def __init__(self) -> None:
+		self.rate = 0
+		self.tokens = 0.0
+		self.last = perf_counter()
+		self.lock = Lock()
+		return
+
+	def __refill(self) -> None:
+		now = perf_counter()
+		self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+		self.last = now
+		return
+
+	def set_rate(self, rate: int) -> None:
+		"""Change the rate of the bucket
+
+		Args:
+			rate (int): The amount of bytes per second. 0 is unlimited.
+		"""
+		with self.lock:
+			self.__refill()
+			self.rate = rate
+			self.tokens = min(self.tokens, rate)
+		return
+
+	def reserve(self, amount: int) -> float:
+		"""Take tokens from the bucket
+
+		Args:
+			amount (int): The amount of bytes that want to pass
+
+		Returns:
+			float: How long to wait in seconds before the bytes may pass
+		"""
+		with self.lock:
+			if not self.rate:
+				return 0.0
+			self.__refill()
+			self.tokens -= amount
+			return max(-self.tokens / self.rate, 0.0)
+
+class SpeedMeter:
+	"""Calculates a download speed that doesn't jump around, by taking the
+	exponential moving average of the speed over time
+	"""
+	# The speed is updated at most this often (in seconds)
+	min_interval = 0.5
+	# After this many seconds, a speed counts for half of the average
+	half_life = 2.0
+
+	def __init__(self) -> None:
+		self.speed = 0.0
+		self.pending = 0
+		self.last = perf_counter()
+		self.first = True
+		return
+
+	def update(self, amount: int) -> float:
+		"""Register downloaded bytes
+
+		Args:
+			amount (int): The amount of bytes that were downloaded since the last update
+
+		Returns:
+			float: The smoothed speed in bytes per second
+		"""
+		self.pending += amount
+		now = perf_counter()
+		elapsed = now - self.last
+		if elapsed < self.min_interval:
+			return self.speed
+
+		speed = self.pending / elapsed
+		if self.first:
+			self.speed = speed
+			self.first = False
+		else:
+			weight = 1 - 0.5 ** (elapsed / self.half_life)
+			self.speed += weight * (speed - self.speed)
+		self.speed = round(self.speed, 2)
+		self.pending = 0
+		self.last = now
+		return self.speed
+
+def _is_active(limit: dict, now: str) -> bool:
+	"""Check if a limit applies at the given time of day
+
+	Args:
+		limit (dict): The limit
+		now (str): The time of day in the format `HH:MM`
+
+	Returns:
+		bool: Wether or not the limit applies
+	"""
+	start, end = limit['start_time'], limit['end_time']
+	if start is None:
+		return True
+	if start <= end:
+		return start <= now < end
+	# Window goes past midnight
+	return now >= start or now < end
+
+class _BandwidthScheduler:
+	"""Throttles all downloads, with one token bucket for all downloads
+	together and one per source
+	"""
+	def __init__(self) -> None:
+		self.limits: List[dict] = []
+		self.all_sources = TokenBucket()
+		self.sources: Dict[str, TokenBucket] = {
+			s[0]: TokenBucket()
+			for s in supported_source_strings
+		}
+		self.next_refresh = 0.0
+		self.lock = Lock()
+		return
+
+	def set_limits(self, limits: List[dict]) -> None:
+		"""Replace the limits. Applies directly to running downloads.
+
+		Args:
+			limits (List[dict]): The limits (output of `get_bandwidth_limits()`)
+		"""
+		with self.lock:
+			self.limits = limits
+			self.next_refresh = 0.0
+		self.__refresh()
+		return
+
+	def __limit(self, source: str, now: str) -> int:
+		"""Get the lowest limit that currently applies
+
+		Args:
+			source (str): The source or `None` for the limits of all downloads together
+			now (str): The time of day in the format `HH:MM`
+
+		Returns:
+			int: The limit in bytes per second. 0 is unlimited.
+		"""
+		limits = [
+			l['speed_limit'] * 1024
+			for l in self.limits
+			if l['source'] == source
+			and _is_active(l, now)
+		]
+		return min(limits, default=0)
+
+	def __refresh(self) -> None:
+		with self.lock:
+			if perf_counter() < self.next_refresh:
+				return
+			self.next_refresh = perf_counter() + refresh_interval
+
+			now = datetime.now().strftime('%H:%M')
+			self.all_sources.set_rate(self.__limit(None, now))
+			for source, bucket in self.sources.items():
+				bucket.set_rate(self.__limit(source, now))
+		return
+
+	def chunk_size(self, source: str, default: int) -> int:
+		"""Get the amount of bytes to download before throttling, so that
+		throttling is smooth and downloads can still be stopped quickly
+
+		Args:
+			source (str): The source of the download
+			default (int): The chunk size when there is no limit
+
+		Returns:
+			int: The chunk size in bytes
+		"""
+		self.__refresh()
+		rates = [
+			r for r in (self.all_sources.rate, self.sources[source].rate)
+			if r
+		]
+		if not rates:
+			return default
+		return max(min_chunk_size, min(default, min(rates) // 4))
+
+	def throttle(self, source: str, amount: int) -> None:
+		"""Wait until downloaded bytes are allowed to pass
+
+		Args:
+			source (str): The source of the download
+			amount (int): The amount of bytes that were downloaded
+		"""
+		self.__refresh()
+		wait = max(
+			self.all_sources.reserve(amount),
+			self.sources[source].reserve(amount)
+		)
+		if wait:
+			sleep(wait)
+		return
+
+bandwidth = _BandwidthScheduler()
+
+#=====================
+# Managing limits
+#=====================
+def get_bandwidth_limits() -> List[dict]:
+	"""Get all bandwidth limits
+
+	Returns:
+		List[dict]: The limits. The speed limit is in KB/s.
+		When source is `None`, the limit applies to all downloads together.
+		When the start and end time are `None`, the limit applies all day.
+	"""
+	now = datetime.now().strftime('%H:%M')
+	result = [
+		dict(l)
+		for l in get_db('dict').execute("""
+			SELECT id, source, start_time, end_time, speed_limit
+			FROM bandwidth_limits
+			ORDER BY id;
+		""")
+	]
+	for limit in result:
+		limit['active'] = _is_active(limit, now)
+	return result
+
+def get_bandwidth_limit(id: int) -> dict:
+	"""Get a bandwidth limit
+
+	Args:
+		id (int): The id of the limit
+
+	Raises:
+		BandwidthLimitNotFound: The id doesn't map to any limit
+
+	Returns:
+		dict: The limit, similar to the dicts in the output of `get_bandwidth_limits()`
+	"""
+	for limit in get_bandwidth_limits():
+		if limit['id'] == id:
+			return limit
+	raise BandwidthLimitNotFound
+
+def add_bandwidth_limit(
+	speed_limit: int,
+	source: str=None,
+	start_time: str=None,
+	end_time: str=None
+) -> dict:
+	"""Add a bandwidth limit
+
+	Args:
+		speed_limit (int): The maximum speed in KB/s
+		source (str, optional): The source the limit applies to. Defaults to None (all downloads together).
+		start_time (str, optional): From when on the limit applies, in the format `HH:MM`. Defaults to None.
+		end_time (str, optional): Until when the limit applies, in the format `HH:MM`. Defaults to None.
+
+	Raises:
+		InvalidKeyValue: One of the values is invalid
+
+	Returns:
+		dict: The new limit
+	"""
+	if not isinstance(speed_limit, int) or isinstance(speed_limit, bool) or speed_limit < 1:
+		raise InvalidKeyValue('speed_limit', speed_limit)
+
+	if source is not None and not source in bandwidth.sources:
+		raise InvalidKeyValue('source', source)
+
+	if (start_time is None) != (end_time is None):
+		raise InvalidKeyValue('start_time' if start_time is None else 'end_time', None)
+	for key, value in (('start_time', start_time), ('end_time', end_time)):
+		if value is not None and not (isinstance(value, str) and time_regex.match(value)):
+			raise InvalidKeyValue(key, value)
+
+	logging.info(f'Adding bandwidth limit: {speed_limit}KB/s for {source or "all sources"}' + (f' from {start_time} to {end_time}' if start_time else ''))
+	id = get_db().execute("""
+		INSERT INTO bandwidth_limits(source, start_time, end_time, speed_limit)
+		VALUES (?, ?, ?, ?);
+		""",
+		(source, start_time, end_time, speed_limit)
+	).lastrowid
+	bandwidth.set_limits(get_bandwidth_limits())
+	return get_bandwidth_limit(id)
+
+def delete_bandwidth_limit(id: int) -> None:
+	"""Delete a bandwidth limit
+
+	Args:
+		id (int): The id of the limit
+
+	Raises:
+		BandwidthLimitNotFound: The id doesn't map to any limit
+	"""
+	logging.info(f'Deleting bandwidth limit: {id}')
+	if not get_db().execute(
+		"DELETE FROM bandwidth_limits WHERE id = ?;",
+		(id,)
+	).rowcount:
+		raise BandwidthLimitNotFound
+	bandwidth.set_limits(get_bandwidth_limits())
+	return
@@ -5,24 +5,33 @@
 
 import logging
 from sqlite3 import IntegrityError
+from sys import maxsize
 from time import time
-from typing import List
+from typing import List, Tuple
 
 from backend.custom_exceptions import BlocklistEntryNotFound, InvalidKeyValue
 from backend.db import get_db
 from backend.settings import blocklist_reasons
 
 
-def get_blocklist(offset: int=0) -> List[dict]:
-	"""Get the blocklist entries in blocks of 50
+def get_blocklist(before: Tuple[int, int]=None, offset: int=0) -> List[dict]:
+	"""Get the blocklist entries in blocks of 50, newest first
 	
 	Args:
-		offset (int, optional): The offset of the list. The higher the number, the deeper into the list you go. Defaults to 0.
+		before (Tuple[int, int], optional): The `added_at` and `id` of the
+		last entry of the previous block, to get the block after it.
+		Defaults to None (first block).
+		offset (int, optional): Deprecated, use `before` instead. The number of
+		the block to get, when `before` isn't given. Defaults to 0.
 
 	Returns:
 		List[dict]: A list of dicts where each dict is a blocklist entry
 	"""	
-	logging.debug(f'Fetching blocklist with offset {offset}')
+	logging.debug(f'Fetching blocklist before {before}, offset {offset}')
+	if before is None:
+		before = (maxsize, maxsize)
+	else:
+		offset = 0
 	entries = list(map(
 		dict,
 		get_db('dict').execute("""
@@ -34,10 +43,11 @@ def get_blocklist(offset: int=0) -> List[dict]:
 			FROM blocklist bl
 			INNER JOIN blocklist_reasons blr
 			ON bl.reason = blr.id
-			ORDER BY bl.id DESC
+			WHERE (bl.added_at, bl.id) < (?, ?)
+			ORDER BY bl.added_at DESC, bl.id DESC
 			LIMIT 50
 			OFFSET ?;
-		""", (offset * 50,))
+		""", (*before, offset * 50))
 	))
 	
 	return entries
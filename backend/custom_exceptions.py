@@ -118,6 +118,15 @@ class DownloadNotFound(Exception):
 		logging.warning('Download with given id not found')
 		return
 
+class ArchiveNotFound(Exception):
+	"""Nothing has been archived yet
+	"""
+	api_response = {'error': 'ArchiveNotFound', 'result': {}, 'code': 404}
+
+	def __init__(self) -> None:
+		logging.warning('Archive not found')
+		return
+
 class BlocklistEntryNotFound(Exception):
 	"""The blocklist entry with the given id was not found
 	"""
@@ -127,6 +136,15 @@ class BlocklistEntryNotFound(Exception):
 		logging.warning('Blocklist entry with given id not found')
 		return
 
+class BandwidthLimitNotFound(Exception):
+	"""The bandwidth limit with the given id was not found
+	"""
+	api_response = {'error': 'BandwidthLimitNotFound', 'result': {}, 'code': 404}
+
+	def __init__(self) -> None:
+		logging.warning('Bandwidth limit with given id not found')
+		return
+
 class InvalidComicVineApiKey(Exception):
 	"""No Comic Vine API key is set or it's invalid
 	"""
@@ -268,4 +286,35 @@ class DownloadLimitReached(Exception):
 	@property
 	def api_response(self):
 		return {'error': 'DownloadLimitReached', 'result': {'string': self.string}, 'code': 509}
-	
\ No newline at end of file
+	
+class DownloadCorrupt(Exception):
+	"""The downloaded file is incomplete or isn't a valid archive
+	"""
+	def __init__(self, file: str, reason: str) -> None:
+		self.file = file
+		self.reason = reason
+		super().__init__(reason)
+		logging.warning(f'Download is corrupt: {file}: {reason}')
+		return
+
+	@property
+	def api_response(self):
+		return {'error': 'DownloadCorrupt', 'result': {'file': self.file, 'reason': self.reason}, 'code': 422}
+
+class TooManyEventStreams(Exception):
+	"""The maximum amount of event streams that can be open at the same time is reached
+	"""
+	api_response = {'error': 'TooManyEventStreams', 'result': {}, 'code': 503}
+
+	def __init__(self) -> None:
+		logging.warning('Event stream refused because the maximum amount is reached')
+		return
+
+class ServerBusy(Exception):
+	"""The server is already handling the maximum amount of slow requests
+	"""
+	api_response = {'error': 'ServerBusy', 'result': {}, 'code': 503}
+
+	def __init__(self) -> None:
+		logging.warning('Request refused because the server is too busy')
+		return
@@ -8,13 +8,15 @@ KAPOWARR_DATABASE_FILE = "Kapowarr.db"
 import logging
 from os import makedirs
 from os.path import dirname
-from sqlite3 import Connection, Row
+from sqlite3 import Connection, Cursor, Row
 from threading import current_thread
 from time import time
 
 from flask import g
 
-__DATABASE_VERSION__ = 6
+from backend.metrics import TimedCursor, metrics
+
+__DATABASE_VERSION__ = 9
 
 class Singleton(type):
 	_instances = {}
@@ -62,14 +64,15 @@ def get_db(output_type='tuple', temp: bool=False):
 	Returns:
 		Cursor: Database cursor instance with desired output type set
 	"""
+	cursor_type = TimedCursor if metrics.enabled else Cursor
 	if temp:
-		cursor = DBConnection(timeout=20.0).cursor()
+		cursor = DBConnection(timeout=20.0).cursor(cursor_type)
 	else:
 		try:
 			cursor = g.cursor
 		except AttributeError:
 			db = DBConnection(timeout=20.0)
-			cursor = g.cursor = db.cursor()
+			cursor = g.cursor = db.cursor(cursor_type)
 		
 	if output_type == 'dict':
 		cursor.row_factory = Row
@@ -96,6 +99,33 @@ def close_db(e: str=None):
 
 	return
 
+# The indexes for the queries that are run often.
+# tests/Tbackend/db.py checks the queries in backend/ against these.
+index_commands = """
+	CREATE INDEX IF NOT EXISTS volumes_comicvine_id_index
+		ON volumes(comicvine_id);
+	CREATE INDEX IF NOT EXISTS volumes_last_cv_fetch_index
+		ON volumes(last_cv_fetch);
+	CREATE INDEX IF NOT EXISTS volumes_title_index
+		ON volumes(title);
+	CREATE INDEX IF NOT EXISTS volumes_root_folder_index
+		ON volumes(root_folder);
+	CREATE INDEX IF NOT EXISTS issues_files_issue_index
+		ON issues_files(issue_id);
+	CREATE INDEX IF NOT EXISTS files_hash_index
+		ON files(hash);
+	CREATE INDEX IF NOT EXISTS files_sample_hash_index
+		ON files(size, sample_hash);
+	CREATE INDEX IF NOT EXISTS download_history_downloaded_at_index
+		ON download_history(downloaded_at);
+	CREATE INDEX IF NOT EXISTS task_history_run_at_index
+		ON task_history(run_at);
+	CREATE INDEX IF NOT EXISTS task_history_task_name_index
+		ON task_history(task_name, run_at);
+	CREATE INDEX IF NOT EXISTS blocklist_added_at_index
+		ON blocklist(added_at);
+"""
+
 def migrate_db(current_db_version: int) -> None:
 	"""
 	Migrate a Kapowarr database from it's current version
@@ -242,6 +272,66 @@ def migrate_db(current_db_version: int) -> None:
 		)
 
 		current_db_version = 6
+
+	if current_db_version == 6:
+		# V6 -> V7
+		from backend.wanted import update_wanted
+
+		update_wanted()
+
+		current_db_version = 7
+
+	if current_db_version == 7:
+		# V7 -> V8
+		cursor.execute("""
+			ALTER TABLE files
+				ADD hash VARCHAR(64);
+		""")
+
+		current_db_version = 8
+
+	if current_db_version == 8:
+		# V8 -> V9
+		cursor.executescript("""
+			BEGIN TRANSACTION;
+
+			ALTER TABLE files
+				ADD sample_hash VARCHAR(64);
+
+			-- Declare the ids of the history entries, so that they can be
+			-- used for paging and don't change when the database is vacuumed
+			CREATE TEMPORARY TABLE temp_download_history AS
+				SELECT rowid AS id, original_link, title, downloaded_at
+				FROM download_history;
+			DROP TABLE download_history;
+
+			CREATE TABLE IF NOT EXISTS download_history(
+				id INTEGER PRIMARY KEY,
+				original_link TEXT NOT NULL,
+				title TEXT NOT NULL,
+				downloaded_at INTEGER NOT NULL
+			);
+			INSERT INTO download_history
+				SELECT * FROM temp_download_history;
+
+			CREATE TEMPORARY TABLE temp_task_history AS
+				SELECT rowid AS id, task_name, display_title, run_at
+				FROM task_history;
+			DROP TABLE task_history;
+
+			CREATE TABLE IF NOT EXISTS task_history(
+				id INTEGER PRIMARY KEY,
+				task_name NOT NULL,
+				display_title NOT NULL,
+				run_at INTEGER NOT NULL
+			);
+			INSERT INTO task_history
+				SELECT * FROM temp_task_history;
+
+			COMMIT;
+		""")
+
+		current_db_version = 9
 	
 	return
 
@@ -299,7 +389,9 @@ def setup_db() -> None:
 		CREATE TABLE IF NOT EXISTS files(
 			id INTEGER PRIMARY KEY,
 			filepath TEXT UNIQUE NOT NULL,
-			size INTEGER
+			size INTEGER,
+			sample_hash VARCHAR(64),
+			hash VARCHAR(64)
 		);
 		CREATE TABLE IF NOT EXISTS issues_files(
 			file_id INTEGER NOT NULL,
@@ -313,6 +405,17 @@ def setup_db() -> None:
 				issue_id
 			)
 		);
+		CREATE TABLE IF NOT EXISTS wanted_issues(
+			issue_id INTEGER PRIMARY KEY,
+			volume_id INTEGER NOT NULL,
+
+			FOREIGN KEY (issue_id) REFERENCES issues(id)
+				ON DELETE CASCADE,
+			FOREIGN KEY (volume_id) REFERENCES volumes(id)
+				ON DELETE CASCADE
+		);
+		CREATE INDEX IF NOT EXISTS wanted_issues_volume_index
+			ON wanted_issues(volume_id);
 		CREATE TABLE IF NOT EXISTS download_queue(
 			id INTEGER PRIMARY KEY,
 			link TEXT NOT NULL,
@@ -323,11 +426,13 @@ def setup_db() -> None:
 			FOREIGN KEY (issue_id) REFERENCES issues(id)
 		);
 		CREATE TABLE IF NOT EXISTS download_history(
+			id INTEGER PRIMARY KEY,
 			original_link TEXT NOT NULL,
 			title TEXT NOT NULL,
 			downloaded_at INTEGER NOT NULL
 		);
 		CREATE TABLE IF NOT EXISTS task_history(
+			id INTEGER PRIMARY KEY,
 			task_name NOT NULL,
 			display_title NOT NULL,
 			run_at INTEGER NOT NULL
@@ -337,6 +442,10 @@ def setup_db() -> None:
 			interval INTEGER NOT NULL,
 			next_run INTEGER NOT NULL
 		);
+		CREATE TABLE IF NOT EXISTS task_progress(
+			task_name PRIMARY KEY,
+			last_id INTEGER NOT NULL
+		);
 		CREATE TABLE IF NOT EXISTS blocklist_reasons(
 			id INTEGER PRIMARY KEY,
 			reason TEXT NOT NULL UNIQUE
@@ -366,6 +475,34 @@ def setup_db() -> None:
 			source VARCHAR(30) UNIQUE NOT NULL,
 			pref INTEGER UNIQUE CHECK (pref >= 1)
 		);
+		CREATE TABLE IF NOT EXISTS library_import(
+			id INTEGER PRIMARY KEY,
+			root_folder INTEGER NOT NULL,
+			folder TEXT NOT NULL,
+			files TEXT NOT NULL,
+			series VARCHAR(255) NOT NULL,
+			volume_number INTEGER(8),
+			year INTEGER(5),
+			comicvine_id INTEGER,
+			cv_title VARCHAR(255),
+			cv_year INTEGER(5),
+			cv_issue_count INTEGER,
+
+			FOREIGN KEY (root_folder) REFERENCES root_folders(id)
+				ON DELETE CASCADE
+		);
+		CREATE TABLE IF NOT EXISTS bandwidth_limits(
+			id INTEGER PRIMARY KEY,
+			source VARCHAR(30),
+			start_time VARCHAR(5),
+			end_time VARCHAR(5),
+			speed_limit INTEGER NOT NULL CHECK (speed_limit >= 1)
+		);
+		CREATE TABLE IF NOT EXISTS download_link_cache(
+			page_link TEXT PRIMARY KEY,
+			plan TEXT NOT NULL,
+			expires_at INTEGER NOT NULL
+		);
 	"""
 	logging.debug('Creating database tables')
 	cursor.executescript(setup_commands)
@@ -392,6 +529,11 @@ def setup_db() -> None:
 			(__DATABASE_VERSION__,)
 		)
 
+	# Indexes are created after migrating, as they can cover
+	# columns that older databases only have after migrating
+	logging.debug('Creating database indexes')
+	cursor.executescript(index_commands)
+
 	# Generate api key
 	api_key = (1,) in cursor.execute(
 		"SELECT 1 FROM config WHERE key = 'api_key' LIMIT 1;"
@@ -5,24 +5,31 @@
 
 import logging
 from abc import ABC, abstractmethod
-from hashlib import sha1
-from os import listdir, remove
-from os.path import basename, join, splitext
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1, sha256
+from json import dumps, loads
+from math import inf
+from os import listdir, remove, stat
+from os.path import basename, isfile, join, splitext
 from re import IGNORECASE, compile
-from threading import Thread
-from time import perf_counter
+from sys import maxsize
+from threading import RLock, Thread
+from time import perf_counter, time
 from typing import Dict, List, Tuple, Union
 
 from bencoding import bdecode, bencode
 from bs4 import BeautifulSoup
 from requests import get
 from requests.exceptions import ConnectionError as requests_ConnectionError
+from requests.exceptions import RequestException
 
+from backend.bandwidth import SpeedMeter, bandwidth
 from backend.blocklist import add_to_blocklist, blocklist_contains
 from backend.credentials import Credentials
-from backend.custom_exceptions import (DownloadLimitReached, DownloadNotFound,
-                                       LinkBroken)
+from backend.custom_exceptions import (DownloadCorrupt, DownloadLimitReached,
+                                       DownloadNotFound, LinkBroken)
 from backend.db import get_db
+from backend.events import event_hub
 from backend.files import extract_filename_data
 from backend.naming import (generate_issue_name, generate_issue_range_name,
                             generate_tpb_name)
@@ -38,6 +45,13 @@ mega_regex = compile(r'https?://mega\.(nz|io)/(#(F\!|\!)|folder/|file/)', IGNORE
 mediafire_regex = compile(r'https?://www\.mediafire\.com/', IGNORECASE)
 
 download_chunk_size = 4194304 # 4MB Chunks
+# A direct download that doesn't receive anything for this many seconds
+# is continued on another mirror (or the same one if there is no other)
+download_stall_timeout = 30
+max_download_failovers = 5
+# Testing mirrors: the amount of bytes to download and the max seconds to take
+mirror_probe_size = 262144
+mirror_probe_timeout = 3.0
 credentials = Credentials(sids)
 
 #=====================
@@ -59,6 +73,8 @@ class Download(ABC):
 	link: int
 	file: str
 	source: str
+	# The checksum of the downloaded file (sha256), if known
+	hash: str = None
 
 	@abstractmethod
 	def run(self) -> None:
@@ -75,13 +91,23 @@ class BaseDownload(Download):
 class DirectDownload(BaseDownload):
 	"""For downloading a file directly from a link
 	"""	
-	def __init__(self, link: str, filename_body: str, source: str):
+	def __init__(self,
+		link: str,
+		filename_body: str,
+		source: str,
+		mirrors: Union[List[str], None]=None,
+		_resolved: dict=None
+	):
 		"""Setup the direct download
 
 		Args:
 			link (str): The link (that leads to a file) that should be used
 			filename_body (str): The body of the filename to write to
 			source (str): The name of the source of the link
+			mirrors (List[str], optional): Other links (that lead to the same file)
+			to continue the download with when the link stalls. Defaults to None.
+			_resolved (dict, optional): Internal use only. The `extension` and `size`
+			of the file from an earlier request, so that the link isn't requested again. Defaults to None.
 
 		Raises:
 			LinkBroken: The link doesn't work
@@ -92,17 +118,29 @@ class DirectDownload(BaseDownload):
 		self.speed: float = 0.0
 		self.link = link
 		self.source = source
+		self.mirrors = mirrors or []
+		self.hash: str = None
+		self.__filename_body = filename_body.rstrip('.')
 
 		self.size: int = 0
-		r = get(self.link, stream=True)
-		r.close()
-		if not r.ok:
-			raise LinkBroken(1, blocklist_reasons[1])
-		self.__filename_body = filename_body.rstrip('.')
+		if _resolved is None:
+			r = get(self.link, stream=True)
+			r.close()
+			if not r.ok:
+				raise LinkBroken(1, blocklist_reasons[1])
+			extension = self.__extract_extension(
+				r.headers.get('Content-Type', ''),
+				r.headers.get('Content-Disposition', ''),
+				r.url
+			)
+			size = int(r.headers.get('content-length',-1))
+		else:
+			extension, size = _resolved['extension'], _resolved['size']
 
-		self.file = self.__build_filename(r)
+		self.extension = extension
+		self.file = self.__build_filename(extension)
 		self.title = splitext(basename(self.file))[0]
-		self.size = int(r.headers.get('content-length',-1))
+		self.size = size
 
 	def __extract_extension(self, content_type: str, content_disposition: str, url: str) -> str:
 		"""Find the extension of the file behind the link
@@ -129,50 +167,140 @@ class DirectDownload(BaseDownload):
 
 		return extension
 
-	def __build_filename(self, r) -> str:
+	def __build_filename(self, extension: str) -> str:
 		"""Build the filename from the download folder, filename body and extension
 
 		Args:
-			r (_type_): The request to the link
+			extension (str): The extension of the file, including the `.`
 
 		Returns:
 			str: The filename
 		"""		
 		folder = Settings().get_settings()['download_folder']
-		extension = self.__extract_extension(
-			r.headers.get('Content-Type', ''),
-			r.headers.get('Content-Disposition', ''),
-			r.url
-		)
 		return join(folder, self.__filename_body + extension)
 
 	def run(self) -> None:
-		"""Start the download
-		"""		
+		"""Start the download. When the download stalls or breaks, it's continued
+		on the next mirror (with a range request if the mirror supports it).
+
+		Raises:
+			requests.exceptions.RequestException: The download kept failing on all mirrors
+		"""
 		self.state = DOWNLOADING_STATE
 		size_downloaded = 0
+		speed_meter = SpeedMeter()
+		hasher = sha256()
+		links = [self.link] + self.mirrors
+		failovers = 0
+
+		# The file could be a hardlink to an imported file, so don't write into it
+		if isfile(self.file):
+			remove(self.file)
+
+		with open(self.file, 'wb') as f:
+			while True:
+				link = links[failovers % len(links)]
+				headers = {'Range': f'bytes={size_downloaded}-'} if size_downloaded else {}
+				try:
+					with get(
+						link,
+						headers=headers,
+						stream=True,
+						timeout=(download_stall_timeout, download_stall_timeout)
+					) as r:
+						r.raise_for_status()
+						if (r.status_code == 206
+						and self.size != -1
+						and not r.headers.get('Content-Range', '').endswith(f'/{self.size}')):
+							raise RequestException(f'Mirror offers a different file: {link}')
+
+						if size_downloaded and r.status_code != 206:
+							# Mirror doesn't support continuing, so start over
+							logging.debug(f'Restarting download from the start on {link}')
+							size_downloaded = 0
+							hasher = sha256()
+							f.seek(0)
+							f.truncate()
+
+						for chunk in r.iter_content(
+							chunk_size=bandwidth.chunk_size(self.source, download_chunk_size)
+						):
+							if self.state == CANCELED_STATE:
+								break
+
+							f.write(chunk)
+							hasher.update(chunk)
+
+							# Update progress
+							chunk_size = len(chunk)
+							size_downloaded += chunk_size
+							bandwidth.throttle(self.source, chunk_size)
+							self.speed = speed_meter.update(chunk_size)
+							if self.size == -1:
+								# Total size of file is not given so set progress to amount downloaded
+								self.progress = size_downloaded
+							else:
+								# Total size of file is given so calculate progress and speed
+								self.progress = round(size_downloaded / self.size * 100, 2)
 
-		with get(self.link, stream=True) as r:
-			with open(self.file, 'wb') as f:
-				start_time = perf_counter()
-				for chunk in r.iter_content(chunk_size=download_chunk_size):
-					if self.state == CANCELED_STATE:
-						break
+						if (self.state != CANCELED_STATE
+						and self.size != -1
+						and size_downloaded < self.size):
+							raise RequestException(f'Download ended early at {size_downloaded} of {self.size} bytes')
+					break
 
-					f.write(chunk)
+				except RequestException:
+					failovers += 1
+					if failovers > max_download_failovers:
+						raise
+					logging.warning(
+						f'Download stalled or failed on {link}, continuing at {size_downloaded} bytes on {links[failovers % len(links)]}'
+					)
 
-					# Update progress
-					chunk_size = len(chunk)
-					size_downloaded += chunk_size
-					self.speed = round(chunk_size / (perf_counter() - start_time), 2)
-					if self.size == -1:
-						# Total size of file is not given so set progress to amount downloaded
-						self.progress = size_downloaded
-					else:
-						# Total size of file is given so calculate progress and speed
-						self.progress = round(size_downloaded / self.size * 100, 2)
-					start_time = perf_counter()
+		self.hash = hasher.hexdigest()
+		return
+
+	def stop(self) -> None:
+		"""Interrupt the download
+		"""
+		self.state = CANCELED_STATE
+		return
+
+class PendingDownload(BaseDownload):
+	"""A download restored from the database, of which the link still has to be
+	resolved. That happens right before it's turn to download comes.
+	"""
+	def __init__(self, page_link: str, plan_entry: dict=None):
+		"""Setup the pending download
 
+		Args:
+			page_link (str): The link to the getcomics page
+			plan_entry (dict, optional): The download in the link cache. Defaults to None.
+		"""
+		super().__init__()
+		self.progress: float = 0.0
+		self.speed: float = 0.0
+		self.plan_entry = plan_entry
+
+		if plan_entry is None:
+			self.link = page_link
+			self.source = 'getcomics'
+			self.title = page_link
+			self.file = ''
+			self.size: int = 0
+		else:
+			self.link = plan_entry['pure_link']
+			self.source = plan_entry['source']
+			self.title = plan_entry['name'].rstrip('.')
+			self.file = join(
+				Settings().get_settings()['download_folder'],
+				self.title + plan_entry.get('extension', '')
+			)
+			self.size: int = plan_entry.get('size', 0)
+
+	def run(self) -> None:
+		"""Pending downloads are resolved by the download handler instead of run
+		"""
 		return
 
 	def stop(self) -> None:
@@ -186,6 +314,10 @@ class MegaDownload(BaseDownload):
 	def progress(self) -> float:
 		return self._mega.progress
 
+	@progress.setter
+	def progress(self, value: float) -> None:
+		self._mega.progress = value
+
 	@property
 	def speed(self) -> float:
 		return self._mega.speed
@@ -194,6 +326,10 @@ class MegaDownload(BaseDownload):
 	def size(self) -> int:
 		return self._mega.size
 
+	@property
+	def hash(self) -> str:
+		return self._mega.hash
+
 	def __init__(self, link: str, filename_body: str, source: str='mega'):
 		"""Setup the mega download
 
@@ -243,9 +379,20 @@ class MegaDownload(BaseDownload):
 		
 		Raises:
 			DownloadLimitReached: The Mega download limit is reached mid-download
+			DownloadCorrupt: The MAC of the downloaded file doesn't match
 		"""		
 		self.state = DOWNLOADING_STATE
-		self._mega.download_url(self.file)
+		# The file could be a hardlink to an imported file, so don't write into it
+		if isfile(self.file):
+			remove(self.file)
+		try:
+			self._mega.download_url(
+				self.file,
+				private_settings['mega_connections'],
+				lambda amount: bandwidth.throttle(self.source, amount)
+			)
+		except ValueError:
+			raise DownloadCorrupt(self.file, 'Mismatched MAC')
 
 	def stop(self) -> None:
 		"""Interrupt the download
@@ -492,6 +639,105 @@ def _process_extracted_get_comics_links(
 	logging.debug(f'Link paths: {link_paths}')
 	return link_paths
 
+def _probe_mirror(link: str) -> float:
+	"""Measure how fast a mirror is by downloading the start of the file
+
+	Args:
+		link (str): The (pure) link to the file on the mirror
+
+	Returns:
+		float: The estimated time in seconds to download `mirror_probe_size` bytes,
+		including the time to the first byte. `inf` if the mirror doesn't work.
+	"""
+	start = perf_counter()
+	first_byte = None
+	received = 0
+	try:
+		with get(
+			link,
+			headers={'Range': f'bytes=0-{mirror_probe_size - 1}'},
+			stream=True,
+			timeout=mirror_probe_timeout
+		) as r:
+			if not r.ok:
+				return inf
+
+			for chunk in r.iter_content(chunk_size=16384):
+				if first_byte is None:
+					first_byte = perf_counter() - start
+				received += len(chunk)
+				if (received >= mirror_probe_size
+				or perf_counter() - start >= mirror_probe_timeout):
+					break
+
+	except RequestException:
+		return inf
+
+	if not received:
+		return inf
+
+	elapsed = perf_counter() - start
+	if received >= mirror_probe_size or elapsed <= first_byte:
+		return elapsed
+	# Extrapolate the speed to the full probe size
+	return first_byte + (elapsed - first_byte) * mirror_probe_size / received
+
+def _fastest_mirror(links: List[str], name: str) -> Union[dict, None]:
+	"""Test all mirrors of a download at the same time and set up the download
+	on the fastest one, with the others as backup
+
+	Args:
+		links (List[str]): The links to the mirrors
+		name (str): The body of the filename to write to
+
+	Returns:
+		Union[dict, None]: The download (same format as the entries in the
+		output of `_test_paths()`) or `None` if no mirror works
+	"""
+	def test(link: str) -> Tuple[str, Union[dict, int], float]:
+		try:
+			pure_link = _purify_link(link)
+		except LinkBroken as lb:
+			return link, lb.reason_id, inf
+		except RequestException:
+			return link, None, inf
+		return link, pure_link, _probe_mirror(pure_link['link'])
+
+	with ThreadPoolExecutor(len(links), thread_name_prefix='Mirror Test') as executor:
+		results = list(executor.map(test, links))
+
+	working = []
+	for link, pure_link, duration in results:
+		if isinstance(pure_link, int):
+			add_to_blocklist(link, pure_link)
+		elif pure_link is not None:
+			working.append((duration, link, pure_link))
+	working.sort(key=lambda w: w[0])
+	logging.debug(f'Mirror test results: {[(w[1], w[0]) for w in working]}')
+
+	for index, (_, link, pure_link) in enumerate(working):
+		if pure_link['target'] is not DirectDownload:
+			continue
+		mirrors = [
+			w[2]['link']
+			for w in working[index + 1:]
+			if w[2]['target'] is DirectDownload
+			and w[0] != inf
+		]
+		try:
+			dl_instance = DirectDownload(
+				link=pure_link['link'],
+				filename_body=name,
+				source=pure_link['source'],
+				mirrors=mirrors
+			)
+		except LinkBroken as lb:
+			add_to_blocklist(link, lb.reason_id)
+		else:
+			return {'name': name, 'link': link, 'instance': dl_instance}
+
+	return None
+
 def _test_paths(
 	link_paths: List[List[Dict[str, dict]]],
 	volume_id: int
@@ -515,6 +761,7 @@ def _test_paths(
 	logging.debug('Testing paths')
 	limit_reached = False
 	downloads = []
+	race_mirrors = Settings().get_settings()['mirror_selection'] == 'fastest'
 	for path in link_paths:
 		for download in path:
 			# Generate name
@@ -534,7 +781,14 @@ def _test_paths(
 				name = generate_issue_name(volume_id, download['info']['issue_number'])
 
 			# Find working link
-			for links in download['links'].values():
+			for source, links in download['links'].items():
+				if race_mirrors and source != 'mega' and len(links) > 1:
+					race_result = _fastest_mirror(links, name)
+					if race_result is None:
+						continue
+					downloads.append(race_result)
+					break
+
 				for link in links:
 					try:
 						# Maybe make purify link async so that all links can be purified 'at the same time'?
@@ -568,6 +822,135 @@ def _test_paths(
 	logging.debug(f'Chosen links: {downloads}')
 	return downloads, limit_reached
 		
+#=====================
+# Link resolution cache
+#=====================
+def _cache_downloads(link: str, downloads: List[dict]) -> None:
+	"""Remember which downloads a getcomics page resolved to,
+	so that adding the page again doesn't require resolving it again.
+	Expired pages are removed from the cache at the same time.
+
+	Args:
+		link (str): The link to the getcomics page
+		downloads (List[dict]): The downloads (output of `_test_paths()`)
+	"""
+	plan = []
+	for download in downloads:
+		instance: Union[DirectDownload, MegaDownload] = download['instance']
+		entry = {
+			'name': download['name'],
+			'link': download['link'],
+			'pure_link': instance.link,
+			'source': instance.source
+		}
+		if isinstance(instance, MegaDownload):
+			entry['target'] = 'mega'
+		else:
+			entry.update({
+				'target': 'direct',
+				'mirrors': instance.mirrors,
+				'extension': instance.extension,
+				'size': instance.size
+			})
+		plan.append(entry)
+
+	cursor = get_db()
+	# Pages in the queue are kept, so that the queue can be restored from them
+	cursor.execute("""
+		DELETE FROM download_link_cache
+		WHERE
+			expires_at <= ?
+			AND NOT page_link IN (SELECT link FROM download_queue);
+		""",
+		(round(time()),)
+	)
+	cursor.execute("""
+		INSERT OR REPLACE INTO download_link_cache(page_link, plan, expires_at)
+		VALUES (?, ?, ?);
+		""",
+		(link, dumps(plan), round(time()) + private_settings['download_link_cache_ttl'])
+	)
+	return
+
+def _restore_download(entry: dict) -> Union[DirectDownload, MegaDownload]:
+	"""Set up a download from the cache
+
+	Args:
+		entry (dict): The download in the cache
+
+	Raises:
+		LinkBroken: The link is blocklisted or doesn't work anymore
+		DownloadLimitReached: The download limit of Mega is reached
+
+	Returns:
+		Union[DirectDownload, MegaDownload]: The download instance
+	"""
+	if blocklist_contains(entry['link']):
+		raise LinkBroken(1, blocklist_reasons[1])
+
+	if entry['target'] == 'mega':
+		# Mega links contain everything needed to download, but the
+		# download limit still has to be checked
+		return MegaDownload(
+			link=entry['pure_link'],
+			filename_body=entry['name'],
+			source=entry['source']
+		)
+
+	return DirectDownload(
+		link=entry['pure_link'],
+		filename_body=entry['name'],
+		source=entry['source'],
+		mirrors=entry['mirrors'],
+		_resolved=entry
+	)
+
+def _get_cached_downloads(link: str) -> Union[List[dict], None]:
+	"""Set up the downloads that a getcomics page resolved to earlier
+
+	Args:
+		link (str): The link to the getcomics page
+
+	Returns:
+		Union[List[dict], None]: The downloads (same format as the output of `_test_paths()`)
+		or `None` if the page isn't cached (anymore) or the cached links don't work anymore.
+	"""
+	plan = get_db().execute(
+		"SELECT plan FROM download_link_cache WHERE page_link = ? AND expires_at > ? LIMIT 1;",
+		(link, round(time()))
+	).fetchone()
+	if not plan:
+		return None
+
+	downloads = []
+	try:
+		for entry in loads(plan[0]):
+			downloads.append({
+				'name': entry['name'],
+				'link': entry['link'],
+				'instance': _restore_download(entry)
+			})
+
+	except (LinkBroken, DownloadLimitReached):
+		invalidate_link_cache(link)
+		return None
+
+	logging.debug(f'Using cached links for {link}: {downloads}')
+	return downloads
+
+def invalidate_link_cache(link: str) -> None:
+	"""Forget what a getcomics page resolved to
+
+	Args:
+		link (str): The link to the getcomics page
+	"""
+	logging.debug(f'Invalidating cached links of {link}')
+	get_db().execute(
+		"DELETE FROM download_link_cache WHERE page_link = ?;",
+		(link,)
+	)
+	return
+
 def _extract_download_links(link: str, volume_id: int, issue_id: int=None) -> Tuple[List[dict], bool]:
 	"""Filter, select and setup downloads from a getcomic page
 
@@ -588,6 +971,10 @@ def _extract_download_links(link: str, volume_id: int, issue_id: int=None) -> Tu
 	"""	
 	logging.debug(f'Extracting download links from {link} for volume {volume_id} and issue {issue_id}')
 
+	downloads = _get_cached_downloads(link)
+	if downloads:
+		return downloads, False
+
 	try:
 		r = get(link, headers={'user-agent': 'Kapowarr'}, stream=True)
 		if not r.ok:
@@ -617,7 +1004,10 @@ def _extract_download_links(link: str, volume_id: int, issue_id: int=None) -> Tu
 
 		# Decide which path to take by testing the links
 		# [{'name': 'Filename', 'link': 'link_on_getcomics_page', 'instance': Download_instance}]
-		return _test_paths(link_paths, volume_id)
+		downloads, limit_reached = _test_paths(link_paths, volume_id)
+		if downloads:
+			_cache_downloads(link, downloads)
+		return downloads, limit_reached
 
 	#else
 	# Link is a torrent file or magnet link
@@ -631,6 +1021,8 @@ class DownloadHandler:
 	"""Handles downloads
 	"""	
 	queue: List[dict] = []
+	# Downloads that are done and are being post processed
+	importing: List[dict] = []
 	
 	def __init__(self, context) -> None:
 		"""Setup the download handler
@@ -640,6 +1032,10 @@ class DownloadHandler:
 		"""		
 		self.context = context.app_context
 		self.load_download_thread = Thread(target=self.__load_downloads, name="Download Importer")
+		# Downloads can be added from multiple threads at the same time (e.g. tasks.SearchAll)
+		self.queue_lock = RLock()
+		# Imports are done on their own thread so that the next download can already start
+		self.import_executor = ThreadPoolExecutor(1, thread_name_prefix='Download Import')
 		return
 
 	def __run_download(self, download: dict) -> None:
@@ -651,35 +1047,113 @@ class DownloadHandler:
 		logging.info(f'Starting download: {download["id"]}')
 		
 		with self.context():
+			if (isinstance(download['instance'], PendingDownload)
+			and not self.__resolve_pending(download)):
+				event_hub.notify()
+				self._process_queue()
+				return
+
 			try:
 				download['instance'].run()
 			except DownloadLimitReached:
 				# Mega download limit reached mid-download
 				download['instance'].state == CANCELED_STATE
-				self.queue = [e for e in self.queue if not isinstance(e['instance'], MegaDownload)]
+				self.queue = [e for e in self.queue if e['instance'].source != 'mega']
+			except RequestException:
+				# Download kept failing, even on the mirrors
+				logging.exception(f'Download failed: {download["id"]}')
+				download['instance'].state = FAILED_STATE
+				invalidate_link_cache(download['original_link'])
+				with self.queue_lock:
+					self.queue.pop(0)
+				PostProcessing(download, self.queue).error()
+			except DownloadCorrupt:
+				download['instance'].state = FAILED_STATE
+				with self.queue_lock:
+					self.queue.pop(0)
+				self.__retry_corrupt(download, self.queue)
 			else:
 				if download['instance'].state == CANCELED_STATE:
 					PostProcessing(download, self.queue).short()
+					event_hub.notify()
 					return
 				# else
 				download['instance'].state = IMPORTING_STATE
-				PostProcessing(download, self.queue).full()
-			
-				self.queue.pop(0)
+				with self.queue_lock:
+					self.queue.pop(0)
+					self.importing.append(download)
+				self.import_executor.submit(self.__import_download, download)
+			event_hub.notify()
 			self._process_queue()
 			return
 
+	def __import_download(self, download: dict) -> None:
+		"""Post process a finished download. Intended to be run on the import thread.
+
+		Args:
+			download (dict): The download to import. One of the entries in self.importing.
+		"""
+		logging.info(f'Importing download: {download["id"]}')
+		with self.context():
+			try:
+				PostProcessing(download, self.importing + self.queue).full()
+			except DownloadCorrupt:
+				download['instance'].state = FAILED_STATE
+				self.__retry_corrupt(download, self.importing + self.queue)
+			except Exception:
+				logging.exception('An error occured while importing a download: ')
+			finally:
+				with self.queue_lock:
+					self.importing.remove(download)
+				event_hub.notify()
+		return
+
+	def __retry_corrupt(self, download: dict, queue: List[dict]) -> None:
+		"""Clean up a download that turned out to be corrupt, blocklist the
+		link and queue the same file again from the next working link on the page.
+
+		Args:
+			download (dict): The corrupt download
+			queue (List[dict]): The queue entries, to pass to the post processor
+		"""
+		# The database entry is only removed when no other download shares it
+		shared = any(
+			entry['db_id'] == download['db_id'] and entry['id'] != download['id']
+			for entry in queue
+		)
+		PostProcessing(download, queue).error()
+		add_to_blocklist(download['link'], 5)
+		invalidate_link_cache(download['original_link'])
+
+		link = download['original_link']
+		downloads, _ = _extract_download_links(
+			link, download['volume_id'], download['issue_id']
+		)
+		downloads = [d for d in downloads if d['name'] == download['name']]
+		if not downloads:
+			logging.warning(f'No other link found for corrupt download: {download["name"]}')
+			return
+
+		logging.info(f'Retrying corrupt download from other link: {download["name"]}')
+		self.__queue_downloads(
+			downloads, link, download['volume_id'], download['issue_id'],
+			download['db_id'] if shared else None
+		)
+		return
+
 	def _process_queue(self) -> None:
 		"""Handle the queue. In the case that there is something in the queue and it isn't already downloading,
 		start the download. This can safely be called multiple times while a download is going or while there is
 		nothing in the queue.
 		"""	
-		if not self.queue:
-			return
-		
-		first_entry = self.queue[0]
-		if first_entry['instance'].state == QUEUED_STATE:
-			first_entry['thread'].start()
+		with self.queue_lock:
+			if not self.queue:
+				return
+			
+			first_entry = self.queue[0]
+			if (first_entry['instance'].state == QUEUED_STATE
+			and first_entry['thread'].ident is None):
+				first_entry['thread'].start()
 		return
 
 	def __format_entry(self, d: dict) -> dict:
@@ -706,24 +1180,151 @@ class DownloadHandler:
 			'issue_id': d['issue_id']
 		}
 
+	def __make_entry(self,
+		download: dict,
+		link: str,
+		volume_id: int, issue_id: int,
+		db_id: int
+	) -> dict:
+		"""Turn a download into a queue entry
+
+		Args:
+			download (dict): The download (entry of the output of `_extract_download_links()`)
+			link (str): The getcomics link the download is from
+			volume_id (int): The id of the volume for which the download is intended
+			issue_id (int): The id of the issue for which the download is intended
+			db_id (int): The id of the download in the database
+
+		Returns:
+			dict: The queue entry
+		"""
+		download['original_link'] = link
+		download['volume_id'] = volume_id
+		download['issue_id'] = issue_id
+		entries = self.importing + self.queue
+		download['id'] = max(e['id'] for e in entries) + 1 if entries else 1
+		download['db_id'] = db_id
+		download['thread'] = Thread(target=self.__run_download, args=(download,), name="Download Handler")
+		return download
+
+	def __resolve_pending(self, download: dict) -> bool:
+		"""Resolve the link of a pending download. If the download isn't in
+		the link cache (anymore), the getcomics page is resolved again and the
+		pending downloads of the page are replaced with the result.
+
+		Args:
+			download (dict): The queue entry with the pending download
+
+		Returns:
+			bool: Wether the queue entry can now be run. If not, the queue
+			has been updated instead.
+		"""
+		pending: PendingDownload = download['instance']
+		if pending.plan_entry is not None:
+			try:
+				instance = _restore_download(pending.plan_entry)
+			except (LinkBroken, DownloadLimitReached):
+				invalidate_link_cache(download['original_link'])
+			except Exception:
+				logging.exception(f'Restoring download from cache failed: {download["id"]}')
+				invalidate_link_cache(download['original_link'])
+			else:
+				with self.queue_lock:
+					if not download in self.queue:
+						# Removed while resolving
+						return False
+					download['instance'] = instance
+				return True
+
+		link = download['original_link']
+		try:
+			downloads, limit_reached = _extract_download_links(
+				link, download['volume_id'], download['issue_id']
+			)
+		except Exception:
+			# The page could be fine, so don't blocklist it, but drop the
+			# download so that the rest of the queue isn't held up
+			logging.exception(f'Resolving pending download failed: {download["id"]}')
+			pending.state = FAILED_STATE
+			downloads, limit_reached = None, True
+
+		with self.queue_lock:
+			if not download in self.queue:
+				# Removed while resolving
+				return False
+
+			siblings = [e for e in self.queue if e['db_id'] == download['db_id']]
+			pending_siblings = [
+				e for e in siblings
+				if isinstance(e['instance'], PendingDownload)
+			]
+			resolved_names = [
+				e['name'] for e in siblings
+				if not e in pending_siblings
+			]
+			index = self.queue.index(download)
+			for entry in pending_siblings:
+				self.queue.remove(entry)
+
+			if not downloads:
+				if not limit_reached:
+					# No links extracted from page so add it to blocklist
+					add_to_blocklist(link, 3)
+				if downloads is not None:
+					logging.warning('Unable to extract download links from source')
+				if not resolved_names:
+					get_db().execute(
+						"DELETE FROM download_queue WHERE id = ?",
+						(download['db_id'],)
+					)
+				return False
+
+			for d in downloads:
+				if d['name'] in resolved_names:
+					continue
+				self.queue.insert(index, self.__make_entry(
+					d, link, download['volume_id'], download['issue_id'], download['db_id']
+				))
+				index += 1
+
+		return False
+
 	def __load_downloads(self) -> None:
-		"""Load downloads from the database and add them to the queue for re-downloading
+		"""Load downloads from the database and add them to the queue for re-downloading.
+		The downloads are added right away as pending downloads, with the info from the
+		link cache if available. Their links are resolved once it's their turn.
 		"""		
 		logging.debug('Loading downloads from database')
 		with self.context():
-			cursor2 = get_db('dict', temp=True)
-			cursor2.execute("""
+			rows = get_db('dict').execute("""
 				SELECT
-					id,
-					link,
-					volume_id, issue_id
-				FROM download_queue;
-			""")
-			cursor = get_db()
-			for download in cursor2:
-				logging.debug(f'Download from database: {dict(download)}')
-				self.add(download['link'], download['volume_id'], download['issue_id'], download['id'])
-				cursor.connection.commit()
+					dq.id,
+					dq.link,
+					dq.volume_id, dq.issue_id,
+					dlc.plan
+				FROM download_queue dq
+				LEFT JOIN download_link_cache dlc
+				ON dq.link = dlc.page_link
+				ORDER BY dq.id;
+			""").fetchall()
+
+			with self.queue_lock:
+				for row in rows:
+					logging.debug(f'Download from database: {dict(row)}')
+					plan = loads(row['plan']) if row['plan'] else [None]
+					for plan_entry in plan:
+						download = {
+							'name': plan_entry['name'] if plan_entry else None,
+							'link': plan_entry['link'] if plan_entry else row['link'],
+							'instance': PendingDownload(row['link'], plan_entry)
+						}
+						self.queue.append(self.__make_entry(
+							download, row['link'], row['volume_id'], row['issue_id'], row['id']
+						))
+
+		logging.info(f'Restored {len(rows)} downloads from the database')
+		event_hub.notify()
+		self._process_queue()
 		return
 
 	def add(self,
@@ -762,31 +1363,48 @@ class DownloadHandler:
 					)
 			return []
 
+		return self.__queue_downloads(
+			downloads, link, volume_id, issue_id, _download_db_id_override
+		)
+
+	def __queue_downloads(self,
+		downloads: List[dict],
+		link: str,
+		volume_id: int, issue_id: int,
+		db_id: int=None
+	) -> List[dict]:
+		"""Register downloads in the database and add them to the queue
+
+		Args:
+			downloads (List[dict]): The downloads (output of `_extract_download_links()`)
+			link (str): The getcomics link the downloads are from
+			volume_id (int): The id of the volume for which the downloads are intended
+			issue_id (int): The id of the issue for which the downloads are intended
+			db_id (int, optional): The id of the download in the database.
+			Defaults to None (registers a new one).
+
+		Returns:
+			List[dict]: Queue entries that were added
+		"""
 		result = []
-		with self.context():
+		with self.context(), self.queue_lock:
 			# Register download in database
-			if _download_db_id_override is None:
+			if db_id is None:
 				db_id = get_db().execute("""
 					INSERT INTO download_queue(link, volume_id, issue_id)
 					VALUES (?,?,?);
 					""",
 					(link, volume_id, issue_id)
 				).lastrowid
-			else:
-				db_id = _download_db_id_override
 
 			for download in downloads:
-				download['original_link'] = link
-				download['volume_id'] = volume_id
-				download['issue_id'] = issue_id
-				download['id'] = self.queue[-1]['id'] + 1 if self.queue else 1
-				download['db_id'] = db_id
-				download['thread'] = Thread(target=self.__run_download, args=(download,), name="Download Handler")
+				self.__make_entry(download, link, volume_id, issue_id, db_id)
 
 				# Add to queue
 				result.append(self.__format_entry(download))
 				self.queue.append(download)
 
+		event_hub.notify()
 		self._process_queue()
 		return result
 
@@ -797,6 +1415,7 @@ class DownloadHandler:
 		if self.queue:
 			self.queue[0]['instance'].stop()
 			self.queue[0]['thread'].join()
+		self.import_executor.shutdown(wait=True)
 		return
 
 	def get_all(self) -> List[dict]:
@@ -807,7 +1426,7 @@ class DownloadHandler:
 		"""		
 		result = list(map(
 			self.__format_entry,
-			self.queue
+			self.importing + self.queue
 		))
 		return result
 	
@@ -823,7 +1442,7 @@ class DownloadHandler:
 		Returns:
 			dict: The queue entry, formatted after self.__format_entry()
 		"""		
-		for entry in self.queue:
+		for entry in self.importing + self.queue:
 			if entry['id'] == download_id:
 				return self.__format_entry(entry)
 		raise DownloadNotFound
@@ -851,18 +1470,42 @@ class DownloadHandler:
 		else:
 			raise DownloadNotFound
 
+		event_hub.notify()
 		self._process_queue()
 		return
 	
 	def empty_download_folder(self) -> None:
 		"""Empty the temporary download folder of files that aren't being downloaded.
 		Handy in the case that a crash left half-downloaded files behind in the folder.
+		When downloads are imported by linking, the originals of completed downloads
+		are kept in the download folder on purpose, so those are not removed.
 		"""
 		logging.info(f'Emptying the temporary download folder')
-		folder = Settings().get_settings()['download_folder']
-		files_in_queue = [basename(download['instance'].file) for download in self.queue]
+		settings = Settings().get_settings()
+		folder = settings['download_folder']
+		files_in_queue = [basename(download['instance'].file) for download in self.importing + self.queue]
 		files_in_folder = listdir(folder)
 		ghost_files = [join(folder, f) for f in files_in_folder if not f in files_in_queue]
+
+		if settings['import_mode'] != 'move':
+			completed_titles = set(
+				t[0] for t in get_db().execute(
+					"SELECT DISTINCT title FROM download_history;"
+				)
+			)
+			originals = [
+				f for f in ghost_files
+				if isfile(f) and (
+					stat(f).st_nlink > 1
+					or splitext(basename(f))[0] in completed_titles
+				)
+			]
+			if originals:
+				logging.info(
+					f'Keeping {len(originals)} originals of imported downloads, as the import mode is {settings["import_mode"]}'
+				)
+				ghost_files = [f for f in ghost_files if not f in originals]
+
 		for f in ghost_files:
 			remove(f)
 		return
@@ -870,27 +1513,36 @@ class DownloadHandler:
 #=====================
 # Download History Managing
 #=====================
-def get_download_history(offset: int=0) -> List[dict]:
-	"""Get the download history in blocks of 50.
+def get_download_history(before: Tuple[int, int]=None, offset: int=0) -> List[dict]:
+	"""Get the download history in blocks of 50, newest first.
 
 	Args:
-		offset (int, optional): The offset of the list. The higher the number, the deeper into history you go. Defaults to 0.
+		before (Tuple[int, int], optional): The `downloaded_at` and `id` of the
+		last entry of the previous block, to get the block after it.
+		Defaults to None (first block).
+		offset (int, optional): Deprecated, use `before` instead. The number of
+		the block to get, when `before` isn't given. Defaults to 0.
 
 	Returns:
 		List[dict]: The history entries.
 	"""	
+	if before is None:
+		before = (maxsize, maxsize)
+	else:
+		offset = 0
 	result = list(map(
 		dict,
 		get_db('dict').execute(
 			"""
 			SELECT
-				original_link, title, downloaded_at
+				id, original_link, title, downloaded_at
 			FROM download_history
-			ORDER BY downloaded_at DESC
+			WHERE (downloaded_at, id) < (?, ?)
+			ORDER BY downloaded_at DESC, id DESC
 			LIMIT 50
 			OFFSET ?;
 			""",
-			(offset * 50,)
+			(*before, offset * 50)
 		)
 	))
 	return result
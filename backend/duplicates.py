@@ -0,0 +1,306 @@
+#-*- coding: utf-8 -*-
+
+"""This file contains functions regarding finding files with the same content.
+Files are first compared on a cheap hash of their size and the start and end
+of the file. Only the files that share that hash get hashed in full.
+"""
+
+import logging
+from hashlib import sha256
+from os import link, remove, replace, stat
+from os.path import basename, dirname, isfile, join
+from typing import Dict, List
+
+from backend.db import get_db
+
+# The amount of bytes of the start and end of a file that make up the sample hash
+sample_size = 65536
+# The amount of bytes read at once when hashing a complete file
+hash_block_size = 1048576
+
+def _sample_hash(filepath: str, size: int) -> str:
+	"""Hash the size, start and end of a file
+
+	Args:
+		filepath (str): The file to hash
+		size (int): The size of the file
+
+	Returns:
+		str: The hash
+	"""
+	hasher = sha256(str(size).encode())
+	with open(filepath, 'rb') as f:
+		hasher.update(f.read(sample_size))
+		if size > sample_size:
+			f.seek(max(sample_size, size - sample_size))
+			hasher.update(f.read(sample_size))
+	return hasher.hexdigest()
+
+def _full_hash(filepath: str) -> str:
+	"""Hash the complete content of a file
+
+	Args:
+		filepath (str): The file to hash
+
+	Returns:
+		str: The sha256 hash, the same as downloads get while downloading
+	"""
+	hasher = sha256()
+	with open(filepath, 'rb') as f:
+		for block in iter(lambda: f.read(hash_block_size), b''):
+			hasher.update(block)
+	return hasher.hexdigest()
+
+def _same_content(filepath_1: str, filepath_2: str) -> bool:
+	"""Compare the complete content of two files
+
+	Args:
+		filepath_1 (str): The first file
+		filepath_2 (str): The second file
+
+	Returns:
+		bool: Wether or not the files have the same content
+	"""
+	with open(filepath_1, 'rb') as f1, open(filepath_2, 'rb') as f2:
+		while True:
+			block_1 = f1.read(hash_block_size)
+			if block_1 != f2.read(hash_block_size):
+				return False
+			if not block_1:
+				return True
+
+def _volume_file_ids(volume_id: int) -> List[int]:
+	"""Get the ids of the files of a volume
+
+	Args:
+		volume_id (int): The id of the volume
+
+	Returns:
+		List[int]: The ids of the files
+	"""
+	return [f[0] for f in get_db().execute("""
+		SELECT DISTINCT if.file_id
+		FROM issues_files if
+		INNER JOIN issues i
+		ON if.issue_id = i.id
+		WHERE i.volume_id = ?;
+		""",
+		(volume_id,)
+	)]
+
+def hash_files(volume_id: int=None) -> None:
+	"""Update the hashes of the files. All files get a sample hash, which is
+	redone when the size of the file changed. Files that share a sample hash
+	with another file get hashed in full.
+
+	Args:
+		volume_id (int, optional): Only hash the files of this volume
+		(and the files they share a sample hash with). Defaults to None.
+	"""
+	cursor = get_db()
+	if volume_id is None:
+		logging.info('Hashing files')
+		file_ids = None
+	else:
+		logging.info(f'Hashing files for volume {volume_id}')
+		file_ids = set(_volume_file_ids(volume_id))
+
+	# 1. Sample hash of new and changed files
+	files = [
+		f for f in cursor.execute(
+			"SELECT id, filepath, size, sample_hash FROM files;"
+		).fetchall()
+		if file_ids is None or f[0] in file_ids
+	]
+	for file_id, filepath, size, sample_hash in files:
+		if not isfile(filepath):
+			continue
+
+		current_size = stat(filepath).st_size
+		if current_size == size and sample_hash is not None:
+			continue
+
+		cursor.execute("""
+			UPDATE files
+			SET
+				size = ?,
+				sample_hash = ?,
+				hash = CASE WHEN size = ? THEN hash ELSE NULL END
+			WHERE id = ?;
+			""",
+			(current_size, _sample_hash(filepath, current_size), current_size, file_id)
+		)
+		cursor.connection.commit()
+
+	# 2. Full hash of files that share a sample hash with another file
+	collisions = cursor.execute("""
+		SELECT f.id, f.filepath, f.size, f.sample_hash
+		FROM files f
+		INNER JOIN (
+			SELECT size, sample_hash
+			FROM files
+			WHERE sample_hash IS NOT NULL
+			GROUP BY size, sample_hash
+			HAVING COUNT(*) > 1
+		) c
+		ON
+			f.size = c.size
+			AND f.sample_hash = c.sample_hash
+		WHERE f.hash IS NULL;
+	""").fetchall()
+	if file_ids is not None:
+		# Only the collisions that involve a file of the volume
+		keys = set(
+			(f[1], f[2])
+			for f in cursor.execute(
+				"SELECT id, size, sample_hash FROM files;"
+			).fetchall()
+			if f[0] in file_ids
+		)
+		collisions = [c for c in collisions if (c[2], c[3]) in keys]
+
+	for file_id, filepath, _, _ in collisions:
+		if not isfile(filepath):
+			continue
+		cursor.execute(
+			"UPDATE files SET hash = ? WHERE id = ?;",
+			(_full_hash(filepath), file_id)
+		)
+		cursor.connection.commit()
+
+	return
+
+def get_duplicates(volume_id: int=None) -> List[dict]:
+	"""Get the groups of files that have the same content, based on the
+	hashes that are known. Run `hash_files()` first to update them.
+
+	Args:
+		volume_id (int, optional): Only get the groups that contain
+		a file of this volume. Defaults to None.
+
+	Returns:
+		List[dict]: The groups. `wasted_size` is the amount of bytes that
+		could be saved by hardlinking the files of the group together.
+	"""
+	cursor = get_db('dict')
+	files = cursor.execute("""
+		SELECT
+			f.id, f.filepath, f.size, f.hash,
+			i.id AS issue_id, i.volume_id
+		FROM files f
+		INNER JOIN (
+			SELECT hash
+			FROM files
+			WHERE hash IS NOT NULL
+			GROUP BY hash
+			HAVING COUNT(*) > 1
+		) d
+		ON f.hash = d.hash
+		LEFT JOIN issues_files if
+		ON f.id = if.file_id
+		LEFT JOIN issues i
+		ON if.issue_id = i.id
+		ORDER BY f.hash, f.id;
+	""").fetchall()
+
+	groups: Dict[str, dict] = {}
+	for f in files:
+		group = groups.setdefault(f['hash'], {
+			'hash': f['hash'],
+			'size': f['size'],
+			'wasted_size': 0,
+			'files': {}
+		})
+		entry = group['files'].setdefault(f['id'], {
+			'id': f['id'],
+			'filepath': f['filepath'],
+			'volume_ids': [],
+			'issue_ids': []
+		})
+		if f['issue_id'] is not None:
+			entry['issue_ids'].append(f['issue_id'])
+			if not f['volume_id'] in entry['volume_ids']:
+				entry['volume_ids'].append(f['volume_id'])
+
+	result = []
+	for group in groups.values():
+		group['files'] = list(group['files'].values())
+		if volume_id is not None and not any(
+			volume_id in f['volume_ids']
+			for f in group['files']
+		):
+			continue
+
+		# Files that are already hardlinked to each other don't waste space
+		inodes = set()
+		for f in group['files']:
+			try:
+				s = stat(f['filepath'])
+				inodes.add((s.st_dev, s.st_ino))
+			except OSError:
+				pass
+		group['wasted_size'] = group['size'] * max(len(inodes) - 1, 0)
+		result.append(group)
+
+	return result
+
+def link_duplicates(volume_id: int=None) -> int:
+	"""Replace files that have the same content as another file by a hardlink
+	to that file. The file that was added first is kept. Files on another
+	filesystem than the kept file are skipped. The content of both files is
+	compared right before linking, so files that changed since they were
+	hashed are skipped.
+
+	Args:
+		volume_id (int, optional): Only link the groups that contain
+		a file of this volume. Defaults to None.
+
+	Returns:
+		int: The amount of bytes that were freed
+	"""
+	freed = 0
+	for group in get_duplicates(volume_id):
+		original, *duplicates = group['files']
+		try:
+			original_stat = stat(original['filepath'])
+		except OSError:
+			continue
+		if original_stat.st_size != group['size']:
+			# Changed since it was hashed
+			continue
+
+		for duplicate in duplicates:
+			filepath = duplicate['filepath']
+			try:
+				duplicate_stat = stat(filepath)
+			except OSError:
+				continue
+			if (duplicate_stat.st_dev, duplicate_stat.st_ino) == (original_stat.st_dev, original_stat.st_ino):
+				continue
+			if duplicate_stat.st_dev != original_stat.st_dev:
+				logging.debug(f'Not linking duplicate on other filesystem: {filepath}')
+				continue
+			if duplicate_stat.st_size != group['size']:
+				continue
+			# The hashes could be outdated (e.g. a file edited
+			# without changing it's size), so check the content itself
+			try:
+				if not _same_content(original['filepath'], filepath):
+					logging.debug(f'Not linking file that changed since it was hashed: {filepath}')
+					continue
+			except OSError:
+				continue
+
+			logging.info(f'Replacing duplicate by hardlink: {filepath} -> {original["filepath"]}')
+			temp_path = join(dirname(filepath), f'.{basename(filepath)}.link')
+			try:
+				link(original['filepath'], temp_path)
+				replace(temp_path, filepath)
+			except OSError:
+				logging.exception(f'Failed to replace duplicate by hardlink: {filepath}')
+				if isfile(temp_path):
+					remove(temp_path)
+				continue
+			freed += group['size']
+
+	return freed
@@ -0,0 +1,167 @@
+#-*- coding: utf-8 -*-
+
+"""This file contains functions regarding pushing changes in the download queue
+and task queue to clients, instead of clients having to poll for them
+"""
+
+import logging
+from queue import Full, Queue
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Tuple
+
+from backend.custom_exceptions import TooManyEventStreams
+from backend.settings import private_settings
+
+
+class EventHub:
+	"""Keeps track of the state of the download queue and task queue and sends
+	the changes (deltas) to all subscribed clients. State changes are sent as soon
+	as a handler calls `notify()`. Changes that handlers don't notify about
+	(like download progress) are checked for once every `interval` seconds,
+	so they are throttled.
+	"""
+	interval = 1.0
+
+	def __init__(self) -> None:
+		# name -> function that returns the current state (list of entries with an 'id')
+		self.sources: Dict[str, Callable[[], List[dict]]] = {}
+		self.snapshots: Dict[str, Dict[int, dict]] = {}
+		self.clients: List[Queue] = []
+		self.lock = Lock()
+		self.wake = Event()
+		self.thread: Thread = None
+		return
+
+	def register(self, name: str, get_state: Callable[[], List[dict]]) -> None:
+		"""Register a state to keep track of
+
+		Args:
+			name (str): The name of the state. The events will be named `{name}_added`,
+			`{name}_changed` and `{name}_removed`. An added entry includes its
+			position in the state under `index`.
+			get_state (Callable[[], List[dict]]): Function that returns the current state
+		"""
+		self.sources[name] = get_state
+		return
+
+	def notify(self) -> None:
+		"""Signal that the state of something changed, so that the change is sent directly
+		"""
+		self.wake.set()
+		return
+
+	def __take_snapshot(self, name: str) -> Dict[int, dict]:
+		return {e['id']: e for e in self.sources[name]()}
+
+	def __diff(self, name: str) -> List[Tuple[str, dict]]:
+		"""Find the changes in a state since the last time it was checked
+
+		Args:
+			name (str): The name of the state
+
+		Returns:
+			List[Tuple[str, dict]]: The events describing the changes
+		"""
+		old = self.snapshots.get(name, {})
+		new = self.__take_snapshot(name)
+		self.snapshots[name] = new
+
+		events = []
+		for id in old:
+			if not id in new:
+				events.append((f'{name}_removed', {'id': id}))
+
+		for index, (id, entry) in enumerate(new.items()):
+			if not id in old:
+				events.append((f'{name}_added', {**entry, 'index': index}))
+				continue
+
+			changes = {
+				k: v
+				for k, v in entry.items()
+				if old[id].get(k) != v
+			}
+			if changes:
+				changes['id'] = id
+				events.append((f'{name}_changed', changes))
+		return events
+
+	def __run(self) -> None:
+		"""Send changes to the clients for as long as there are clients
+		"""
+		while True:
+			self.wake.wait(self.interval)
+			self.wake.clear()
+			with self.lock:
+				if not self.clients:
+					self.thread = None
+					return
+
+				try:
+					events = [e for name in self.sources for e in self.__diff(name)]
+				except Exception:
+					logging.exception('An error occured while checking for changes to send: ')
+					continue
+
+				for client in self.clients:
+					try:
+						for event in events:
+							client.put_nowait(event)
+					except Full:
+						# The client can't keep up, so replace the events
+						# that it hasn't received yet by the complete state
+						self.__reset_client(client)
+
+	def __reset_client(self, client: Queue) -> None:
+		"""Replace the events in the queue of a client by the current state
+		(one `{name}_state` event per state)
+
+		Args:
+			client (Queue): The queue of the client
+		"""
+		with client.mutex:
+			client.queue.clear()
+		for name in self.sources:
+			client.put_nowait((f'{name}_state', list(self.snapshots[name].values())))
+		return
+
+	def subscribe(self) -> Queue:
+		"""Start receiving changes. The first events are the complete current state
+		(one `{name}_state` event per state).
+
+		Raises:
+			TooManyEventStreams: The maximum amount of clients is reached
+
+		Returns:
+			Queue: The queue in which the events (`(event_name, data)`) will be put
+		"""
+		with self.lock:
+			if len(self.clients) >= private_settings['max_event_streams']:
+				raise TooManyEventStreams
+
+			client = Queue(private_settings['event_queue_size'])
+			if self.thread is None:
+				# Nobody was keeping the snapshots up to date
+				for name in self.sources:
+					self.snapshots[name] = self.__take_snapshot(name)
+			self.__reset_client(client)
+			self.clients.append(client)
+
+			if self.thread is None:
+				self.thread = Thread(target=self.__run, name='Event Hub', daemon=True)
+				self.thread.start()
+		return client
+
+	def unsubscribe(self, client: Queue) -> None:
+		"""Stop receiving changes
+
+		Args:
+			client (Queue): The queue that was returned by `subscribe()`
+		"""
+		with self.lock:
+			if client in self.clients:
+				self.clients.remove(client)
+		self.notify()
+		return
+
+event_hub = EventHub()
@@ -8,16 +8,39 @@ extract_filename_data is inspired by the file parsing of Kavita and Comictagger:
 """
 
 import logging
-from os import listdir, makedirs, scandir, stat
-from os.path import (abspath, basename, dirname, isdir, join, relpath,
-                     samefile, splitext)
+from errno import EEXIST, EXDEV
+from json import dumps
+from os import (O_CREAT, O_RDONLY, O_TRUNC, O_WRONLY, close, fstat, fsync,
+                link, listdir, makedirs, read, remove, replace, scandir, stat,
+                walk, write)
+from os import open as os_open
+from os.path import (abspath, basename, dirname, exists, isdir, isfile,
+                     join, relpath, samefile, splitext)
 from re import IGNORECASE, compile
-from shutil import move, rmtree
-from typing import List, Tuple, Union
+from shutil import copystat, rmtree
+from typing import Callable, List, Tuple, Union
 from urllib.parse import unquote
 
 from backend.db import get_db
 from backend.root_folders import RootFolders
+from backend.wanted import update_wanted
+
+try:
+	from os import O_BINARY
+except ImportError:
+	O_BINARY = 0
+try:
+	from os import copy_file_range
+except ImportError:
+	copy_file_range = None
+try:
+	from os import sendfile
+except ImportError:
+	sendfile = None
+try:
+	from fcntl import ioctl
+except ImportError:
+	ioctl = None
 
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
 alphabet = {letter: str(alphabet.index(letter) + 1).zfill(2) for letter in alphabet}
@@ -28,6 +51,8 @@ file_extensions = r'\.(' + '|'.join(e[1:] for e in supported_extensions) + r')$'
 volume_regex_snippet = r'\b(?:v(?:ol|olume)?)(?:\.\s|[\.\-\s])?(\d+|I{1,3})\b'
 year_regex_snippet = r'(?:(\d{4})(?:-\d{2}){0,2}|(\d{4})[\s\.]?-[\s\.]?\d{4}|(?:\d{2}-){1,2}(\d{4})|(\d{4})[\s\.\-]Edition|(\d{4})-\d{4}\s{3}\d{4})'
 issue_regex_snippet = r'(?!\d+(?:th|rd|st))\d+(?:\.\d{1,2}|\w{1,2}|[\s\-\.]?½)?'
+copy_chunk_size = 16777216 # 16MB Chunks
+FICLONE = 0x40049409 # ioctl request for making a reflink
 
 # Cleaning the filename
 strip_filename_regex = compile(r'\(.*?\)|\[.*?\]|\{.*?\}', IGNORECASE)
@@ -351,13 +376,15 @@ def _add_file(filepath: str) -> int:
 	).fetchone()[0]
 	return file_id
 
-def scan_files(volume_data: dict) -> None:
-	"""Scan inside the volume folder for files and map them to issues
+def _map_volume_files(volume_data: dict) -> List[List[int]]:
+	"""Find the files inside a volume folder and the issues that they cover
 
 	Args:
 		volume_data (dict): The output from volumes.Volume().get_info().
-	"""	
-	logging.debug(f'Scanning for files for {volume_data["id"]}')
+
+	Returns:
+		List[List[int]]: The file id and issue id pairs
+	"""
 	cursor = get_db()
 
 	if not isdir(volume_data['folder']):
@@ -418,7 +445,29 @@ def scan_files(volume_data: dict) -> None:
 					file_id = _add_file(file)
 					file_to_issue_map.append([file_id, issue_id[0]])
 
-	# Delete all file bindings for the volume
+	return file_to_issue_map
+
+def scan_files(volume_data: Union[dict, List[dict]]) -> None:
+	"""Scan inside the volume folder for files and map them to issues
+
+	Args:
+		volume_data (Union[dict, List[dict]]): The output from volumes.Volume().get_info().
+		Give a list of them to scan multiple volumes in one go.
+	"""
+	if isinstance(volume_data, dict):
+		volume_data = [volume_data]
+	if not volume_data:
+		return
+
+	volume_ids = [v['id'] for v in volume_data]
+	logging.debug(f'Scanning for files for {volume_ids}')
+	cursor = get_db()
+
+	file_to_issue_map = []
+	for volume in volume_data:
+		file_to_issue_map += _map_volume_files(volume)
+
+	# Delete all file bindings for the volumes
 	cursor.execute("""
 		DELETE FROM issues_files
 		WHERE rowid IN (
@@ -426,10 +475,10 @@ def scan_files(volume_data: dict) -> None:
 			FROM issues_files if
 			INNER JOIN issues i
 			ON i.id = if.issue_id
-			WHERE i.volume_id = ?
+			WHERE i.volume_id IN (SELECT value FROM json_each(?))
 		);
 		""",
-		(volume_data['id'],)
+		(dumps(volume_ids),)
 	)
 
 	if file_to_issue_map:
@@ -452,6 +501,8 @@ def scan_files(volume_data: dict) -> None:
 		);
 	""")
 
+	update_wanted(volume_ids)
+
 	return
 
 def create_volume_folder(root_folder: str, volume_id: int) -> str:
@@ -498,7 +549,7 @@ def move_volume_folder(folder: str, root_folder: str, new_root_folder: str) -> s
 	logging.info(f'Moving volume folder {folder} to {new_folder}')
 	
 	# Create and move to new folder
-	move(folder, new_folder)
+	move_folder(folder, new_folder)
 
 	return new_folder
 
@@ -550,5 +601,225 @@ def rename_file(before: str, after: str) -> None:
 	makedirs(dirname(after), exist_ok=True)
 	
 	# Move file into folder
-	move(before, after)
+	move_file(before, after)
+	return
+
+#=====================
+# Moving
+#=====================
+def _copy_file_data(
+	source_fd: int,
+	dest_fd: int,
+	progress: Callable[[float], None]=None
+) -> None:
+	"""Copy the contents of one file to another, letting the kernel do the copying
+	when possible (`copy_file_range` or `sendfile`) instead of reading the data into python.
+
+	Args:
+		source_fd (int): The file descriptor of the file to copy from
+		dest_fd (int): The file descriptor of the file to copy to
+		progress (Callable[[float], None], optional): Called with the percentage copied
+		after each chunk. Defaults to None.
+	"""
+	methods = [
+		m for m, f in (
+			('copy_file_range', copy_file_range),
+			('sendfile', sendfile),
+			('readwrite', write)
+		)
+		if f is not None
+	]
+
+	size = fstat(source_fd).st_size
+	copied = 0
+	while copied < size:
+		count = min(copy_chunk_size, size - copied)
+		try:
+			if methods[0] == 'copy_file_range':
+				written = copy_file_range(source_fd, dest_fd, count)
+			elif methods[0] == 'sendfile':
+				written = sendfile(dest_fd, source_fd, None, count)
+			else:
+				data = memoryview(read(source_fd, count))
+				written = 0
+				# A write can be short, so write until the whole chunk is written
+				while written < len(data):
+					written += write(dest_fd, data[written:])
+		except OSError:
+			if copied or len(methods) == 1:
+				raise
+			# Method not supported by OS or filesystem so try next one
+			methods.pop(0)
+			continue
+
+		if not written:
+			# File got shorter while copying
+			break
+		copied += written
+		if progress is not None:
+			progress(round(copied / size * 100, 2))
+	return
+
+def copy_file(
+	before: str,
+	after: str,
+	sync: bool=False,
+	progress: Callable[[float], None]=None
+) -> None:
+	"""Copy a file, replacing the destination if it already exists.
+	The data is copied by the kernel when possible.
+
+	Args:
+		before (str): The filepath of the file to copy
+		after (str): The filepath of the copy
+		sync (bool, optional): Make sure the data is written to the disk before returning. Defaults to False.
+		progress (Callable[[float], None], optional): Called with the percentage copied. Defaults to None.
+	"""
+	logging.debug(f'Copying file: {before} -> {after}')
+	source_fd = os_open(before, O_RDONLY | O_BINARY)
+	try:
+		dest_fd = os_open(after, O_WRONLY | O_CREAT | O_TRUNC | O_BINARY, 0o644)
+		try:
+			_copy_file_data(source_fd, dest_fd, progress)
+			if sync:
+				fsync(dest_fd)
+		except BaseException:
+			close(dest_fd)
+			remove(after)
+			raise
+		close(dest_fd)
+	finally:
+		close(source_fd)
+
+	copystat(before, after)
+	return
+
+def move_file(
+	before: str,
+	after: str,
+	sync: bool=False,
+	progress: Callable[[float], None]=None
+) -> None:
+	"""Move a file, replacing the destination if it already exists.
+	On the same filesystem this is a rename, otherwise the data is copied
+	by the kernel and the original is deleted afterwards.
+
+	Args:
+		before (str): The current filepath of the file
+		after (str): The new desired filepath of the file
+		sync (bool, optional): Make sure the data is written to the disk before deleting the original,
+		when the file has to be copied. Defaults to False.
+		progress (Callable[[float], None], optional): Called with the percentage copied
+		when the file has to be copied. Defaults to None.
+	"""
+	try:
+		replace(before, after)
+		return
+	except OSError as e:
+		if e.errno != EXDEV:
+			raise
+
+	# Different filesystems so copy data
+	copy_file(before, after, sync, progress)
+	remove(before)
+	return
+
+def link_file(
+	before: str,
+	after: str,
+	reflink: bool=False,
+	sync: bool=False,
+	progress: Callable[[float], None]=None
+) -> None:
+	"""Make the file also available at another location, without
+	duplicating the data if possible. The original file is kept.
+	When the file can't be linked (e.g. different filesystems), it is copied.
+
+	Args:
+		before (str): The filepath of the file
+		after (str): The filepath where the file should also be available
+		reflink (bool, optional): Make a reflink (copy-on-write clone, btrfs/XFS)
+		instead of a hardlink. Defaults to False.
+		sync (bool, optional): Make sure the data is written to the disk when the file has to be copied.
+		Defaults to False.
+		progress (Callable[[float], None], optional): Called with the percentage copied
+		when the file has to be copied. Defaults to None.
+	"""
+	if exists(after) and samefile(before, after):
+		# Already available at the location
+		return
+
+	# Build the link next to the destination and then put it in place, so that
+	# the file currently at the destination is only replaced once it succeeded
+	temp_path = join(dirname(after), f'.{basename(after)}.link')
+	if isfile(temp_path):
+		remove(temp_path)
+
+	try:
+		if not reflink:
+			link(before, temp_path)
+			replace(temp_path, after)
+			return
+
+		if ioctl is not None:
+			source_fd = os_open(before, O_RDONLY)
+			try:
+				dest_fd = os_open(temp_path, O_WRONLY | O_CREAT | O_TRUNC, 0o644)
+				try:
+					ioctl(dest_fd, FICLONE, source_fd)
+				except OSError:
+					close(dest_fd)
+					remove(temp_path)
+					raise
+				close(dest_fd)
+			finally:
+				close(source_fd)
+			copystat(before, temp_path)
+			replace(temp_path, after)
+			return
+
+	except OSError:
+		if isfile(temp_path):
+			remove(temp_path)
+
+	# Filesystem doesn't support linking (between these locations)
+	logging.debug(f'Linking {before} to {after} not possible, copying instead')
+	copy_file(before, temp_path, sync, progress)
+	replace(temp_path, after)
+	return
+
+def move_folder(before: str, after: str) -> None:
+	"""Move a folder including it's contents. On the same filesystem this
+	is a rename, otherwise the files are moved one by one using `files.move_file()`.
+	When the new folder already exists and isn't empty, the contents are merged into it.
+
+	Args:
+		before (str): The current path of the folder
+		after (str): The new desired path of the folder
+
+	Raises:
+		FileExistsError: The new folder already contains a file with the
+		same path as a file in the folder. Nothing is moved in that case.
+	"""
+	makedirs(dirname(after), exist_ok=True)
+	if isdir(after) and listdir(after):
+		for folder, _, files in walk(before):
+			for f in files:
+				dest = join(after, relpath(folder, before), f)
+				if isfile(dest):
+					raise FileExistsError(EEXIST, 'File already exists in destination folder', dest)
+	else:
+		try:
+			replace(before, after)
+			return
+		except OSError as e:
+			if e.errno != EXDEV:
+				raise
+
+	for folder, _, files in walk(before):
+		dest_folder = join(after, relpath(folder, before))
+		makedirs(dest_folder, exist_ok=True)
+		for f in files:
+			move_file(join(folder, f), join(dest_folder, f))
+	rmtree(before, ignore_errors=True)
 	return
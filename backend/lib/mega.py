@@ -21,27 +21,39 @@ DIFFERENCES:
 		file being downloaded directly in target directory
 		4. Rewritten some code to either make it more modern or reduce imports
 		5. Made imports more specific
+		6. Download the file in segments over multiple connections at the
+		same time, with decrypting and calculating the chunk MACs happening
+		in the worker pool and the chunk MACs being combined in order
+		7. Sessions (and master keys) are logged in once per credential and
+		reused until they expire, and connections to the API are reused
+		8. A sha256 checksum of the decrypted file is calculated while
+		downloading, in the same ordered step as combining the chunk MACs
 """
 
 from base64 import b64decode, b64encode
 from binascii import hexlify, unhexlify
 from codecs import latin_1_decode, latin_1_encode
-from hashlib import pbkdf2_hmac
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from hashlib import pbkdf2_hmac, sha256
 from json import dumps, loads
 import logging
 from math import ceil
 from random import randint
 from re import findall, search
 from struct import pack, unpack
-from time import perf_counter, time
+from threading import Lock, local
+from time import time
+from typing import Callable, Dict, List, Tuple, Union
 
 from Crypto.Cipher import AES
 from Crypto.PublicKey import RSA
 from Crypto.Util import Counter
-from requests import get, post
+from requests import Session
 from simplejson.errors import JSONDecodeError
 from tenacity import retry, retry_if_exception_type, wait_exponential
 
+from backend.bandwidth import SpeedMeter
 from backend.custom_exceptions import DownloadLimitReached
 
 _CODE_TO_DESCRIPTIONS = {
@@ -102,6 +114,8 @@ class RequestError(Exception):
 
 
 EMPTY_IV = b'\0' * 16
+# The amount of bytes downloaded with one request
+SEGMENT_SIZE = 0x400000
 
 def makebyte(x):
 	return latin_1_encode(x)[0]
@@ -231,13 +245,59 @@ def get_chunks(size: int):
 	yield size - p
 
 
+def _get_segments(size: int) -> List[List[Tuple[int, int]]]:
+	"""Group the chunks of a file into segments of (at least) `SEGMENT_SIZE`
+	bytes, that are each downloaded with one request
+
+	Args:
+		size (int): The size of the file
+
+	Returns:
+		List[List[Tuple[int, int]]]: The offset and size of each chunk, per segment
+	"""
+	segments = [[]]
+	segment_size = offset = 0
+	for chunk_size in get_chunks(size):
+		if segment_size >= SEGMENT_SIZE:
+			segments.append([])
+			segment_size = 0
+		segments[-1].append((offset, chunk_size))
+		segment_size += chunk_size
+		offset += chunk_size
+	return segments
+
+
+def _chunk_mac(k_str: bytes, iv_str: bytes, chunk: bytes) -> bytes:
+	encryptor = AES.new(k_str, AES.MODE_CBC, iv_str)
+	mv = memoryview(chunk)
+	modchunk = len(chunk) % 16
+	if not modchunk:
+		modchunk = 16
+		last_block = chunk[-modchunk:]
+	else:
+		last_block = chunk[-modchunk:] + (b'\0' * (16 - modchunk))
+
+	encryptor.encrypt(mv[:-modchunk])
+	return encryptor.encrypt(last_block)
+
+
 def decrypt_attr(attr, key):
 	attr = aes_cbc_decrypt(attr, a32_to_str(key))
 	attr = makestring(attr)
 	attr = attr.rstrip('\0')
 	return loads(attr[4:]) if attr[:6] == 'MEGA{"' else False
 
-sids = {}
+# Logged in sessions per credential (email, or -1 for anonymous):
+# (sid, master key, time after which the session is logged in again)
+sids: Dict[Union[str, int], Tuple[str, list, float]] = {}
+sids_lock = Lock()
+# Seconds after which a session is logged in again
+USER_SESSION_LIFETIME = 86400
+ANONYMOUS_SESSION_LIFETIME = 3600
+
+# Connections to the API are reused by all instances
+api_session = Session()
+
 class Mega:
 	def __init__(self, url: str, email: str=None, password: str=None, only_check_login: bool=False):
 		self.downloading: bool = False
@@ -252,46 +312,26 @@ class Mega:
 		self.sid = None
 		self.sequence_num = randint(0, 0xFFFFFFFF)
 
-		logged_in = False
-		try:
-			if email is not None:
-				if not email in sids or only_check_login:
-					# No sid fetched for user yet
-					self._login_user(email, password)
-					sids.update({email: (self.sid, None)})
-				self.sid = sids[email][0]
-				if only_check_login:
-					return
-				logged_in = True
-		except JSONDecodeError:
-			logging.error('Login credentials for mega are invalid. Login failed.')
-			raise RequestError(-16)
-		if not logged_in:
+		if only_check_login:
 			try:
-				if not -1 in sids:
-					# No sid fetched for user yet
-					# Make it "expire" after an hour
-					self.login_anonymous()
-					sids.update({-1: (self.sid, time() + 3600)})
-				expire_time = sids[-1][1]
-				if expire_time <= time():
-					# Current sid is "expired"
-					self.login_anonymous()
-					sids.update({-1: (self.sid, time() + 3600)})
-				self.sid = sids[-1][0]
-					
+				self._login_user(email, password)
 			except JSONDecodeError:
+				logging.error('Login credentials for mega are invalid. Login failed.')
 				raise RequestError(-16)
-		
+			with sids_lock:
+				sids[email] = (self.sid, self.master_key, time() + USER_SESSION_LIFETIME)
+			return
+
 		self.file_id, file_key = self._parse_url(url).split('!')
+		self._use_session(email, password)
 		try:
-			file_data = self._api_request({
-				'a': 'g',
-				'g': 1,
-				'p': self.file_id
-			})
-		except JSONDecodeError:
-			raise RequestError(-18)
+			file_data = self._get_file_data(url)
+		except RequestError as e:
+			if e.code != -15:
+				raise
+			# Session expired early, log in again
+			self._use_session(email, password, expired_sid=self.sid)
+			file_data = self._get_file_data(url)
 
 		# Seems to happens sometime... When this occurs, files are
 		# inaccessible also in the official also in the official web app.
@@ -300,8 +340,9 @@ class Mega:
 			raise RequestError('File not accessible anymore')
 
 		self.size = file_data['s']
+		self.hash: Union[str, None] = None
 
-		r = get(file_data['g'], stream=True)
+		r = api_session.get(file_data['g'], stream=True)
 		r.close()
 		if r.status_code == 509:
 			# Download limit reached
@@ -317,6 +358,50 @@ class Mega:
 		attribs = decrypt_attr(attribs, self.k)
 		self.mega_filename = attribs.get('n', '')
 
+	def _use_session(self, email: str=None, password: str=None, expired_sid: str=None) -> None:
+		"""Use the logged in session of the credential, logging in first
+		if there isn't one yet or if it's expired. Only one instance logs in
+		at a time, so that many downloads added at once result in one login.
+
+		Args:
+			email (str, optional): The email of the account. Defaults to None (anonymous).
+			password (str, optional): The password of the account. Defaults to None.
+			expired_sid (str, optional): A sid that Mega rejected. If it's still the session of the credential, log in again. Defaults to None.
+
+		Raises:
+			RequestError: Logging in failed
+		"""
+		key = email if email is not None else -1
+		with sids_lock:
+			if (not key in sids
+			or sids[key][2] <= time()
+			or sids[key][0] == expired_sid):
+				try:
+					if email is not None:
+						self._login_user(email, password)
+						lifetime = USER_SESSION_LIFETIME
+					else:
+						self.login_anonymous()
+						lifetime = ANONYMOUS_SESSION_LIFETIME
+				except JSONDecodeError:
+					if email is not None:
+						logging.error('Login credentials for mega are invalid. Login failed.')
+					raise RequestError(-16)
+				sids[key] = (self.sid, self.master_key, time() + lifetime)
+
+			self.sid, self.master_key = sids[key][:2]
+		return
+
+	def _get_file_data(self, url: str) -> dict:
+		try:
+			return self._api_request({
+				'a': 'g',
+				'g': 1,
+				'p': self.file_id
+			})
+		except JSONDecodeError:
+			raise RequestError(-18)
+
 	def _login_user(self, email: str, password: str):
 		logging.debug('Logging into Mega with user account')
 		email = email.lower()
@@ -430,7 +515,7 @@ class Mega:
 			data = [data]
 
 		url = f'{self.schema}://g.api.{self.domain}/cs'
-		json_resp = post(
+		json_resp = api_session.post(
 			url,
 			params=params,
 			data=dumps(data),
@@ -470,61 +555,158 @@ class Mega:
 		else:
 			raise RequestError('Url key missing')
 
-	def download_url(self, filename: str):
-		self.downloading = True
+	def _fetch_segment(self, url: str, segment: List[Tuple[int, int]]) -> List[Tuple[int, bytes, bytes]]:
+		"""Download, decrypt and MAC a range of chunks, over the connection of
+		the current thread. Runs inside the worker pool.
 
-		url = self._api_request({
-			'a': 'g',
-			'g': 1,
-			'p': self.file_id
-		})['g']
+		Args:
+			url (str): The download url of the file
+			segment (List[Tuple[int, int]]): The offset and size of each chunk in the range
+
+		Raises:
+			DownloadLimitReached: The Mega download limit is reached mid-download
+
+		Returns:
+			List[Tuple[int, bytes, bytes]]: The offset, decrypted data and MAC of each chunk
+		"""
+		ssn = getattr(self._connections, 'session', None)
+		if ssn is None:
+			ssn = self._connections.session = Session()
+			self._sessions.append(ssn)
 
-		r = get(url, stream=True).raw
-		size_downloaded = 0
-		with open(filename, 'wb') as f:
-			k_str = a32_to_str(self.k)
-			counter = Counter.new(128,
-								  initial_value=((self.iv[0] << 32) + self.iv[1]) << 64)
-			aes = AES.new(k_str, AES.MODE_CTR, counter=counter)
-
-			mac_bytes = EMPTY_IV
-			mac_encryptor = AES.new(k_str, AES.MODE_CBC,
-									mac_bytes)
-			iv_str = a32_to_str([self.iv[0], self.iv[1], self.iv[0], self.iv[1]])
-
-			start_time = perf_counter()
-			for chunk_size in get_chunks(self.size):
+		first, last = segment[0][0], segment[-1][0] + segment[-1][1] - 1
+		r = ssn.get(f'{url}/{first}-{last}', stream=True, timeout=self.timeout)
+		try:
+			if r.status_code == 509:
+				raise DownloadLimitReached('mega')
+
+			# One cipher for the whole range, starting at the counter of the
+			# first chunk (every chunk starts on a 16 byte boundary)
+			aes = AES.new(self._k_str, AES.MODE_CTR, counter=Counter.new(
+				128, initial_value=self._ctr_base + first // 16
+			))
+			result = []
+			for offset, chunk_size in segment:
 				if not self.downloading:
 					break
 
-				chunk = r.read(chunk_size)
-				if not chunk:
+				chunk = r.raw.read(chunk_size)
+				if len(chunk) != chunk_size:
 					# Download limit reached mid download
 					raise DownloadLimitReached('mega')
 
+				if self._throttle is not None:
+					self._throttle(chunk_size)
+
 				chunk = aes.decrypt(chunk)
-				f.write(chunk)
-
-				encryptor = AES.new(k_str, AES.MODE_CBC, iv_str)
-
-				mv = memoryview(chunk)
-				chunk_length = len(chunk)
-				modchunk = chunk_length % 16
-				if not modchunk:
-					modchunk = 16
-					last_block = chunk[-modchunk:]
-				else:
-					last_block = chunk[-modchunk:] + (b'\0' * (16 - modchunk))
-				rest_of_chunk = mv[:-modchunk]
-				
-				encryptor.encrypt(rest_of_chunk)
-				input_to_mac = encryptor.encrypt(last_block)
-				mac_bytes = mac_encryptor.encrypt(input_to_mac)
-
-				size_downloaded += chunk_length
-				self.speed = round(chunk_length / (perf_counter() - start_time), 2)
-				self.progress = round(size_downloaded / self.size * 100, 2)
-				start_time = perf_counter()
+				result.append((offset, chunk, _chunk_mac(self._k_str, self._mac_iv, chunk)))
+				with self._progress_lock:
+					self._size_downloaded += chunk_size
+		finally:
+			r.close()
+		return result
+
+	def download_url(
+		self,
+		filename: str,
+		connections: int=1,
+		throttle: Callable[[int], None]=None
+	):
+		"""Download the file. The file is split into segments of multiple chunks,
+		that are downloaded over multiple connections at the same time.
+		Decrypting and calculating the MAC of each chunk happens in the same
+		worker pool, after which the chunk MACs are combined in order.
+
+		Args:
+			filename (str): The file to download to
+			connections (int, optional): The amount of connections to use. Defaults to 1.
+			throttle (Callable[[int], None], optional): Called with the size of every
+			downloaded chunk, and can wait to limit the speed. Defaults to None.
+
+		Raises:
+			DownloadLimitReached: The Mega download limit is reached mid-download
+			ValueError: The MAC of the downloaded file doesn't match
+		"""
+		self.downloading = True
+
+		url = self._api_request({
+			'a': 'g',
+			'g': 1,
+			'p': self.file_id
+		})['g']
+
+		self._k_str = a32_to_str(self.k)
+		self._ctr_base = ((self.iv[0] << 32) + self.iv[1]) << 64
+		self._mac_iv = a32_to_str([self.iv[0], self.iv[1], self.iv[0], self.iv[1]])
+		self._connections = local()
+		self._sessions: List[Session] = []
+		self._progress_lock = Lock()
+		self._size_downloaded = 0
+		self._throttle = throttle
+
+		segments = _get_segments(self.size)
+		chunk_offsets = [c[0] for segment in segments for c in segment]
+		# Chunks that are downloaded but not yet hashed, because an earlier
+		# chunk isn't downloaded yet
+		chunk_macs: Dict[int, Tuple[bytes, bytes]] = {}
+		buffered = 0
+		next_mac = 0
+		hasher = sha256()
+		mac_encryptor = AES.new(self._k_str, AES.MODE_CBC, EMPTY_IV)
+		mac_bytes = EMPTY_IV
+
+		try:
+			with ThreadPoolExecutor(connections, 'Mega Download') as executor, \
+				open(filename, 'wb') as f:
+				f.truncate(self.size)
+				running: Dict[Future, int] = {}
+				next_segment = 0
+				speed_meter = SpeedMeter()
+				last_size = 0
+				try:
+					while self.downloading and (running or next_segment < len(segments)):
+						# Keep a few segments queued, so that workers never wait,
+						# without holding the whole file in memory
+						while (next_segment < len(segments)
+						and len(running) < connections * 2
+						and buffered < connections * 2 * SEGMENT_SIZE):
+							running[executor.submit(
+								self._fetch_segment, url, segments[next_segment]
+							)] = next_segment
+							next_segment += 1
+
+						done = wait(running, timeout=1, return_when=FIRST_COMPLETED)[0]
+						for future in done:
+							del running[future]
+							for offset, chunk, chunk_mac in future.result():
+								f.seek(offset)
+								f.write(chunk)
+								chunk_macs[offset] = (chunk, chunk_mac)
+								buffered += len(chunk)
+
+						# Combine the chunk MACs and hash the chunks in order,
+						# as far as they're available
+						while next_mac < len(chunk_offsets) and chunk_offsets[next_mac] in chunk_macs:
+							chunk, chunk_mac = chunk_macs.pop(chunk_offsets[next_mac])
+							mac_bytes = mac_encryptor.encrypt(chunk_mac)
+							hasher.update(chunk)
+							buffered -= len(chunk)
+							next_mac += 1
+
+						size_downloaded = self._size_downloaded
+						self.speed = speed_meter.update(size_downloaded - last_size)
+						self.progress = round(size_downloaded / self.size * 100, 2)
+						last_size = size_downloaded
+
+				finally:
+					if running:
+						# Stopped or failed; workers stop at their next chunk
+						self.downloading = False
+						for future in running:
+							future.cancel()
+		finally:
+			for ssn in self._sessions:
+				ssn.close()
 
 		if self.downloading:
 			file_mac = str_to_a32(mac_bytes)
@@ -532,5 +714,6 @@ class Mega:
 			if (file_mac[0] ^ file_mac[1],
 					file_mac[2] ^ file_mac[3]) != self.meta_mac:
 				raise ValueError('Mismatched mac')
+			self.hash = hasher.hexdigest()
 
 		return
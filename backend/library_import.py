@@ -0,0 +1,331 @@
+#-*- coding: utf-8 -*-
+
+"""This file contains functions regarding importing an existing library:
+finding the files in the root folders that aren't part of a volume yet,
+matching them to volumes on ComicVine and adding those volumes
+"""
+
+import logging
+from json import dumps, loads
+from os.path import basename, dirname, isdir, isfile, join
+from typing import Dict, List, Tuple
+
+from backend.comicvine import ComicVine
+from backend.db import get_db
+from backend.files import (_list_files, extract_filename_data, rename_file,
+                           scan_files, supported_extensions)
+from backend.root_folders import RootFolders
+from backend.search import _check_matching_titles
+from backend.settings import Settings
+from backend.volumes import Library, Volume
+
+
+def _is_inside(filepath: str, folders: set, stop: str) -> bool:
+	"""Check if a file is inside one of the given folders
+
+	Args:
+		filepath (str): The file to check
+		folders (set): The folders
+		stop (str): The folder at which to stop going up
+
+	Returns:
+		bool: Wether or not the file is inside one of the folders
+	"""
+	folder = dirname(filepath)
+	while folder and folder != stop:
+		if folder in folders:
+			return True
+		parent = dirname(folder)
+		if parent == folder:
+			break
+		folder = parent
+	return False
+
+def group_unimported_files(root_folder_id: int=None) -> List[dict]:
+	"""Find the files in the root folders that aren't part of any volume
+	and group them into the series that they (probably) belong to
+
+	Args:
+		root_folder_id (int, optional): Only look inside this root folder. Defaults to None.
+
+	Returns:
+		List[dict]: The groups of files
+	"""
+	cursor = get_db()
+	known_files = set(f[0] for f in cursor.execute("SELECT filepath FROM files;"))
+	excluded_folders = set(f[0] for f in cursor.execute(
+		"SELECT folder FROM volumes WHERE folder IS NOT NULL;"
+	))
+	excluded_folders.add(Settings().get_settings()['download_folder'].rstrip('/\\'))
+
+	root_folders = RootFolders().get_all(use_cache=False)
+	if root_folder_id is not None:
+		root_folders = [r for r in root_folders if r['id'] == root_folder_id]
+
+	groups: Dict[Tuple[int, str, str, int], dict] = {}
+	for root_folder in root_folders:
+		folder = root_folder['folder'].rstrip('/\\')
+		if not isdir(folder):
+			continue
+
+		for file in _list_files(folder, supported_extensions):
+			if file in known_files or _is_inside(file, excluded_folders, folder):
+				continue
+
+			file_data = extract_filename_data(file)
+			if not file_data['series']:
+				continue
+
+			key = (
+				root_folder['id'],
+				dirname(file),
+				file_data['series'].lower(),
+				file_data['volume_number']
+			)
+			group = groups.setdefault(key, {
+				'root_folder': root_folder['id'],
+				'folder': dirname(file),
+				'files': [],
+				'series': file_data['series'],
+				'volume_number': file_data['volume_number'],
+				'year': file_data['year']
+			})
+			group['files'].append(file)
+			if file_data['year'] and (
+				not group['year']
+				or file_data['year'] < group['year']
+			):
+				group['year'] = file_data['year']
+
+	logging.debug(f'Found {len(groups)} groups of unimported files')
+	return list(groups.values())
+
+def match_group(cv: ComicVine, group: dict) -> dict:
+	"""Find the volume on ComicVine that a group of files most likely belongs to
+
+	Args:
+		cv (ComicVine): The ComicVine instance to search with
+		group (dict): The group (output of `group_unimported_files()`)
+
+	Returns:
+		dict: The best ComicVine search result or `None` if nothing matched
+	"""
+	results = [
+		r
+		for r in cv.search_volumes(group['series'])
+		if not r['already_added']
+		and (
+			_check_matching_titles(r['title'], group['series'])
+			or any(
+				_check_matching_titles(a, group['series'])
+				for a in r.get('aliases', [])
+			)
+		)
+	]
+	if not results:
+		return None
+
+	results.sort(key=lambda r: (
+		r['volume_number'] != group['volume_number'],
+		abs((r['year'] or 0) - group['year']) if group['year'] else 0
+	))
+	return results[0]
+
+def add_library_import_groups(groups: List[dict]) -> List[int]:
+	"""Store groups of files as proposals, without a match yet
+
+	Args:
+		groups (List[dict]): The groups (output of `group_unimported_files()`)
+
+	Returns:
+		List[int]: The ids of the proposals, in the same order as the groups
+	"""
+	cursor = get_db()
+	ids = []
+	for group in groups:
+		cursor.execute("""
+			INSERT INTO library_import(
+				root_folder, folder, files,
+				series, volume_number, year
+			) VALUES (?, ?, ?, ?, ?, ?);
+			""",
+			(
+				group['root_folder'], group['folder'], dumps(group['files']),
+				group['series'], group['volume_number'], group['year']
+			)
+		)
+		ids.append(cursor.lastrowid)
+	return ids
+
+def set_library_import_match(proposal_id: int, match: dict) -> None:
+	"""Store the ComicVine volume that a proposal matched with
+
+	Args:
+		proposal_id (int): The id of the proposal
+		match (dict): The ComicVine search result (output of `match_group()`)
+	"""
+	get_db().execute("""
+		UPDATE library_import
+		SET
+			comicvine_id = ?,
+			cv_title = ?,
+			cv_year = ?,
+			cv_issue_count = ?
+		WHERE id = ?;
+		""",
+		(
+			match['comicvine_id'], match['title'],
+			match['year'], match['issue_count'],
+			proposal_id
+		)
+	)
+	return
+
+def clear_library_import(root_folder_id: int=None) -> None:
+	"""Remove the proposals
+
+	Args:
+		root_folder_id (int, optional): Only remove the proposals of this root folder. Defaults to None.
+	"""
+	if root_folder_id is None:
+		get_db().execute("DELETE FROM library_import;")
+	else:
+		get_db().execute(
+			"DELETE FROM library_import WHERE root_folder = ?;",
+			(root_folder_id,)
+		)
+	return
+
+def get_library_import(offset: int=0) -> List[dict]:
+	"""Get the proposals of the library import in blocks of 50
+
+	Args:
+		offset (int, optional): The offset of the list. The higher the number, the deeper into the list you go. Defaults to 0.
+
+	Returns:
+		List[dict]: The proposals
+	"""
+	result = list(map(
+		dict,
+		get_db('dict').execute("""
+			SELECT
+				id, root_folder, folder, files,
+				series, volume_number, year,
+				comicvine_id, cv_title, cv_year, cv_issue_count
+			FROM library_import
+			ORDER BY series, volume_number, id
+			LIMIT 50
+			OFFSET ?;
+			""",
+			(offset * 50,)
+		)
+	))
+	for entry in result:
+		entry['files'] = loads(entry['files'])
+	return result
+
+def import_library(entries: List[dict], monitor: bool=True) -> List[int]:
+	"""Add the volumes of confirmed proposals to the library and bind their files.
+	The volume data is fetched in batches and the files of all new volumes are
+	scanned in one go.
+
+	Args:
+		entries (List[dict]): The confirmed proposals. Dicts with the keys `id`
+		(the id of the proposal) and `comicvine_id` (the ComicVine id of the volume to add it as)
+		monitor (bool, optional): Wether or not to monitor the new volumes. Defaults to True.
+
+	Returns:
+		List[int]: The ids of the added volumes
+	"""
+	cursor = get_db()
+	comicvine_ids = {e['id']: int(e['comicvine_id']) for e in entries}
+	proposals = cursor.execute("""
+		SELECT id, root_folder, folder, files
+		FROM library_import
+		WHERE id IN (SELECT value FROM json_each(?));
+		""",
+		(dumps(list(comicvine_ids)),)
+	).fetchall()
+
+	# Multiple proposals can be confirmed as the same volume
+	per_volume: Dict[int, List[tuple]] = {}
+	for proposal in proposals:
+		per_volume.setdefault(comicvine_ids[proposal[0]], []).append(proposal)
+
+	already_added = set(v[0] for v in cursor.execute("""
+		SELECT comicvine_id
+		FROM volumes
+		WHERE comicvine_id IN (SELECT value FROM json_each(?));
+		""",
+		(dumps(list(per_volume)),)
+	))
+	for comicvine_id in already_added:
+		logging.info(f'Skipping import of volume {comicvine_id} as it is already added')
+		del per_volume[comicvine_id]
+	if not per_volume:
+		return []
+
+	# Folders that hold the files of more than one proposal can't become the
+	# volume folder, as the volumes would then pick up each others files
+	shared_folders = set(f[0] for f in cursor.execute("""
+		SELECT folder
+		FROM library_import
+		GROUP BY folder
+		HAVING COUNT(*) > 1;
+	"""))
+	root_folders = RootFolders()
+
+	# Fetch the data of all volumes at once
+	cv = ComicVine()
+	str_ids = [str(i) for i in per_volume]
+	volume_datas = cv.fetch_volumes(str_ids)
+	issues: Dict[int, List[dict]] = {}
+	for issue in cv.fetch_issues([str(v['comicvine_id']) for v in volume_datas]):
+		issues.setdefault(issue['volume_id'], []).append(issue)
+
+	library = Library()
+	volume_ids = []
+	done_proposals = []
+	for volume_data in volume_datas:
+		volume_proposals = per_volume[volume_data['comicvine_id']]
+		volume_data['issues'] = issues.get(volume_data['comicvine_id'], [])
+		root_folder_id, folder = volume_proposals[0][1], volume_proposals[0][2]
+		root_folder = root_folders.get_one(root_folder_id, use_cache=False)['folder']
+
+		if (len(volume_proposals) == 1
+		and folder.rstrip('/\\') != root_folder.rstrip('/\\')
+		and not folder in shared_folders):
+			# The files are already in a folder of their own
+			volume_id = library._insert_volume(
+				volume_data, root_folder_id, monitor, folder
+			)
+
+		else:
+			# Move the files into a new volume folder
+			volume_id = library._insert_volume(volume_data, root_folder_id, monitor)
+			volume_folder = cursor.execute(
+				"SELECT folder FROM volumes WHERE id = ? LIMIT 1;",
+				(volume_id,)
+			).fetchone()[0]
+			for proposal in volume_proposals:
+				for file in loads(proposal[3]):
+					target = join(volume_folder, basename(file))
+					if not isfile(file) or isfile(target):
+						logging.warning(f'Not moving {file} into {volume_folder} during library import')
+						continue
+					rename_file(file, target)
+
+		logging.info(f'Imported volume with comicvine id {volume_data["comicvine_id"]} and id {volume_id}')
+		volume_ids.append(volume_id)
+		done_proposals += [p[0] for p in volume_proposals]
+
+	cursor.execute(
+		"DELETE FROM library_import WHERE id IN (SELECT value FROM json_each(?));",
+		(dumps(done_proposals),)
+	)
+	cursor.connection.commit()
+
+	# Bind the files of all new volumes in one scan
+	scan_files([Volume(volume_id).get_info() for volume_id in volume_ids])
+
+	return volume_ids
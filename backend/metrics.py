@@ -0,0 +1,363 @@
+#-*- coding: utf-8 -*-
+
+"""This file contains functions regarding measuring where the time goes:
+requests to the web server, tasks, database queries and outbound HTTP requests.
+Measuring is opt-in (the `enable_metrics` setting), as it adds some overhead.
+"""
+
+import logging
+from collections import deque
+from math import ceil
+from re import compile
+from sqlite3 import Cursor
+from threading import Lock, local
+from time import perf_counter
+from typing import Deque, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from aiohttp import TraceConfig
+from flask import Response, request
+from requests import Session
+
+# Thresholds (in seconds) above which something is logged as being slow
+slow_request_threshold = 1.0
+slow_query_threshold = 0.1
+slow_http_threshold = 5.0
+
+# The amount of most recent durations that quantiles are calculated over
+sample_size = 1024
+quantiles = (0.5, 0.95, 0.99)
+
+# Requests that are open for a long time by design
+untracked_endpoints = ('static', 'api.api_events')
+
+number_literal = compile(r"\b\d+(\.\d+)?\b")
+string_literal = compile(r"'(?:[^']|'')*'")
+placeholder_list = compile(r"\?(?:\s*,\s*\?)+")
+whitespace = compile(r"\s+")
+
+class _Samples:
+	"""The durations of something that happens over and over
+	"""
+	def __init__(self) -> None:
+		self.recent: Deque[float] = deque(maxlen=sample_size)
+		self.count = 0
+		self.sum = 0.0
+		return
+
+	def add(self, duration: float) -> None:
+		self.recent.append(duration)
+		self.count += 1
+		self.sum += duration
+		return
+
+	def quantiles(self) -> List[Tuple[float, float]]:
+		"""Get the quantiles of the recent durations
+
+		Returns:
+			List[Tuple[float, float]]: The quantile and the duration at that quantile
+		"""
+		recent = sorted(self.recent)
+		return [
+			(q, recent[max(ceil(q * len(recent)) - 1, 0)])
+			for q in quantiles
+		]
+
+class _Profile:
+	"""What happened during one request or task
+	"""
+	def __init__(self, name: str) -> None:
+		self.name = name
+		self.start = perf_counter()
+		self.queries: List[Tuple[str, float, int]] = []
+		self.http: List[Tuple[str, float, int]] = []
+		return
+
+class _Metrics:
+	def __init__(self) -> None:
+		self.enabled = False
+		self.lock = Lock()
+		self.scope = local()
+		self.requests: Dict[str, _Samples] = {}
+		self.tasks: Dict[str, _Samples] = {}
+		self.queries: Dict[str, _Samples] = {}
+		self.query_rows: Dict[str, int] = {}
+		self.http: Dict[str, _Samples] = {}
+		return
+
+	def __add_sample(self, group: Dict[str, _Samples], key: str, duration: float) -> None:
+		with self.lock:
+			if not key in group:
+				group[key] = _Samples()
+			group[key].add(duration)
+		return
+
+	#=====================
+	# Scopes
+	#=====================
+	def start_scope(self, name: str) -> None:
+		"""Start keeping track of what happens in this thread
+
+		Args:
+			name (str): The name of the request or task
+		"""
+		if self.enabled:
+			self.scope.profile = _Profile(name)
+		return
+
+	def end_scope(self, task: bool=False) -> None:
+		"""Stop keeping track of what happens in this thread and record it
+
+		Args:
+			task (bool, optional): Wether the scope was a task instead of a request. Defaults to False.
+		"""
+		profile: _Profile = getattr(self.scope, 'profile', None)
+		if profile is None:
+			return
+		self.scope.profile = None
+
+		duration = perf_counter() - profile.start
+		self.__add_sample(self.tasks if task else self.requests, profile.name, duration)
+
+		if not task and duration >= slow_request_threshold:
+			query_time = sum(q[1] for q in profile.queries)
+			http_time = sum(h[1] for h in profile.http)
+			slowest = sorted(profile.queries, key=lambda q: q[1], reverse=True)[:3]
+			logging.warning(
+				f'Slow request: {profile.name} took {duration:.3f}s '
+				f'({len(profile.queries)} queries in {query_time:.3f}s, '
+				f'{len(profile.http)} HTTP requests in {http_time:.3f}s). '
+				f'Slowest queries: {"; ".join(f"{q[0]} ({q[1]:.3f}s)" for q in slowest)}'
+			)
+		return
+
+	#=====================
+	# Recording
+	#=====================
+	def record_query(self, sql: str, duration: float, rows: int) -> str:
+		"""Record a database query
+
+		Args:
+			sql (str): The SQL of the query
+			duration (float): How long the query took in seconds
+			rows (int): How many rows were changed by the query
+
+		Returns:
+			str: The shape of the query (the SQL without literals)
+		"""
+		shape = query_shape(sql)
+		rows = max(rows, 0)
+		self.__add_sample(self.queries, shape, duration)
+		self.add_query_rows(shape, rows)
+
+		profile: _Profile = getattr(self.scope, 'profile', None)
+		if profile is not None:
+			profile.queries.append((shape, duration, rows))
+
+		if duration >= slow_query_threshold:
+			logging.warning(f'Slow query: took {duration:.3f}s: {shape}')
+		return shape
+
+	def add_query_rows(self, shape: str, rows: int) -> None:
+		if rows:
+			with self.lock:
+				self.query_rows[shape] = self.query_rows.get(shape, 0) + rows
+		return
+
+	def record_http(self, method: str, url: str, duration: float, status: int) -> None:
+		"""Record an outbound HTTP request
+
+		Args:
+			method (str): The method of the request
+			url (str): The url that was requested
+			duration (float): How long the request took in seconds
+			status (int): The status code of the response
+		"""
+		host = urlsplit(url).hostname or ''
+		self.__add_sample(self.http, host, duration)
+
+		profile: _Profile = getattr(self.scope, 'profile', None)
+		if profile is not None:
+			profile.http.append((host, duration, status))
+
+		if duration >= slow_http_threshold:
+			logging.warning(f'Slow HTTP request: {method} {url} took {duration:.3f}s (status {status})')
+		return
+
+	#=====================
+	# Exporting
+	#=====================
+	def export(self) -> str:
+		"""Get the metrics in the Prometheus text format
+
+		Returns:
+			str: The metrics
+		"""
+		lines = [
+			'# HELP kapowarr_metrics_enabled Wether metrics are being recorded',
+			'# TYPE kapowarr_metrics_enabled gauge',
+			f'kapowarr_metrics_enabled {int(self.enabled)}'
+		]
+		with self.lock:
+			for name, label, group, description in (
+				('kapowarr_request_duration_seconds', 'endpoint', self.requests, 'Duration of requests per endpoint'),
+				('kapowarr_task_duration_seconds', 'task', self.tasks, 'Duration of tasks'),
+				('kapowarr_db_query_duration_seconds', 'query', self.queries, 'Duration of database queries per query shape'),
+				('kapowarr_http_request_duration_seconds', 'host', self.http, 'Duration of outbound HTTP requests per host')
+			):
+				lines += [f'# HELP {name} {description}', f'# TYPE {name} summary']
+				for key, samples in group.items():
+					key = _escape_label(key)
+					for q, value in samples.quantiles():
+						lines.append(f'{name}{{{label}="{key}",quantile="{q}"}} {value}')
+					lines.append(f'{name}_sum{{{label}="{key}"}} {samples.sum}')
+					lines.append(f'{name}_count{{{label}="{key}"}} {samples.count}')
+
+			lines += [
+				'# HELP kapowarr_db_query_rows_total Rows read or changed per query shape',
+				'# TYPE kapowarr_db_query_rows_total counter'
+			]
+			for key, rows in self.query_rows.items():
+				lines.append(f'kapowarr_db_query_rows_total{{query="{_escape_label(key)}"}} {rows}')
+
+		return '\n'.join(lines) + '\n'
+
+metrics = _Metrics()
+
+def query_shape(sql: str) -> str:
+	"""Turn SQL into a general form, so that the same query with different
+	values is recorded as the same query
+
+	Args:
+		sql (str): The SQL
+
+	Returns:
+		str: The shape of the query
+	"""
+	sql = string_literal.sub('?', sql)
+	sql = number_literal.sub('?', sql)
+	sql = placeholder_list.sub('?, ...', sql)
+	return whitespace.sub(' ', sql).strip()[:250]
+
+def _escape_label(value: str) -> str:
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+#=====================
+# Database
+#=====================
+class TimedCursor(Cursor):
+	"""A database cursor that records the queries that are run with it
+	"""
+	shape: str = None
+
+	def execute(self, sql: str, parameters=()):
+		start = perf_counter()
+		try:
+			return super().execute(sql, parameters)
+		finally:
+			self.shape = metrics.record_query(sql, perf_counter() - start, self.rowcount)
+
+	def executemany(self, sql: str, parameters):
+		start = perf_counter()
+		try:
+			return super().executemany(sql, parameters)
+		finally:
+			self.shape = metrics.record_query(sql, perf_counter() - start, self.rowcount)
+
+	def executescript(self, sql_script: str):
+		start = perf_counter()
+		try:
+			return super().executescript(sql_script)
+		finally:
+			self.shape = metrics.record_query(sql_script, perf_counter() - start, self.rowcount)
+
+	def fetchone(self):
+		row = super().fetchone()
+		if row is not None:
+			metrics.add_query_rows(self.shape, 1)
+		return row
+
+	def fetchmany(self, *args, **kwargs):
+		rows = super().fetchmany(*args, **kwargs)
+		metrics.add_query_rows(self.shape, len(rows))
+		return rows
+
+	def fetchall(self):
+		rows = super().fetchall()
+		metrics.add_query_rows(self.shape, len(rows))
+		return rows
+
+	def __next__(self):
+		row = super().__next__()
+		metrics.add_query_rows(self.shape, 1)
+		return row
+
+#=====================
+# HTTP
+#=====================
+_original_send = Session.send
+
+def _timed_send(self, request, **kwargs):
+	start = perf_counter()
+	status = 0
+	try:
+		response = _original_send(self, request, **kwargs)
+		status = response.status_code
+		return response
+	finally:
+		metrics.record_http(request.method, request.url, perf_counter() - start, status)
+
+async def _on_request_start(session, context, params) -> None:
+	context.start = perf_counter()
+	return
+
+async def _on_request_end(session, context, params) -> None:
+	metrics.record_http(
+		params.method, str(params.url),
+		perf_counter() - context.start, params.response.status
+	)
+	return
+
+def http_trace_configs() -> List[TraceConfig]:
+	"""Get the trace configs to give to an aiohttp `ClientSession`,
+	so that its requests are recorded
+
+	Returns:
+		List[TraceConfig]: The trace configs (empty when metrics are disabled)
+	"""
+	if not metrics.enabled:
+		return []
+	trace_config = TraceConfig()
+	trace_config.on_request_start.append(_on_request_start)
+	trace_config.on_request_end.append(_on_request_end)
+	return [trace_config]
+
+def set_metrics_enabled(enabled: bool) -> None:
+	"""Turn recording metrics on or off
+
+	Args:
+		enabled (bool): Wether or not to record metrics
+	"""
+	logging.debug(f'Setting metrics enabled: {enabled}')
+	metrics.enabled = enabled
+	Session.send = _timed_send if enabled else _original_send
+	return
+
+#=====================
+# Requests
+#=====================
+def start_request_profile() -> None:
+	"""Start keeping track of a request to the web server (used as `before_request`)
+	"""
+	if metrics.enabled and request.endpoint not in untracked_endpoints:
+		rule = request.url_rule.rule if request.url_rule else 'unknown'
+		metrics.start_scope(f'{request.method} {rule}')
+	return
+
+def end_request_profile(response: Response) -> Response:
+	"""Record the request to the web server once the response is completely
+	sent, so that streamed responses are measured fully (used as `after_request`)
+	"""
+	if getattr(metrics.scope, 'profile', None) is not None:
+		response.call_on_close(metrics.end_scope)
+	return response
@@ -6,9 +6,9 @@
 import logging
 from os import listdir
 from os.path import basename, dirname, isdir, isfile, join, splitext
-from re import IGNORECASE, compile, escape, match
+from re import IGNORECASE, compile
 from string import Formatter
-from typing import Dict, List
+from typing import Callable, Dict, List, Set
 
 from backend.custom_exceptions import (InvalidSettingValue, IssueNotFound,
                                        VolumeNotFound)
@@ -32,10 +32,13 @@ issue_formatting_keys = formatting_keys + (
 	'issue_release_date'
 )
 
-filename_cleaner = compile(r'(<|>|:|\"|\||\?|\*|\x00|(\s|\.)+$)')
+illegal_filename_chars = str.maketrans('', '', '<>:"|?*\x00')
 page_regex = compile(r'^(\d+)$|page[\s\.\-]?(\d+)', IGNORECASE)
 page_regex_2 = compile(r'(\d+)')
 
+# volume id -> formatting data of the volume and it's issues
+_formatting_contexts: Dict[int, dict] = {}
+
 #=====================
 # Name generation
 #=====================
@@ -48,24 +51,87 @@ def _make_filename_safe(unsafe_filename: str) -> str:
 	Returns:
 		str: The filename, now with characters removed/replaced so that it's filesystem-safe.
 	"""
-	safe_filename = filename_cleaner.sub('', unsafe_filename)
+	safe_filename = unsafe_filename.translate(illegal_filename_chars).rstrip()
+	while safe_filename.endswith('.'):
+		safe_filename = safe_filename.rstrip('.').rstrip()
 	return safe_filename
 
-def _get_formatting_data(volume_id: int, issue_id: int=None) -> dict:
-	"""Get the values of the formatting keys for a volume or issue
+def _get_template(type: str) -> Callable[[dict], str]:
+	"""Get a function that fills in a naming format from the settings
+	and makes the result filename safe. The format is read from the settings
+	once, so the function can be used for many names in a row.
+
+	Args:
+		type (str): The naming setting ('volume_folder_naming', 'file_naming', 'file_naming_tpb')
+
+	Returns:
+		Callable[[dict], str]: The function. Takes the formatting data and returns the name.
+	"""
+	fill = Settings().get_settings()[type].format
+	return lambda formatting_data: _make_filename_safe(fill(**formatting_data))
+
+def _volume_formatting_data(volume_data: dict) -> dict:
+	"""Get the values of the formatting keys for a volume
+
+	Args:
+		volume_data (dict): The comicvine_id, title, year, publisher and volume_number of the volume
+
+	Returns:
+		dict: The formatting keys and their values for the volume
+	"""
+	if volume_data['title'].startswith('The '):
+		clean_title = volume_data['title'] + ', The'
+	elif volume_data['title'].startswith('A '):
+		clean_title = volume_data['title'] + ', A'
+	else:
+		clean_title = volume_data['title'] or 'Unknown'
+	
+	formatting_data = {
+		'series_name': (volume_data['title'] or 'Unknown').replace('/', '').replace(r'\\', ''),
+		'clean_series_name': clean_title.replace('/', '').replace(r'\\', ''),
+		'volume_number': volume_data['volume_number'] or 'Unknown',
+		'comicvine_id': volume_data['comicvine_id'] or 'Unknown',
+		'year': volume_data['year'] or 'Unknown',
+		'publisher': volume_data['publisher'] or 'Unknown'
+	}
+	return formatting_data
+
+def _issue_formatting_data(issue_data: dict) -> dict:
+	"""Get the values of the issue specific formatting keys for an issue
+
+	Args:
+		issue_data (dict): The comicvine_id, issue_number, title and date of the issue
+
+	Returns:
+		dict: The issue specific formatting keys and their values for the issue
+	"""
+	formatting_data = {
+		'issue_comicvine_id': issue_data['comicvine_id'] or 'Unknown',
+		'issue_number': issue_data['issue_number'] or 'Unknown',
+		'issue_title': (issue_data['title'] or 'Unknown').replace('/', '').replace(r'\\', ''),
+		'issue_release_date': issue_data['date'] or 'Unknown'
+	}
+	return formatting_data
+
+def _get_formatting_context(volume_id: int) -> dict:
+	"""Get the formatting data of a volume and all of it's issues.
+	The result is cached until naming.invalidate_formatting_context() is called for the volume.
 
 	Args:
 		volume_id (int): The id of the volume
-		issue_id (int, optional): The id of the issue. Defaults to None.
 
 	Raises:
 		VolumeNotFound: The volume id doesn't map to any volume in the library
-		IssueNotFound: The issue id doesn't map to any issue in the volume
 
 	Returns:
-		dict: The formatting keys and their values for the item
+		dict: The formatting data of the volume under the key `volume`,
+		the formatting data of each issue under `issues` (issue id -> data)
+		and the issue id of each calculated issue number under `numbers`.
 	"""
-	# Fetch volume data and check if id is valid
+	context = _formatting_contexts.get(volume_id)
+	if context is not None:
+		return context
+
 	cursor = get_db('dict')
 	volume_data = cursor.execute("""
 		SELECT
@@ -79,48 +145,64 @@ def _get_formatting_data(volume_id: int, issue_id: int=None) -> dict:
 	
 	if not volume_data:
 		raise VolumeNotFound
-	volume_data = dict(volume_data)
-	
-	# Build formatted data
-	if volume_data.get('title').startswith('The '):
-		clean_title = volume_data.get('title') + ', The'
-	elif volume_data.get('title').startswith('A '):
-		clean_title = volume_data.get('title') + ', A'
-	else:
-		clean_title = volume_data.get('title') or 'Unknown'
-	
-	formatting_data = {
-		'series_name': (volume_data.get('title') or 'Unknown').replace('/', '').replace(r'\\', ''),
-		'clean_series_name': clean_title.replace('/', '').replace(r'\\', ''),
-		'volume_number': volume_data.get('volume_number') or 'Unknown',
-		'comicvine_id': volume_data.get('comicvine_id') or 'Unknown',
-		'year': volume_data.get('year') or 'Unknown',
-		'publisher': volume_data.get('publisher') or 'Unknown'
+
+	context = {
+		'volume': _volume_formatting_data(volume_data),
+		'issues': {},
+		'numbers': {}
 	}
-	
-	if issue_id:
-		# Add issue data if issue is found
-		issue_data = cursor.execute("""
-			SELECT
-				comicvine_id,
-				issue_number,
-				title, date
-			FROM issues
-			WHERE id = ?;
-		""", (issue_id,)).fetchone()
-		
-		if not issue_data:
-			raise IssueNotFound
-		issue_data = dict(issue_data)
-			
-		formatting_data.update({
-			'issue_comicvine_id': issue_data.get('comicvine_id') or 'Unknown',
-			'issue_number': issue_data.get('issue_number') or 'Unknown',
-			'issue_title': (issue_data.get('title') or 'Unknown').replace('/', '').replace(r'\\', ''),
-			'issue_release_date': issue_data.get('date') or 'Unknown'
-		})
-		
-	return formatting_data
+	for issue in cursor.execute("""
+		SELECT
+			id, comicvine_id,
+			issue_number, calculated_issue_number,
+			title, date
+		FROM issues
+		WHERE volume_id = ?
+		ORDER BY id;
+		""",
+		(volume_id,)
+	):
+		context['issues'][issue['id']] = _issue_formatting_data(issue)
+		context['numbers'].setdefault(issue['calculated_issue_number'], issue['id'])
+
+	_formatting_contexts[volume_id] = context
+	return context
+
+def invalidate_formatting_context(volume_id: int=None) -> None:
+	"""Forget the cached formatting data of a volume.
+	Should be called when the metadata of the volume or it's issues changes.
+
+	Args:
+		volume_id (int, optional): The id of the volume. If `None`, the data of all volumes is forgotten. Defaults to None.
+	"""
+	if volume_id is None:
+		_formatting_contexts.clear()
+	else:
+		_formatting_contexts.pop(volume_id, None)
+	return
+
+def _get_formatting_data(volume_id: int, issue_id: int=None) -> dict:
+	"""Get the values of the formatting keys for a volume or issue
+
+	Args:
+		volume_id (int): The id of the volume
+		issue_id (int, optional): The id of the issue. Defaults to None.
+
+	Raises:
+		VolumeNotFound: The volume id doesn't map to any volume in the library
+		IssueNotFound: The issue id doesn't map to any issue in the volume
+
+	Returns:
+		dict: The formatting keys and their values for the item
+	"""
+	context = _get_formatting_context(volume_id)
+	if not issue_id:
+		return context['volume']
+
+	if not issue_id in context['issues']:
+		raise IssueNotFound
+
+	return {**context['volume'], **context['issues'][issue_id]}
 
 def generate_volume_folder_name(volume_id: int) -> str:
 	"""Generate a volume folder name based on the format string
@@ -132,11 +214,7 @@ def generate_volume_folder_name(volume_id: int) -> str:
 		str: The volume folder name
 	"""
 	formatting_data = _get_formatting_data(volume_id)
-	format: str = Settings().get_settings()['volume_folder_naming']
-
-	name = format.format(**formatting_data)
-	save_name = _make_filename_safe(name)
-	return save_name
+	return _get_template('volume_folder_naming')(formatting_data)
 
 def generate_tpb_name(volume_id: int) -> str:
 	"""Generate a TPB name based on the format string
@@ -148,11 +226,7 @@ def generate_tpb_name(volume_id: int) -> str:
 		str: The TPB name
 	"""
 	formatting_data = _get_formatting_data(volume_id)
-	format: str = Settings().get_settings()['file_naming_tpb']
-
-	name = format.format(**formatting_data)
-	save_name = _make_filename_safe(name)
-	return save_name
+	return _get_template('file_naming_tpb')(formatting_data)
 
 def generate_issue_range_name(
 	volume_id: int,
@@ -169,40 +243,17 @@ def generate_issue_range_name(
 	Returns:
 		str: The issue range name
 	"""
-	cursor = get_db()
-	issue_id = cursor.execute("""
-		SELECT id
-		FROM issues
-		WHERE volume_id = ?
-			AND calculated_issue_number = ?
-		LIMIT 1;
-	""", (volume_id, calculated_issue_number_start)).fetchone()[0]
-	formatting_data = _get_formatting_data(volume_id, issue_id)
-	format: str = Settings().get_settings()['file_naming']
-	
+	context = _get_formatting_context(volume_id)
+	start = context['issues'][context['numbers'][calculated_issue_number_start]]
+	end = context['issues'][context['numbers'][calculated_issue_number_end]]
+
 	# Override issue number to range
-	issue_number_start, issue_number_end = cursor.execute("""
-		SELECT issue_number
-		FROM issues
-		WHERE
-			volume_id = ?
-			AND
-			(
-				calculated_issue_number = ?
-				OR calculated_issue_number = ?
-			)
-		ORDER BY calculated_issue_number
-		LIMIT 2;
-		""",
-		(volume_id,
-		calculated_issue_number_start,
-		calculated_issue_number_end)
-	).fetchall()
-	formatting_data['issue_number'] = f'{issue_number_start[0]}-{issue_number_end[0]}'
-	
-	name = format.format(**formatting_data)
-	save_name = _make_filename_safe(name)
-	return save_name
+	formatting_data = {
+		**context['volume'],
+		**start,
+		'issue_number': f'{start["issue_number"]}-{end["issue_number"]}'
+	}
+	return _get_template('file_naming')(formatting_data)
 
 def generate_issue_name(volume_id: int, calculated_issue_number: float) -> str:
 	"""Generate a issue name based on the format string
@@ -213,20 +264,13 @@ def generate_issue_name(volume_id: int, calculated_issue_number: float) -> str:
 
 	Returns:
 		str: The issue name
-	"""	
-	issue_id = get_db().execute("""
-		SELECT id
-		FROM issues
-		WHERE volume_id = ?
-			AND calculated_issue_number = ?
-		LIMIT 1;
-	""", (volume_id, calculated_issue_number)).fetchone()[0]
-	formatting_data = _get_formatting_data(volume_id, issue_id)
-	format: str = Settings().get_settings()['file_naming']
-
-	name = format.format(**formatting_data)
-	save_name = _make_filename_safe(name)
-	return save_name
+	"""
+	context = _get_formatting_context(volume_id)
+	formatting_data = {
+		**context['volume'],
+		**context['issues'][context['numbers'][calculated_issue_number]]
+	}
+	return _get_template('file_naming')(formatting_data)
 
 #=====================
 # Checking formats
@@ -259,49 +303,79 @@ def check_format(format: str, type: str) -> None:
 #=====================
 # Renaming
 #=====================
-def same_name_indexing(
-	suggested_name: str,
-	current_name: str,
-	folder: str,
-	planned_names: List[Dict[str, str]]
-) -> str:
-	"""Add a number after a filename if the filename already exists.
+class _NameIndex:
+	"""Keeps track of the names that are taken in folders,
+	so that files can be given a unique name without listing
+	the folder or scanning the planned renames for every file.
+	"""
+	def __init__(self) -> None:
+		# folder -> names (without extension) of the files currently in it
+		self.existing: Dict[str, Set[str]] = {}
+		# folder -> names (without extension) that are planned to be used
+		self.planned: Dict[str, Set[str]] = {}
+		return
+
+	def __existing_names(self, folder: str) -> Set[str]:
+		if not folder in self.existing:
+			if isdir(folder):
+				self.existing[folder] = {splitext(f)[0] for f in listdir(folder)}
+			else:
+				self.existing[folder] = set()
+		return self.existing[folder]
+
+	def claim(self, suggested_name: str, current_name: str, folder: str) -> str:
+		"""Add a number after a filename if the filename is already taken
+		and mark the resulting name as taken.
+
+		Args:
+			suggested_name (str): The currently suggested filename (without extension).
+			Can contain a subfolder.
+			current_name (str): The current filepath of the file
+			folder (str): The folder that the file will be put in
+
+		Returns:
+			str: The suggested name, now with number at the end if needed
+		"""
+		dest_folder = dirname(join(folder, suggested_name))
+		name = basename(suggested_name)
+		existing = self.__existing_names(dest_folder)
+		planned = self.planned.setdefault(dest_folder, set())
+		if dirname(current_name) == dest_folder:
+			# The file itself doesn't count as taking the name
+			own_name = splitext(basename(current_name))[0]
+		else:
+			own_name = None
+
+		unique_name, i = name, 0
+		while unique_name in planned or (
+			unique_name in existing and unique_name != own_name
+		):
+			i += 1
+			unique_name = f'{name} ({i})'
+
+		planned.add(unique_name)
+		return join(dirname(suggested_name), unique_name)
+
+def _page_number(filepath: str) -> str:
+	"""Extract the page number from the filepath of an image
 
 	Args:
-		suggested_name (str): The currently suggested filename
-		current_name (str): The current name of the file
-		folder (str): The folder that the file is in
-		planned_names (List[Dict[str, str]]): The already planned names of other files
+		filepath (str): The filepath of the image
 
 	Returns:
-		str: The suggested name, now with number at the end if needed
+		str: The page number, or `'1'` if it couldn't be found
 	"""
-	same_names = tuple(
-		filter(
-			lambda r: match(escape(suggested_name) + r'( \(\d+\))?$', r),
-			[splitext(basename(r['after']))[0] for r in planned_names]
-		)
-	)
-	if isdir(folder):
-		# Add number to filename if an other file in the dest folder has the same name
-		basename_file = splitext(basename(current_name))[0]
-		same_names += tuple(
-			filter(
-				lambda f: not f == basename_file and match(escape(suggested_name) + r'(?: \(\d+\))?$', f),
-				[splitext(f)[0] for f in listdir(folder)]
-			)
-		)
-	if same_names:
-		i = 0
-		while True:
-			if not i and not suggested_name in same_names:
-				break
-			if i and not f"{suggested_name} ({i})" in same_names:
-				suggested_name += f" ({i})"
-				break
-			i += 1
-
-	return suggested_name
+	page_number = None
+	page_result = page_regex.search(filepath)
+	if page_result:
+		page_number = next(r for r in page_result.groups() if r is not None)
+	else:
+		page_result = None
+		r = page_regex_2.finditer(filepath)
+		for page_result in r: pass
+		if page_result:
+			page_number = page_result.group(1)
+	return page_number or '1'
 
 def preview_mass_rename(volume_id: int, issue_id: int=None, filepath_filter: List[str]=None) -> List[Dict[str, str]]:
 	"""Preview what naming.mass_rename() will do.
@@ -311,26 +385,39 @@ def preview_mass_rename(volume_id: int, issue_id: int=None, filepath_filter: Lis
 		issue_id (int, optional): The id of the issue for which to check the renaming. Defaults to None.
 		filepath_filter (List[str], optional): Only process files that are in the list. Defaults to None.
 
+	Raises:
+		VolumeNotFound: The volume id doesn't map to any volume in the library
+
 	Returns:
 		List[Dict[str, str]]: The renaming proposals.
 	"""
 	result = []
 	cursor = get_db('dict')
-	# Fetch all files linked to the volume or issue
+
+	# Load everything needed for generating the names at once
+	context = _get_formatting_context(volume_id)
+	issues = context['issues']
+	file_template = _get_template('file_naming')
+	tpb_template = _get_template('file_naming_tpb')
+
+	# Fetch all files linked to the volume, with the issues they cover
+	file_issues: Dict[str, List[int]] = {}
+	for filepath, file_issue_id in cursor.execute("""
+		SELECT f.filepath, if.issue_id
+		FROM files f
+		INNER JOIN issues_files if
+		INNER JOIN issues i
+		ON
+			i.id = if.issue_id
+			AND if.file_id = f.id
+		WHERE i.volume_id = ?
+		ORDER BY f.id, i.calculated_issue_number;
+		""",
+		(volume_id,)
+	):
+		file_issues.setdefault(filepath, []).append(file_issue_id)
+
 	if not issue_id:
-		file_infos = cursor.execute("""
-			SELECT DISTINCT
-				f.id, f.filepath
-			FROM files f
-			INNER JOIN issues_files if
-			INNER JOIN issues i
-			ON
-				i.id = if.issue_id
-				AND if.file_id = f.id
-			WHERE i.volume_id = ?;
-			""",
-			(volume_id,)
-		).fetchall()
 		root_folder = cursor.execute("""
 			SELECT rf.folder
 			FROM
@@ -342,111 +429,148 @@ def preview_mass_rename(volume_id: int, issue_id: int=None, filepath_filter: Lis
 			""",
 			(volume_id,)
 		).fetchone()[0]
-		folder = join(root_folder, generate_volume_folder_name(volume_id))
+		folder = join(root_folder, _get_template('volume_folder_naming')(context['volume']))
 	else:
-		file_infos = cursor.execute("""
-			SELECT
-				f.id, f.filepath
-			FROM files f
-			INNER JOIN issues_files if
-			ON if.file_id = f.id
-			WHERE if.issue_id = ?;
-			""",
-			(issue_id,)
-		).fetchall()
-		if not file_infos: return result
-		folder = dirname(file_infos[0]['filepath'])
+		file_issues = {
+			f: i
+			for f, i in file_issues.items()
+			if issue_id in i
+		}
+		if not file_issues: return result
+		folder = dirname(next(iter(file_issues)))
 		
 	if filepath_filter is not None:
-		file_infos = filter(lambda f: f['filepath'] in filepath_filter, file_infos)
+		filepath_filter = set(filepath_filter)
+		file_issues = {
+			f: i
+			for f, i in file_issues.items()
+			if f in filepath_filter
+		}
+
+	name_index = _NameIndex()
+	for filepath, covered_issues in file_issues.items():
+		if not isfile(filepath):
+			continue
+		logging.debug(f'Renaming: original filename: {filepath}')
 
-	issues_in_volume = cursor.execute(
-		"SELECT COUNT(*) FROM issues WHERE volume_id = ?",
-		(volume_id,)
-	).fetchone()[0]
-	for file in file_infos:
 		# Determine what issue(s) the file covers
-		if not isfile(file['filepath']):
-			continue
-		logging.debug(f'Renaming: original filename: {file["filepath"]}')
-		
-		# Find the issues that the file covers
-		issues = cursor.execute("""
-			SELECT
-				calculated_issue_number
-			FROM issues
-			INNER JOIN issues_files
-			ON id = issue_id
-			WHERE file_id = ?
-			ORDER BY calculated_issue_number;
-			""",
-			(file['id'],)
-		).fetchall()
-		if len(issues) > 1:
-			if len(issues) == issues_in_volume:
+		if len(covered_issues) > 1:
+			if len(covered_issues) == len(issues):
 				# File is TPB
-				suggested_name = generate_tpb_name(volume_id)
+				suggested_name = tpb_template(context['volume'])
 			else:
 				# File covers multiple issues
-				suggested_name = generate_issue_range_name(volume_id, issues[0][0], issues[-1][0])
+				first, last = issues[covered_issues[0]], issues[covered_issues[-1]]
+				suggested_name = file_template({
+					**context['volume'],
+					**first,
+					'issue_number': f'{first["issue_number"]}-{last["issue_number"]}'
+				})
 		else:
 			# File covers one issue
-			suggested_name = generate_issue_name(volume_id, issues[0][0])
+			suggested_name = file_template({
+				**context['volume'],
+				**issues[covered_issues[0]]
+			})
 
 		# If file is image, it's probably a page instead of a whole issue/tpb.
 		# So put it in it's own folder together with the other images.
-		if file['filepath'].endswith(image_extensions):
-			page_number = None
-			page_result = page_regex.search(file['filepath'])
-			if page_result:
-				page_number = next(r for r in page_result.groups() if r is not None)
-			else:
-				page_result = None
-				r = page_regex_2.finditer(file['filepath'])
-				for page_result in r: pass
-				if page_result:
-					page_number = page_result.group(1)
-			suggested_name = join(suggested_name, page_number or '1')
+		if filepath.endswith(image_extensions):
+			suggested_name = join(suggested_name, _page_number(filepath))
 
 		# Add number to filename if other file has the same name
-		suggested_name = same_name_indexing(suggested_name, file['filepath'], folder, result)
+		suggested_name = name_index.claim(suggested_name, filepath, folder)
 
-		suggested_name = join(folder, suggested_name + splitext(file["filepath"])[1])
+		suggested_name = join(folder, suggested_name + splitext(filepath)[1])
 		logging.debug(f'Renaming: suggested filename: {suggested_name}')
-		if file['filepath'] != suggested_name:
+		if filepath != suggested_name:
 			logging.debug(f'Renaming: added rename')
 			result.append({
-				'before': file['filepath'],
+				'before': filepath,
 				'after': suggested_name
 			})
 		
 	return result
 
 def mass_rename(volume_id: int, issue_id: int=None, filepath_filter: List[str]=None) -> None:
-	"""Carry out proposal of naming.preview_mass_rename()
+	"""Carry out proposal of naming.preview_mass_rename().
+	Either all renames succeed or none of them are done.
 
 	Args:
 		volume_id (int): The id of the volume for which to rename.
 		issue_id (int, optional): The id of the issue for which to rename. Defaults to None.
 		filepath_filter (List[str], optional): Only rename files that are in the list. Defaults to None.
 	"""
-	cursor = get_db()
 	renames = preview_mass_rename(volume_id, issue_id, filepath_filter)
-	if not issue_id and renames:
-		file = renames[0]['after']
-		if file.endswith(image_extensions):
-			folder = dirname(dirname(file))
-		else:
-			folder = dirname(file)
-		cursor.execute(
-			"UPDATE volumes SET folder = ? WHERE id = ?",
-			(folder, volume_id)
-		)
-	for r in renames:
-		rename_file(r['before'], r['after'])
-		cursor.execute(
+	if not renames:
+		return
+
+	cursor = get_db()
+	cursor.execute("SAVEPOINT mass_rename;")
+	done: List[Dict[str, str]] = []
+	try:
+		# Move the files before writing to the database,
+		# so that the database isn't locked while moving
+		for r in renames:
+			rename_file(r['before'], r['after'])
+			done.append(r)
+
+		if not issue_id:
+			file = renames[0]['after']
+			if file.endswith(image_extensions):
+				folder = dirname(dirname(file))
+			else:
+				folder = dirname(file)
+			cursor.execute(
+				"UPDATE volumes SET folder = ? WHERE id = ?",
+				(folder, volume_id)
+			)
+
+		cursor.executemany(
 			"UPDATE files SET filepath = ? WHERE filepath = ?;",
-			(r['after'], r['before'])
+			((r['after'], r['before']) for r in renames)
 		)
+
+	except BaseException:
+		logging.error(
+			f'Renaming volume {volume_id} failed after {len(done)} files, reverting'
+		)
+		for r in reversed(done):
+			rename_file(r['after'], r['before'])
+		cursor.execute("ROLLBACK TO mass_rename;")
+		cursor.execute("RELEASE mass_rename;")
+		raise
+
+	cursor.execute("RELEASE mass_rename;")
 	logging.info(f'Renamed volume {volume_id} {f"issue {issue_id}" if issue_id else ""}')
 	return
+
+def preview_mass_rename_all(offset: int=0) -> List[dict]:
+	"""Preview what naming.mass_rename() will do for all volumes in the library,
+	in blocks of 50 volumes.
+
+	Args:
+		offset (int, optional): The offset of the list. The higher the number, the deeper into the list you go. Defaults to 0.
+
+	Returns:
+		List[dict]: The id and title of each volume in the block with it's renaming proposals
+		(empty list if there's nothing to rename). An empty list means the end of the library is reached.
+	"""
+	volumes = get_db().execute("""
+		SELECT id, title
+		FROM volumes
+		ORDER BY title, id
+		LIMIT 50
+		OFFSET ?;
+		""",
+		(offset * 50,)
+	).fetchall()
+	result = [
+		{
+			'id': volume_id,
+			'title': title,
+			'renames': preview_mass_rename(volume_id)
+		}
+		for volume_id, title in volumes
+	]
+	return result
@@ -5,20 +5,50 @@
 
 import logging
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from os import remove
-from os.path import basename, isfile, join
-from shutil import move, rmtree
+from os.path import basename, dirname, getsize, isfile, join, splitext
+from shutil import copyfileobj, move, rmtree
 from time import time
-from typing import List
+from typing import Dict, List, Tuple
 from zipfile import ZipFile
 
+from backend.custom_exceptions import DownloadCorrupt
 from backend.db import get_db
-from backend.files import extract_filename_data
+from backend.files import extract_filename_data, link_file, move_file
 from backend.naming import mass_rename
 from backend.search import _check_matching_titles
+from backend.settings import Settings
 from backend.volumes import Volume, scan_files
 
+try:
+	from rarfile import RarFile
+except ImportError:
+	RarFile = None
+
+try:
+	from py7zr import SevenZipFile
+except ImportError:
+	SevenZipFile = None
+
 zip_extract_folder = '.zip_extract'
+unzip_workers = 4
+
+# Archives that contain multiple files (packs) and that can be unzipped.
+# RAR and 7z support depend on the optional rarfile and py7zr packages.
+archive_extensions = ('.zip',)
+if RarFile is not None:
+	archive_extensions += ('.rar',)
+if SevenZipFile is not None:
+	archive_extensions += ('.7z',)
+
+# The first bytes of each archive format, and the extensions that are used for it
+archive_signatures = {
+	b'PK\x03\x04': 'zip',
+	b'Rar!\x1a\x07': 'rar',
+	b"7z\xbc\xaf'\x1c": '7z'
+}
+verifiable_extensions = ('.cbz', '.zip', '.cbr', '.rar', '.cb7', '.7z')
 
 class PostProcessor(ABC):
 	@abstractmethod
@@ -50,6 +80,7 @@ class PostProcessing(PostProcessor):
 		]
 		
 		self.actions_full = [
+			self._verify_file,
 			self._remove_from_queue,
 			self._add_to_history,
 			self._move_file,
@@ -67,6 +98,25 @@ class PostProcessing(PostProcessor):
 		self.queue = queue
 		return
 
+	def _verify_file(self) -> None:
+		"""Check that the downloaded file is complete and, if it's an archive,
+		that it can be opened
+
+		Raises:
+			DownloadCorrupt: The file is incomplete or isn't a valid archive
+		"""
+		file = self.download['instance'].file
+		if not isfile(file):
+			return
+
+		size = self.download['instance'].size
+		if size not in (-1, None) and getsize(file) != size:
+			raise DownloadCorrupt(file, f'Size is {getsize(file)} instead of {size} bytes')
+
+		if file.lower().endswith(verifiable_extensions):
+			_verify_archive(file)
+		return
+
 	def _remove_from_queue(self) -> None:
 		"""Delete the download from the queue in the database
 		"""
@@ -93,7 +143,7 @@ class PostProcessing(PostProcessor):
 		return
 		
 	def _move_file(self) -> None:
-		"""Move file from download folder to final destination
+		"""Move (or link, depending on the import mode) file from download folder to final destination
 		"""
 		logging.debug(f'Moving download to final destination: {self.download}')
 		if isfile(self.download['instance'].file):
@@ -102,14 +152,32 @@ class PostProcessing(PostProcessor):
 				(self.download['volume_id'],)
 			).fetchone()[0]
 			file_dest = join(folder, basename(self.download['instance'].file))
-			if isfile(file_dest):
-				remove(file_dest)
-			move(self.download['instance'].file, file_dest)
+			settings = Settings().get_settings()
+
+			# Report the import progress as the progress of the download
+			instance = self.download['instance']
+			instance.progress = 0.0
+			if settings['import_mode'] == 'move':
+				move_file(
+					instance.file,
+					file_dest,
+					sync=settings['fsync_imports'],
+					progress=lambda p: setattr(instance, 'progress', p)
+				)
+			else:
+				link_file(
+					instance.file,
+					file_dest,
+					reflink=settings['import_mode'] == 'reflink',
+					sync=settings['fsync_imports'],
+					progress=lambda p: setattr(instance, 'progress', p)
+				)
+			instance.progress = 100.0
 			self.download['instance'].file = file_dest
 		return
 		
 	def _unzip_file(self) -> None:
-		if self.download['instance'].file.lower().endswith('.zip'):
+		if self.download['instance'].file.lower().endswith(archive_extensions):
 			unzip = get_db().execute("SELECT value FROM config WHERE key = 'unzip';").fetchone()[0]
 			if unzip:
 				unzip_volume(self.download['volume_id'], self.download['instance'].file)
@@ -126,6 +194,11 @@ class PostProcessing(PostProcessor):
 		"""Register file in database and match to a volume/issue
 		"""
 		scan_files(Volume(self.download['volume_id']).get_info())
+		if self.download['instance'].hash:
+			get_db().execute(
+				"UPDATE files SET hash = ? WHERE filepath = ?;",
+				(self.download['instance'].hash, self.download['instance'].file)
+			)
 		return
 
 	def __run_actions(self, actions: list) -> None:
@@ -159,7 +232,145 @@ class PostProcessing(PostProcessor):
 		self.__run_actions(self.actions_error)
 		return
 
+def _verify_archive(file: str) -> None:
+	"""Check that an archive is valid, by reading its index
+	(e.g. the central directory of a zip file) without extracting it.
+	Comic archives are regularly in a different format than their
+	extension suggests, so the format is determined from the first bytes.
+
+	Args:
+		file (str): The archive
+
+	Raises:
+		DownloadCorrupt: The archive is not valid
+	"""
+	with open(file, 'rb') as f:
+		header = f.read(8)
+	for signature, archive_format in archive_signatures.items():
+		if header.startswith(signature):
+			break
+	else:
+		raise DownloadCorrupt(file, 'Not a zip, rar or 7z archive')
+
+	try:
+		if archive_format == 'zip':
+			with ZipFile(file, 'r') as archive:
+				has_files = bool(archive.infolist())
+		elif archive_format == 'rar' and RarFile is not None:
+			with RarFile(file, 'r') as archive:
+				has_files = bool(archive.infolist())
+		elif archive_format == '7z' and SevenZipFile is not None:
+			with SevenZipFile(file, 'r') as archive:
+				has_files = bool(archive.list())
+		else:
+			# Package to read the archive is not installed
+			return
+	except Exception as e:
+		raise DownloadCorrupt(file, f'Archive can not be read: {e}')
+
+	if not has_files:
+		raise DownloadCorrupt(file, 'Archive is empty')
+	return
+
+def _list_archive(file: str) -> List[str]:
+	"""List the files inside an archive
+
+	Args:
+		file (str): The archive
+
+	Returns:
+		List[str]: The paths of the files inside the archive (folders excluded)
+	"""
+	extension = splitext(file)[1].lower()
+	if extension == '.7z':
+		with SevenZipFile(file, 'r') as archive:
+			return [m.filename for m in archive.list() if not m.is_directory]
+
+	archive_class = RarFile if extension == '.rar' else ZipFile
+	with archive_class(file, 'r') as archive:
+		return [c for c in archive.namelist() if not c.endswith('/')]
+
+def _extract_archive(file: str, members: Dict[str, str]) -> None:
+	"""Extract only the given files from an archive, directly to their destination
+
+	Args:
+		file (str): The archive
+		members (Dict[str, str]): Maps the path of a file inside the archive
+		to the path that it should be extracted to
+	"""
+	extension = splitext(file)[1].lower()
+	if extension == '.7z':
+		# py7zr can't stream a single file, so extract the selection
+		# to a temporary folder next to the destination and move it from there
+		dest_folder = join(dirname(file), zip_extract_folder + '_' + basename(file))
+		with SevenZipFile(file, 'r') as archive:
+			archive.extract(path=dest_folder, targets=list(members))
+		for member, dest in members.items():
+			move(join(dest_folder, member), dest)
+		rmtree(dest_folder, ignore_errors=True)
+		return
+
+	archive_class = RarFile if extension == '.rar' else ZipFile
+	with archive_class(file, 'r') as archive:
+		for member, dest in members.items():
+			with archive.open(member) as source, open(dest, 'wb') as target:
+				copyfileobj(source, target)
+	return
+
+def _unzip_archive(file: str, volume_data: Tuple[str, int, int, str]) -> List[str]:
+	"""Extract the relevant files of an archive into the volume folder and delete the archive
+
+	Args:
+		file (str): The archive
+		volume_data (Tuple[str, int, int, str]): The title, year, volume number and folder of the volume
+
+	Returns:
+		List[str]: The paths of the extracted files
+	"""
+	logging.debug(f'Unzipping {file}')
+	title, year, volume_number, folder = volume_data
+	annual = 'annual' in title.lower()
+
+	# 1. Filter non-relevant files based on their names in the archive
+	contents = _list_archive(file)
+	logging.debug(f'Zip contents: {contents}')
+	rel_files = {}
+	for c in contents:
+		if 'variant cover' in c.lower():
+			continue
+
+		result = extract_filename_data(c, False)
+		if (_check_matching_titles(result['series'], title)
+		and (
+			# Year has to match
+			(result['year'] is not None
+				and year - 1 <= result['year'] <= year + 1)
+			# Or volume number
+			or (result['volume_number'] is not None
+				and result['volume_number'] == volume_number)
+			# Or neither should be found (we play it safe so we keep those)
+			or (result['year'] is None and result['volume_number'] is None)
+		)
+		and result['annual'] == annual):
+			rel_files[c] = join(folder, basename(c))
+	logging.debug(f'Zip relevant files: {list(rel_files)}')
+
+	# 2. Extract only the relevant files, straight into the volume folder
+	_extract_archive(file, rel_files)
+
+	# 3. Delete original file
+	remove(file)
+
+	return list(rel_files.values())
+
 def unzip_volume(volume_id: int, file: str=None) -> None:
+	"""Unzip the archives of a volume (or only the given one). Only the files in the archive
+	that are relevant for the volume are kept and they are then renamed.
+
+	Args:
+		volume_id (int): The id of the volume
+		file (str, optional): Only unzip this archive instead of all archives of the volume. Defaults to None.
+	"""
 	cursor = get_db()
 	if file:
 		logging.info(f'Unzipping the following file for volume {volume_id}: {file}')
@@ -175,9 +386,9 @@ def unzip_volume(volume_id: int, file: str=None) -> None:
 				if.issue_id = i.id
 				AND if.file_id = f.id
 			WHERE
-				i.volume_id = ?
-				AND filepath LIKE '%.zip';
-		""", (volume_id,))]
+				i.volume_id = ?;
+		""", (volume_id,))
+		if f[0].lower().endswith(archive_extensions)]
 
 	if not files:
 		return
@@ -186,60 +397,14 @@ def unzip_volume(volume_id: int, file: str=None) -> None:
 		"SELECT title, year, volume_number, folder FROM volumes WHERE id = ? LIMIT 1;",
 		(volume_id,)
 	).fetchone()
-	annual = 'annual' in volume_data[0].lower()
 
-	# All zip files gathered, now handle them one by one
+	# All archives gathered, now handle them at the same time
 	resulting_files = []
-	resulting_files_append = resulting_files.append
-	zip_folder = join(volume_data[3], zip_extract_folder)
-	for f in files:
-		logging.debug(f'Unzipping {f}')
-		
-		# 1. Unzip
-		with ZipFile(f, 'r') as zip:
-			contents = [join(zip_folder, c) for c in zip.namelist() if not c.endswith('/')]
-			logging.debug(f'Zip contents: {contents}')
-			zip.extractall(zip_folder)
-
-		# 2. Delete original file
-		remove(f)
-
-		# 3. Filter non-relevant files
-		rel_files = []
-		rel_files_append = rel_files.append
-		for c in contents:
-			if 'variant cover' in c.lower():
-				continue
-
-			result = extract_filename_data(c, False)
-			if (_check_matching_titles(result['series'], volume_data[0])
-			and (
-				# Year has to match
-				(result['year'] is not None
-     				and volume_data[1] - 1 <= result['year'] <= volume_data[1] + 1)
-				# Or volume number
-				or (result['volume_number'] is not None
-					and result['volume_number'] == volume_data[2])
-				# Or neither should be found (we play it safe so we keep those)
-				or (result['year'] is None and result['volume_number'] is None)
-			)
-			and result['annual'] == annual):
-				rel_files_append(c)
-		logging.debug(f'Zip relevant files: {rel_files}')
-
-		# 4. Delete non-relevant files
-		for c in contents:
-			if not c in rel_files:
-				remove(c)
-
-		# 5. Move restant files to main folder and delete zip folder
-		for c in rel_files:
-			dest = join(volume_data[3], basename(c))
-			move(c, dest)
-			resulting_files_append(dest)
-		rmtree(zip_folder, ignore_errors=True)
-
-	# 6. Rename restant files
+	with ThreadPoolExecutor(min(len(files), unzip_workers), thread_name_prefix='Unzip') as executor:
+		for result in executor.map(lambda f: _unzip_archive(f, volume_data), files):
+			resulting_files += result
+
+	# 4. Rename restant files
 	scan_files(Volume(volume_id).get_info())
 	if resulting_files:
 		mass_rename(volume_id, filepath_filter=resulting_files)
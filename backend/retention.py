@@ -0,0 +1,171 @@
+#-*- coding: utf-8 -*-
+
+"""This file contains functions regarding removing old history entries.
+Removed entries are added to an archive file next to the database,
+so that they can still be exported.
+"""
+
+import logging
+from gzip import open as gzip_open
+from json import dumps
+from os import makedirs
+from os.path import dirname, isfile, join
+from time import time
+from typing import Dict, List
+
+from backend.custom_exceptions import ArchiveNotFound
+from backend.db import DBConnection, get_db
+from backend.settings import Settings
+
+# The amount of entries that are removed at once
+prune_batch_size = 1000
+
+archive_names = {
+	'download_history': 'download_history.jsonl.gz',
+	'task_history': 'task_history.jsonl.gz'
+}
+
+def _archive_file(table: str) -> str:
+	"""Get the path to the archive file of a table
+
+	Args:
+		table (str): The table (key of `archive_names`)
+
+	Returns:
+		str: The path to the file
+	"""
+	return join(dirname(DBConnection.file), 'archive', archive_names[table])
+
+def _archive_rows(table: str, rows: List[dict]) -> None:
+	"""Add entries to the archive file of a table. The file is a gzipped file
+	with one json object per line. Every addition is its own gzip member,
+	which gzip readers read as one file.
+
+	Args:
+		table (str): The table (key of `archive_names`)
+		rows (List[dict]): The entries
+	"""
+	file = _archive_file(table)
+	makedirs(dirname(file), exist_ok=True)
+	with gzip_open(file, 'at', encoding='utf-8') as f:
+		f.writelines(dumps(row) + '\n' for row in rows)
+	return
+
+def prune_download_history(days: int) -> int:
+	"""Remove the download history entries that are older than a certain age
+	and add them to the archive
+
+	Args:
+		days (int): The age in days
+
+	Returns:
+		int: The amount of entries that were removed
+	"""
+	cursor = get_db('dict')
+	cutoff = round(time()) - days * 86400
+	pruned = 0
+	while True:
+		rows = [dict(r) for r in cursor.execute("""
+			SELECT
+				id, original_link, title, downloaded_at
+			FROM download_history
+			WHERE downloaded_at < ?
+			ORDER BY downloaded_at
+			LIMIT ?;
+			""",
+			(cutoff, prune_batch_size)
+		)]
+		if not rows:
+			break
+
+		_archive_rows('download_history', rows)
+		cursor.executemany(
+			"DELETE FROM download_history WHERE id = ?;",
+			((r['id'],) for r in rows)
+		)
+		cursor.connection.commit()
+		pruned += len(rows)
+
+	return pruned
+
+def prune_task_history(days: int) -> int:
+	"""Remove the task history entries that are older than a certain age
+	and add them to the archive. The last run of each task is kept,
+	as it's shown in the task planning.
+
+	Args:
+		days (int): The age in days
+
+	Returns:
+		int: The amount of entries that were removed
+	"""
+	cursor = get_db('dict')
+	cutoff = round(time()) - days * 86400
+	pruned = 0
+	while True:
+		rows = [dict(r) for r in cursor.execute("""
+			SELECT
+				id, task_name, display_title, run_at
+			FROM task_history
+			WHERE
+				run_at < ?
+				AND id NOT IN (
+					SELECT MAX(id)
+					FROM task_history
+					GROUP BY task_name
+				)
+			ORDER BY run_at
+			LIMIT ?;
+			""",
+			(cutoff, prune_batch_size)
+		)]
+		if not rows:
+			break
+
+		_archive_rows('task_history', rows)
+		cursor.executemany(
+			"DELETE FROM task_history WHERE id = ?;",
+			((r['id'],) for r in rows)
+		)
+		cursor.connection.commit()
+		pruned += len(rows)
+
+	return pruned
+
+def prune_history() -> Dict[str, int]:
+	"""Remove the history entries that are older than the retention settings allow
+
+	Returns:
+		Dict[str, int]: The amount of entries that were removed per table
+	"""
+	settings = Settings().get_settings()
+	result = {}
+	for table, setting, prune in (
+		('download_history', 'download_history_retention', prune_download_history),
+		('task_history', 'task_history_retention', prune_task_history)
+	):
+		days = int(settings[setting])
+		if not days:
+			# Kept forever
+			continue
+		result[table] = prune(days)
+		if result[table]:
+			logging.info(f'Moved {result[table]} entries of {table} older than {days} days to the archive')
+	return result
+
+def get_archive(table: str) -> str:
+	"""Get the archive file of a table
+
+	Args:
+		table (str): The table (key of `archive_names`)
+
+	Raises:
+		ArchiveNotFound: Nothing of the table has been archived yet
+
+	Returns:
+		str: The path to the file
+	"""
+	file = _archive_file(table)
+	if not isfile(file):
+		raise ArchiveNotFound
+	return file
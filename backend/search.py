@@ -9,6 +9,8 @@ Inspired by Mylar3:
 import logging
 from asyncio import create_task, gather, run
 from re import compile
+from threading import Lock
+from time import perf_counter, sleep
 from typing import Dict, List
 
 from aiohttp import ClientSession
@@ -18,11 +20,51 @@ from requests import get
 from backend.blocklist import blocklist_contains
 from backend.db import get_db
 from backend.files import extract_filename_data
+from backend.metrics import http_trace_configs
 from backend.settings import private_settings
 
 clean_title_regex = compile(r'((?<=annual)s|(?!\s)\-(?!\s)|\+|,|\!|:|\bthe\s|’|\'|\")')
 clean_title_regex_2 = compile(r'(\s-\s|\s+|/)')
 
+class _GetComicsPacer:
+	"""Spaces out the requests to GetComics, so that multiple searches running
+	at the same time (e.g. during `tasks.SearchAll`) don't flood the site
+	"""
+	def __init__(self, interval: float) -> None:
+		"""Setup the pacer
+
+		Args:
+			interval (float): The minimum amount of seconds between two requests
+		"""
+		self.interval = interval
+		self.next_request = 0.0
+		self.lock = Lock()
+		return
+
+	def wait(self) -> None:
+		"""Block until the next request to GetComics is allowed to be made
+		"""
+		with self.lock:
+			now = perf_counter()
+			wait_time = self.next_request - now
+			self.next_request = max(now, self.next_request) + self.interval
+		if wait_time > 0:
+			sleep(wait_time)
+		return
+
+	def back_off(self, seconds: float) -> None:
+		"""Delay all upcoming requests, for when GetComics asks us to slow down
+
+		Args:
+			seconds (float): The amount of seconds to wait before the next request
+		"""
+		logging.warning(f'GetComics rate limit reached, waiting {seconds} seconds')
+		with self.lock:
+			self.next_request = max(self.next_request, perf_counter() + seconds)
+		return
+
+getcomics_pacer = _GetComicsPacer(private_settings['getcomics_search_interval'])
+
 def _check_matching_titles(title1: str, title2: str) -> bool:
 	"""Determine if two titles match; if they refer to the same thing.
 
@@ -209,7 +251,7 @@ class SearchSources:
 			return await response.text()
 
 	async def __fetch_GC_pages(self, pages: range):
-		async with ClientSession() as session:
+		async with ClientSession(trace_configs=http_trace_configs()) as session:
 			tasks = [
 				create_task(self.__fetch_one(
 					session,
@@ -227,17 +269,26 @@ class SearchSources:
 		Returns:
 			List[dict]: The search results
 		"""		
-		search_results = get(
-			private_settings["getcomics_url"],
-			params={'s': self.query},
-			headers={'user-agent': 'Kapowarr'},
-			timeout=30
-		).text
+		for _ in range(2):
+			getcomics_pacer.wait()
+			response = get(
+				private_settings["getcomics_url"],
+				params={'s': self.query},
+				headers={'user-agent': 'Kapowarr'},
+				timeout=30
+			)
+			if response.status_code != 429:
+				break
+			retry_after = response.headers.get('Retry-After', '')
+			getcomics_pacer.back_off(int(retry_after) if retry_after.isdigit() else 60)
+		search_results = response.text
 		soup = BeautifulSoup(search_results, 'html.parser')
 		pages = soup.find_all(['a','span'], {"class": 'page-numbers'})
 		pages = min(int(pages[-1].get_text(strip=True)), 10) if pages else 1
 
 		results = []
+		if pages > 1:
+			getcomics_pacer.wait()
 		parsed_results = run(self.__fetch_GC_pages(range(2, pages + 1)))
 		for page in [soup] + parsed_results:
 			results += page.find_all('article', {'class': 'post'})
@@ -393,27 +444,26 @@ def auto_search(volume_id: int, issue_id: int=None) -> List[dict]:
 		cursor.execute(
 			"""
 			SELECT calculated_issue_number
-			FROM issues i
-			LEFT JOIN issues_files if
-			ON i.id = if.issue_id
-			WHERE
-				file_id IS NULL
-				AND volume_id = ?
-				AND monitored = 1;
+			FROM wanted_issues w
+			INNER JOIN issues i
+			ON w.issue_id = i.id
+			WHERE w.volume_id = ?;
 			""",
 			(volume_id,)
 		)
-		searchable_issues = tuple(map(lambda i: i[0], cursor))
-		if not searchable_issues:
+		open_issues = tuple(map(lambda i: i[0], cursor))
+		if not open_issues:
 			result = []
 			logging.debug(f'Auto search results: {result}')
 			return result
 
-		total_count = cursor.execute(
-			"SELECT COUNT(1) FROM issues WHERE volume_id = ?",
+		# Used for checking if all issues that an issue range covers are open
+		issue_numbers = tuple(map(lambda i: i[0], cursor.execute(
+			"SELECT calculated_issue_number FROM issues WHERE volume_id = ?;",
 			(volume_id,)
-		).fetchone()[0]
-		all_open = len(searchable_issues) == total_count
+		)))
+		all_open = len(open_issues) == len(issue_numbers)
+		searchable_issues = set(open_issues)
 		
 	else:
 		# Auto search issue
@@ -460,14 +510,10 @@ def auto_search(volume_id: int, issue_id: int=None) -> List[dict]:
 				if isinstance(result['issue_number'], tuple):
 					# Release is an issue range
 					# Only allow range if all the issues that the range covers are open
-					covered_issues = tuple(map(lambda i: i[0], cursor.execute("""
-						SELECT calculated_issue_number
-						FROM issues
-						WHERE
-							volume_id = ?
-							AND calculated_issue_number >= ?
-							AND calculated_issue_number <= ?;
-					""", (volume_id, *result['issue_number']))))
+					covered_issues = (
+						i for i in issue_numbers
+						if result['issue_number'][0] <= i <= result['issue_number'][1]
+					)
 					if any(not i in searchable_issues for i in covered_issues):
 						continue
 				else:
@@ -4,6 +4,7 @@
 """
 
 import logging
+from hmac import compare_digest
 from os import urandom
 from os.path import isdir
 from os.path import sep as path_sep
@@ -16,6 +17,7 @@ from backend.custom_exceptions import (FolderNotFound, InvalidSettingKey,
 from backend.db import __DATABASE_VERSION__, get_db
 from backend.files import folder_path
 from backend.logging import log_levels, set_log_level
+from backend.metrics import set_metrics_enabled
 
 default_settings = {
 	'host': '0.0.0.0',
@@ -29,14 +31,42 @@ default_settings = {
 	'download_folder': folder_path('temp_downloads'),
 	'log_level': 'info',
 	'database_version': __DATABASE_VERSION__,
-	'unzip': False
+	'unzip': False,
+	'search_all_concurrency': 3,
+	'fsync_imports': False,
+	'import_mode': 'move',
+	'enable_metrics': False,
+	'mirror_selection': 'preference',
+	'hardlink_duplicates': False,
+	# Days that history entries are kept, 0 is forever.
+	# Pruning moves entries to the archive, so users have to opt in.
+	'download_history_retention': 0,
+	'task_history_retention': 0,
+	# Web server, changes are applied after a restart
+	'hosting_threads': 10,
+	'connection_limit': 100,
+	'channel_timeout': 120
 }
 
 private_settings = {
 	'comicvine_url': 'https://comicvine.gamespot.com',
 	'comicvine_api_url': 'https://comicvine.gamespot.com/api',
 	'getcomics_url': 'https://getcomics.org',
-	'hosting_threads': 10,
+	'getcomics_search_interval': 1.0,
+	# ComicVine allows 200 requests per resource per hour
+	'comicvine_search_interval': 18.0,
+	# Each event stream occupies a hosting thread for as long as it's open
+	'max_event_streams': 5,
+	# Events that can wait for a slow event stream client before
+	# the client is sent the complete state instead
+	'event_queue_size': 100,
+	# Part of the hosting threads that are left after the event streams,
+	# that can be busy with slow requests (like searching) at the same time
+	'long_request_share': 0.5,
+	# Seconds that the links that a getcomics page resolved to are remembered
+	'download_link_cache_ttl': 21600,
+	# Connections used at the same time for one Mega download
+	'mega_connections': 4,
 	'version': 'v1.0.0-beta-1',
 	'python_version': ".".join(str(i) for i in list(version_info))
 }
@@ -53,18 +83,29 @@ task_intervals = {
 	# Tasks at the same interval, but that should be
 	# run after each other should be put in that order in this dict
 	'update_all': 3600, # every hour
-	'search_all': 86400 # every day
+	'search_all': 86400, # every day
+	'find_duplicates': 86400, # every day
+	'prune_history': 86400 # every day
 }
 
 blocklist_reasons = {
 	1: 'Link broken',
 	2: 'Source not supported',
 	3: 'No supported or working links',
-	4: 'Added by user'
+	4: 'Added by user',
+	5: 'Download corrupt'
 }
 
 credential_sources = ('mega',)
 
+# How a download gets into the volume folder. With the link modes,
+# the original download is kept in the download folder.
+import_modes = ('move', 'hardlink', 'reflink')
+
+# How the mirror of a download is chosen when a download is offered on
+# multiple mirrors: the first that works, or the fastest after testing them all
+mirror_selection_modes = ('preference', 'fastest')
+
 supported_source_strings = (('mega', 'mega link'),
 							('mediafire', 'mediafire link'),
 							('getcomics', 'download now','main server','mirror download','link 1','link 2'))
@@ -73,6 +114,8 @@ class Settings:
 	"""For interacting with the settings
 	"""	
 	cache = {}
+	# The api key, encoded for comparing
+	api_key_cache: bytes = None
 	
 	def get_settings(self, use_cache: bool=True) -> dict:
 		"""Get all settings and their values
@@ -88,10 +131,42 @@ class Settings:
 				"SELECT key, value FROM config;"
 			))
 			settings['unzip'] = settings['unzip'] == 1
+			settings['fsync_imports'] = settings['fsync_imports'] == 1
+			settings['enable_metrics'] = settings['enable_metrics'] == 1
+			settings['hardlink_duplicates'] = settings['hardlink_duplicates'] == 1
 			self.cache.update(settings)
 
 		return self.cache
 
+	def check_api_key(self, api_key: str) -> bool:
+		"""Check if an api key is the current api key. The comparison takes
+		the same amount of time no matter how much of the key is correct.
+
+		Args:
+			api_key (str): The api key to check
+
+		Returns:
+			bool: Wether or not the api key is correct
+		"""
+		if Settings.api_key_cache is None:
+			Settings.api_key_cache = self.get_settings()['api_key'].encode('utf-8')
+		return compare_digest(api_key.encode('utf-8'), Settings.api_key_cache)
+
+	def check_password(self, password: str) -> bool:
+		"""Check if a password is the login password, in constant time
+
+		Args:
+			password (str): The password to check
+
+		Returns:
+			bool: Wether or not the password is correct (always `True` if no password is set)
+		"""
+		auth_password = self.get_settings().get('auth_password', '')
+		return auth_password == '' or compare_digest(
+			password.encode('utf-8'),
+			auth_password.encode('utf-8')
+		)
+
 	def set_settings(self, settings: dict) -> dict:
 		"""Change the values of settings
 
@@ -128,6 +203,30 @@ class Settings:
 			elif key == 'log_level' and not value in log_levels:
 				raise InvalidSettingValue(key, value)
 
+			elif key == 'import_mode' and not value in import_modes:
+				raise InvalidSettingValue(key, value)
+
+			elif key == 'mirror_selection' and not value in mirror_selection_modes:
+				raise InvalidSettingValue(key, value)
+
+			elif key in ('fsync_imports', 'enable_metrics', 'hardlink_duplicates') and not isinstance(value, bool):
+				raise InvalidSettingValue(key, value)
+
+			elif key in ('search_all_concurrency', 'hosting_threads',
+						'connection_limit', 'channel_timeout'):
+				if not str(value).isdigit() or int(value) < 1:
+					raise InvalidSettingValue(key, value)
+				value = int(value)
+				if (key == 'hosting_threads'
+				and value < private_settings['max_event_streams'] + 2):
+					# Room for the event streams, a slow request and a short request
+					raise InvalidSettingValue(key, value)
+
+			elif key in ('download_history_retention', 'task_history_retention'):
+				if not str(value).isdigit():
+					raise InvalidSettingValue(key, value)
+				value = int(value)
+
 			elif key == 'url_base':
 				if value:
 					if not value.startswith('/'):
@@ -148,6 +247,9 @@ class Settings:
 			if 'log_level' in settings:
 				set_log_level(settings['log_level'])
 
+			if 'enable_metrics' in settings:
+				set_metrics_enabled(settings['enable_metrics'])
+
 			result = self.get_settings(use_cache=False)
 		else:
 			result = self.get_settings()
@@ -176,6 +278,8 @@ class Settings:
 			(default_settings[key], key)
 		)
 		logging.info(f'Setting reset: {key}->{default_settings[key]}')
+		if key == 'enable_metrics':
+			set_metrics_enabled(default_settings[key])
 		return self.get_settings(use_cache=False)
 		
 	def generate_api_key(self) -> dict:
@@ -191,6 +295,7 @@ class Settings:
 			(api_key,)
 		)
 		logging.info(f'Setting api key regenerated: {api_key}')
+		Settings.api_key_cache = None
 
 		return self.get_settings(use_cache=False)
 
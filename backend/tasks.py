@@ -5,20 +5,39 @@
 
 import logging
 from abc import ABC, abstractmethod
-from threading import Thread, Timer
-from time import time
-from typing import Dict, List, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from json import dumps
+from sys import maxsize
+from threading import Lock, Thread, Timer
+from time import perf_counter, sleep, time
+from typing import Dict, List, Tuple, Union
 
+from flask import Flask, current_app
+
+from backend.comicvine import ComicVine
 from backend.custom_exceptions import (InvalidComicVineApiKey,
                                        TaskNotDeletable, TaskNotFound)
 from backend.db import get_db
 from backend.download import DownloadHandler
+from backend.duplicates import hash_files, link_duplicates
+from backend.events import event_hub
+from backend.library_import import (add_library_import_groups,
+                                    clear_library_import,
+                                    group_unimported_files, import_library,
+                                    match_group, set_library_import_match)
+from backend.metrics import metrics
+from backend.naming import mass_rename
 from backend.post_processing import unzip_volume
+from backend.retention import prune_history
 from backend.search import auto_search
-from backend.volumes import refresh_and_scan
+from backend.settings import Settings, private_settings
+from backend.volumes import Volume, refresh_and_scan
 
 
 class Task(ABC):
+	# Set by the TaskHandler right before the task is run
+	download_handler: DownloadHandler = None
+
 	@property
 	@abstractmethod
 	def stop(self) -> bool:
@@ -233,7 +252,10 @@ class UpdateAll(Task):
 		return
 
 class SearchAll(Task):
-	"""Trigger an automatic search for each volume in the library
+	"""Trigger an automatic search for each volume in the library.
+	The volumes are searched for concurrently and any result is directly
+	added to the download queue. When the task is interrupted, the next run
+	continues where this one stopped.
 	"""	
 	stop = False
 	message = ''
@@ -243,20 +265,392 @@ class SearchAll(Task):
 	volume_id = None
 	issue_id = None
 
-	def run(self) -> List[tuple]:
-		cursor = get_db(temp=True)
-		cursor.execute(
-			"SELECT id, title FROM volumes WHERE monitored = 1;"
-		)
-		downloads = []
-		for volume_id, volume_title in cursor:
-			if self.stop: break
+	def __search_volume(self, app: Flask, volume_id: int, volume_title: str) -> bool:
+		"""Search for a volume and add the results to the download queue.
+		Intended to be run in a thread.
+
+		Args:
+			app (Flask): The app of which to use the context
+			volume_id (int): The id of the volume to search for
+			volume_title (str): The title of the volume
+
+		Returns:
+			bool: Wether or not the volume was searched for.
+			`False` when the task was stopped before it could.
+		"""
+		if self.stop:
+			return False
+
+		with app.app_context():
 			self.message = f'Searching for {volume_title}'
-			# Get search results and download them
 			results = auto_search(volume_id)
-			if results:
-				downloads += [(result['link'], volume_id) for result in results]
-		return downloads
+			for result in results:
+				self.download_handler.add(result['link'], volume_id)
+		return True
+
+	def __save_progress(self, last_id: int) -> None:
+		"""Remember up to which volume the library has been searched
+
+		Args:
+			last_id (int): The id of the volume up to which (inclusive)
+			all volumes have been searched
+		"""
+		cursor = get_db()
+		cursor.execute(
+			"INSERT OR REPLACE INTO task_progress(task_name, last_id) VALUES (?,?);",
+			(self.action, last_id)
+		)
+		cursor.connection.commit()
+		return
+
+	def run(self) -> List[tuple]:
+		cursor = get_db()
+		last_id = cursor.execute(
+			"SELECT last_id FROM task_progress WHERE task_name = ? LIMIT 1;",
+			(self.action,)
+		).fetchone()
+		last_id = last_id[0] if last_id else 0
+		if last_id:
+			logging.info(f'Resuming {self.display_title} after volume {last_id}')
+
+		# Only volumes that have open issues need to be searched for
+		volumes = cursor.execute(
+			"""
+			SELECT id, title
+			FROM volumes
+			WHERE
+				id IN (SELECT volume_id FROM wanted_issues)
+				AND id > ?
+			ORDER BY id;
+			""",
+			(last_id,)
+		).fetchall()
+		max_workers = int(Settings().get_settings()['search_all_concurrency'])
+		app = current_app._get_current_object()
+
+		# Volumes are done out of order, so only move the progress forward
+		# when all volumes before it are done too
+		order = [v[0] for v in volumes]
+		next_index = 0
+		done = set()
+		with ThreadPoolExecutor(max_workers, thread_name_prefix='Search All') as executor:
+			futures = {
+				executor.submit(self.__search_volume, app, volume_id, volume_title): volume_id
+				for volume_id, volume_title in volumes
+			}
+			for future in as_completed(futures):
+				try:
+					if not future.result():
+						continue
+				except Exception:
+					# Not done, so an interrupted run is resumed from this volume
+					logging.exception(f'An error occured while searching for volume {futures[future]}: ')
+					continue
+				done.add(futures[future])
+
+				start_index = next_index
+				while next_index < len(order) and order[next_index] in done:
+					next_index += 1
+				if next_index > start_index:
+					self.__save_progress(order[next_index - 1])
+
+		if not self.stop:
+			# Whole library searched so next run starts from the beginning
+			cursor.execute(
+				"DELETE FROM task_progress WHERE task_name = ?;",
+				(self.action,)
+			)
+			cursor.connection.commit()
+		return []
+
+class MassRenameAll(Task):
+	"""Rename the files of all volumes in the library, following the naming settings.
+	The volumes of each root folder are renamed one by one, but the root folders
+	are handled at the same time.
+	"""
+	stop = False
+	message = ''
+	action = 'mass_rename_all'
+	display_title = 'Rename All'
+	category = ''
+	volume_id = None
+	issue_id = None
+
+	def __rename_root_folder(self, app: Flask, volumes: List[int]) -> None:
+		"""Rename the volumes of a root folder. Intended to be run in a thread.
+
+		Args:
+			app (Flask): The app of which to use the context
+			volumes (List[int]): The ids of the volumes in the root folder
+		"""
+		for volume_id in volumes:
+			if self.stop:
+				break
+
+			# New context per volume so that changes are committed per volume
+			with app.app_context():
+				try:
+					mass_rename(volume_id)
+				except Exception:
+					logging.exception(f'An error occured while renaming volume {volume_id}: ')
+
+			with self.__progress_lock:
+				self.__done += 1
+				self.message = f'Renamed {self.__done}/{self.__total} volumes'
+		return
+
+	def run(self) -> None:
+		root_folders: Dict[int, List[int]] = {}
+		for volume_id, root_folder in get_db().execute(
+			"SELECT id, root_folder FROM volumes ORDER BY id;"
+		):
+			root_folders.setdefault(root_folder, []).append(volume_id)
+		if not root_folders:
+			return
+
+		self.__total = sum(map(len, root_folders.values()))
+		self.__done = 0
+		self.__progress_lock = Lock()
+		self.message = f'Renamed 0/{self.__total} volumes'
+		app = current_app._get_current_object()
+
+		with ThreadPoolExecutor(len(root_folders), thread_name_prefix='Rename All') as executor:
+			for future in [
+				executor.submit(self.__rename_root_folder, app, volumes)
+				for volumes in root_folders.values()
+			]:
+				future.result()
+		return
+
+class MassEdit(Task):
+	"""Apply actions to multiple volumes or issues, one after another
+	"""
+	stop = False
+	message = ''
+	action = 'mass_edit'
+	display_title = 'Mass Edit'
+	category = ''
+	volume_id = None
+	issue_id = None
+
+	def __init__(self,
+		volume_ids: List[int]=None,
+		issue_ids: List[int]=None,
+		root_folder_id: int=None,
+		refresh: bool=False,
+		rename: bool=False,
+		search: bool=False
+	):
+		"""Create the task
+
+		Args:
+			volume_ids (List[int], optional): The ids of the volumes to apply the actions to. Defaults to None.
+			issue_ids (List[int], optional): The ids of the issues to apply the actions to. Defaults to None.
+			root_folder_id (int, optional): Move the volumes to this root folder. Defaults to None.
+			refresh (bool, optional): Refresh and scan the volumes. Defaults to False.
+			rename (bool, optional): Rename the files of the volumes or issues. Defaults to False.
+			search (bool, optional): Do an automatic search for the volumes or issues. Defaults to False.
+		"""
+		self.volume_ids = volume_ids or []
+		self.issue_ids = issue_ids or []
+		self.root_folder_id = root_folder_id
+		self.refresh = refresh
+		self.rename = rename
+		self.search = search
+
+	def __edit_volume(self, volume_id: int) -> None:
+		if self.root_folder_id is not None:
+			Volume(volume_id)._edit_root_folder(self.root_folder_id)
+
+		if self.refresh:
+			try:
+				refresh_and_scan(volume_id)
+			except InvalidComicVineApiKey:
+				self.refresh = False
+
+		if self.rename:
+			mass_rename(volume_id)
+
+		if self.search:
+			for result in auto_search(volume_id):
+				self.download_handler.add(result['link'], volume_id)
+		return
+
+	def __edit_issue(self, volume_id: int, issue_id: int) -> None:
+		if self.rename:
+			mass_rename(volume_id, issue_id)
+
+		if self.search:
+			for result in auto_search(volume_id, issue_id):
+				self.download_handler.add(result['link'], volume_id, issue_id)
+		return
+
+	def run(self) -> None:
+		cursor = get_db()
+		items = [(volume_id, None) for volume_id in self.volume_ids]
+		if self.issue_ids:
+			items += cursor.execute("""
+				SELECT volume_id, id
+				FROM issues
+				WHERE id IN (SELECT value FROM json_each(?))
+				ORDER BY volume_id, calculated_issue_number;
+				""",
+				(dumps(self.issue_ids),)
+			).fetchall()
+
+		for index, (volume_id, issue_id) in enumerate(items):
+			if self.stop:
+				break
+			self.message = f'Editing {index + 1}/{len(items)}'
+
+			try:
+				if issue_id is None:
+					self.__edit_volume(volume_id)
+				else:
+					self.__edit_issue(volume_id, issue_id)
+			except Exception:
+				logging.exception(f'An error occured while editing volume {volume_id}{f" issue {issue_id}" if issue_id else ""}: ')
+			cursor.connection.commit()
+		return
+
+class ScanLibraryImport(Task):
+	"""Find the files in the root folders that aren't part of a volume yet
+	and propose a ComicVine volume for each series that they form
+	"""
+	stop = False
+	message = ''
+	action = 'library_import_scan'
+	display_title = 'Scan Library Import'
+	category = ''
+	volume_id = None
+	issue_id = None
+
+	def __init__(self, root_folder_id: int=None):
+		"""Create the task
+
+		Args:
+			root_folder_id (int, optional): Only scan this root folder. Defaults to None.
+		"""
+		self.root_folder_id = root_folder_id
+
+	def run(self) -> None:
+		cursor = get_db()
+		try:
+			cv = ComicVine()
+		except InvalidComicVineApiKey:
+			return
+
+		self.message = 'Looking for files to import'
+		clear_library_import(self.root_folder_id)
+		groups = group_unimported_files(self.root_folder_id)
+		proposal_ids = add_library_import_groups(groups)
+		cursor.connection.commit()
+
+		# Groups of the same series in different folders share a search
+		matches: Dict[tuple, dict] = {}
+		interval = private_settings['comicvine_search_interval']
+		next_search = 0.0
+		for index, (proposal_id, group) in enumerate(zip(proposal_ids, groups)):
+			if self.stop:
+				break
+			self.message = f'Matching {index + 1}/{len(groups)}: {group["series"]}'
+
+			key = (group['series'].lower(), group['volume_number'], group['year'])
+			if not key in matches:
+				wait_time = next_search - perf_counter()
+				if wait_time > 0:
+					sleep(wait_time)
+				next_search = perf_counter() + interval
+				try:
+					matches[key] = match_group(cv, group)
+				except Exception:
+					logging.exception(f'An error occured while matching {group["series"]}: ')
+					matches[key] = None
+
+			if matches[key]:
+				set_library_import_match(proposal_id, matches[key])
+				cursor.connection.commit()
+		return
+
+class LibraryImport(Task):
+	"""Add the volumes of the confirmed library import proposals
+	"""
+	stop = False
+	message = ''
+	action = 'library_import'
+	display_title = 'Library Import'
+	category = ''
+	volume_id = None
+	issue_id = None
+
+	def __init__(self, entries: List[dict]=None, monitor: bool=True):
+		"""Create the task
+
+		Args:
+			entries (List[dict], optional): The confirmed proposals (`id` and `comicvine_id`). Defaults to None.
+			monitor (bool, optional): Wether or not to monitor the new volumes. Defaults to True.
+		"""
+		self.entries = entries or []
+		self.monitor = monitor
+
+	def run(self) -> None:
+		if not self.entries:
+			return
+
+		self.message = f'Importing {len(self.entries)} series'
+		try:
+			import_library(self.entries, self.monitor)
+		except InvalidComicVineApiKey:
+			pass
+		return
+
+class FindDuplicates(Task):
+	"""Hash the files of the library to find files with the same content and,
+	if enabled in the settings, replace the duplicates by hardlinks
+	"""
+	stop = False
+	message = ''
+	action = 'find_duplicates'
+	display_title = 'Find Duplicates'
+	category = ''
+	volume_id = None
+	issue_id = None
+
+	def __init__(self, volume_id: int=None):
+		"""Create the task
+
+		Args:
+			volume_id (int, optional): Only handle the files of this volume. Defaults to None.
+		"""
+		self.volume_id = volume_id
+
+	def run(self) -> None:
+		self.message = 'Hashing files'
+		hash_files(self.volume_id)
+
+		if Settings().get_settings()['hardlink_duplicates']:
+			self.message = 'Replacing duplicates by hardlinks'
+			freed = link_duplicates(self.volume_id)
+			if freed:
+				logging.info(f'Freed {freed} bytes by hardlinking duplicates')
+		return
+
+class PruneHistory(Task):
+	"""Move the history entries that are older than the retention settings
+	allow to the archive
+	"""
+	stop = False
+	message = ''
+	action = 'prune_history'
+	display_title = 'Prune History'
+	category = ''
+	volume_id = None
+	issue_id = None
+
+	def run(self) -> None:
+		self.message = 'Moving old history entries to the archive'
+		prune_history()
+		return
 
 #=====================
 # Task handling
@@ -289,12 +683,14 @@ class TaskHandler:
 		"""
 		try:
 			logging.debug(f'Running task {task.display_title}')
+			metrics.start_scope(task.action)
 			with self.context():
+				task.download_handler = self.download_handler
 				result = task.run()
 
 				# Note in history
 				get_db().execute(
-					"INSERT INTO task_history VALUES (?,?,?);",
+					"INSERT INTO task_history(task_name, display_title, run_at) VALUES (?,?,?);",
 					(task.action, task.display_title, round(time()))
 				)
 
@@ -304,10 +700,13 @@ class TaskHandler:
 							self.download_handler.add(*download)
 
 					self.queue.pop(0)
+					event_hub.notify()
 					self._process_queue()
 					logging.info(f'Finished task {task.display_title}')
 		except Exception:
 			logging.exception('An error occured while trying to run a task: ')
+		finally:
+			metrics.end_scope(task=True)
 		return
 		
 	def _process_queue(self) -> None:
@@ -322,6 +721,7 @@ class TaskHandler:
 		if first_entry['status'] != 'running':
 			first_entry['status'] = 'running'
 			first_entry['thread'].start()
+			event_hub.notify()
 		return
 
 	def add(self, task: Task) -> int:
@@ -342,6 +742,7 @@ class TaskHandler:
 			'thread': Thread(target=self.__run_task, args=(task,), name="Task Handler")
 		}
 		self.queue.append(task_data)
+		event_hub.notify()
 		logging.info(f'Added task: {task.display_title} ({id})')
 		self._process_queue()
 		return id
@@ -469,30 +870,40 @@ class TaskHandler:
 		task['task'].stop = True
 		task['thread'].join()
 		self.queue.remove(task)
+		event_hub.notify()
 		logging.info(f'Removed task: {task["task"].display_name} ({task_id})')
 		return
 
-def get_task_history(offset: int=0) -> List[dict]:
-	"""Get the task history in blocks of 50.
+def get_task_history(before: Tuple[int, int]=None, offset: int=0) -> List[dict]:
+	"""Get the task history in blocks of 50, newest first.
 
 	Args:
-		offset (int, optional): The offset of the list. The higher the number, the deeper into history you go. Defaults to 0.
+		before (Tuple[int, int], optional): The `run_at` and `id` of the
+		last entry of the previous block, to get the block after it.
+		Defaults to None (first block).
+		offset (int, optional): Deprecated, use `before` instead. The number of
+		the block to get, when `before` isn't given. Defaults to 0.
 
 	Returns:
 		List[dict]: The history entries.
 	"""	
+	if before is None:
+		before = (maxsize, maxsize)
+	else:
+		offset = 0
 	result = list(map(
 		dict,
 		get_db('dict').execute(
 			"""
 			SELECT
-				task_name, display_title, run_at
+				id, task_name, display_title, run_at
 			FROM task_history
-			ORDER BY run_at DESC
+			WHERE (run_at, id) < (?, ?)
+			ORDER BY run_at DESC, id DESC
 			LIMIT 50
 			OFFSET ?;
 			""",
-			(offset * 50,)
+			(*before, offset * 50)
 		)
 	))
 	return result
@@ -5,16 +5,20 @@
 
 import logging
 from io import BytesIO
+from json import dumps
 from time import time
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple, Union
 
 from backend.comicvine import ComicVine
-from backend.custom_exceptions import (IssueNotFound, VolumeAlreadyAdded,
-                                       VolumeDownloadedFor, VolumeNotFound)
+from backend.custom_exceptions import (InvalidKeyValue, IssueNotFound,
+                                       VolumeAlreadyAdded, VolumeDownloadedFor,
+                                       VolumeNotFound)
 from backend.db import get_db
 from backend.files import (create_volume_folder, delete_volume_folder,
                            move_volume_folder, scan_files)
+from backend.naming import invalidate_formatting_context
 from backend.root_folders import RootFolders
+from backend.wanted import update_wanted
 from frontend.ui import ui_vars
 
 #=====================
@@ -34,11 +38,12 @@ class Issue:
 		"""
 		self.id = id
 		issue_found = get_db().execute(
-			"SELECT 1 FROM issues WHERE id = ? LIMIT 1",
+			"SELECT volume_id FROM issues WHERE id = ? LIMIT 1",
 			(id,)
-		)
-		if not (1,) in issue_found:
+		).fetchone()
+		if issue_found is None:
 			raise IssueNotFound
+		self.volume_id: int = issue_found[0]
 		
 	def get_info(self) -> dict:
 		"""Get all info about the issue
@@ -88,6 +93,7 @@ class Issue:
 			"UPDATE issues SET monitored = 1 WHERE id = ?",
 			(self.id,)
 		)
+		update_wanted(issue_id=self.id)
 		return
 		
 	def unmonitor(self) -> None:
@@ -98,6 +104,7 @@ class Issue:
 			"UPDATE issues SET monitored = 0 WHERE id = ?",
 			(self.id,)
 		)
+		update_wanted(issue_id=self.id)
 		return
 
 #=====================
@@ -232,6 +239,7 @@ class Volume:
 			"UPDATE volumes SET monitored = 1 WHERE id = ?",
 			(self.id,)
 		)
+		update_wanted(self.id)
 		return
 
 	def _unmonitor(self) -> None:
@@ -242,6 +250,7 @@ class Volume:
 			"UPDATE volumes SET monitored = 0 WHERE id = ?",
 			(self.id,)
 		)
+		update_wanted(self.id)
 		return
 
 	def _edit_root_folder(self, root_folder_id: int) -> None:
@@ -317,6 +326,7 @@ class Volume:
 		# Delete metadata entries
 		# ON DELETE CASCADE will take care of issues
 		cursor.execute("DELETE FROM volumes WHERE id = ?", (self.id,))
+		invalidate_formatting_context(self.id)
 
 		return
 
@@ -432,6 +442,7 @@ def refresh_and_scan(volume_id: int=None) -> None:
 				"UPDATE volumes SET last_cv_update = ?, last_cv_fetch = ? WHERE id = ?;",
 				(volume_data['date_last_updated'], one_day_ago + 86400, ids[volume_data['comicvine_id']][0])
 			)
+			invalidate_formatting_context(ids[volume_data['comicvine_id']][0])
 	cursor.connection.commit()
 
 	# Scan for files
@@ -457,20 +468,61 @@ class Library:
 		'publisher': 'publisher, title, year, volume_number'
 	}
 	
-	def __format_lib_output(self, library: List[dict]) -> List[dict]:
-		"""Format the library entries for API response
+	def __format_lib_entry(self, entry: dict) -> dict:
+		"""Format a library entry for API response
 
 		Args:
-			library (List[dict]): The unformatted library entries list
+			entry (dict): The unformatted library entry
 
 		Returns:
-			List[dict]: The formatted library list
+			dict: The formatted library entry
 		"""
-		for entry in library:
-			entry['monitored'] = entry['monitored'] == 1
-			entry['cover'] = f'{ui_vars["url_base"]}/api/volumes/{entry["id"]}/cover'
-		return library
-	
+		entry['monitored'] = entry['monitored'] == 1
+		entry['cover'] = f'{ui_vars["url_base"]}/api/volumes/{entry["id"]}/cover'
+		return entry
+
+	def iter_volumes(self, sort: str='title') -> Iterator[dict]:
+		"""Go over all volumes in the library, one at a time, straight from the database.
+		Use this instead of `get_volumes()` when the volumes don't all need to be in memory.
+
+		Args:
+			sort (str, optional): How to sort the list. `title`, `year`, `volume_number`, `recently_added` and `publisher` allowed. Defaults to 'title'.
+
+		Returns:
+			Iterator[dict]: The volumes in the library.
+		"""
+		# Determine sorting order
+		sort = self.sorting_orders[sort]
+
+		# Own cursor, so that other queries can be done while iterating
+		cursor = get_db('dict', temp=True)
+		try:
+			cursor.execute(f"""
+				SELECT
+					id, comicvine_id,
+					title, year, publisher,
+					volume_number, description,
+					monitored,
+					(
+						SELECT COUNT(*)
+						FROM issues
+						WHERE volume_id = volumes.id
+					) AS issue_count,
+					(
+						SELECT COUNT(DISTINCT issue_id)
+						FROM issues i
+						INNER JOIN issues_files if
+						ON i.id = if.issue_id
+						WHERE volume_id = volumes.id
+					) AS issues_downloaded
+				FROM volumes
+				ORDER BY {sort};
+				""")
+			for volume in cursor:
+				yield self.__format_lib_entry(dict(volume))
+		finally:
+			cursor.close()
+
 	def get_volumes(self, sort: str='title') -> List[dict]:
 		"""Get all volumes in the library
 
@@ -479,37 +531,25 @@ class Library:
 
 		Returns:
 			List[dict]: The list of volumes in the library.
-		"""		
-		# Determine sorting order
-		sort = self.sorting_orders[sort]
+		"""
+		return list(self.iter_volumes(sort))
 
-		# Fetch all volumes
-		volumes = list(map(dict, get_db('dict').execute(f"""
-			SELECT
-				id, comicvine_id,
-				title, year, publisher,
-				volume_number, description,
-				monitored,
-				(
-					SELECT COUNT(*)
-					FROM issues
-					WHERE volume_id = volumes.id
-				) AS issue_count,
-				(
-					SELECT COUNT(DISTINCT issue_id)
-					FROM issues i
-					INNER JOIN issues_files if
-					ON i.id = if.issue_id
-					WHERE volume_id = volumes.id
-				) AS issues_downloaded
-			FROM volumes
-			ORDER BY {sort};
-		""")))
+	def iter_search(self, query: str, sort: str='title') -> Iterator[dict]:
+		"""Go over the volumes in the library that match a query, one at a time
+
+		Args:
+			query (str): The query to search with
+			sort (str, optional): How to sort the list. `title`, `year`, `volume_number`, `recently_added` and `publisher` allowed. Defaults to 'title'.
+
+		Returns:
+			Iterator[dict]: The matching volumes in the library
+		"""
+		query = query.lower()
+		return filter(
+			lambda v: query in v['title'].lower(),
+			self.iter_volumes(sort)
+		)
 
-		volumes = self.__format_lib_output(volumes)
-		
-		return volumes
-		
 	def search(self, query: str, sort: str='title') -> List[dict]:
 		"""Search in the library with a query
 
@@ -520,12 +560,7 @@ class Library:
 		Returns:
 			List[dict]: The resulting list of matching volumes in the library
 		"""
-		volumes = list(filter(
-			lambda v: query.lower() in v['title'].lower(),
-			self.get_volumes(sort)
-		))
-		
-		return volumes
+		return list(self.iter_search(query, sort))
 
 	def get_volume(self, volume_id: int) -> Volume:
 		"""Get a volumes.Volume instance of a volume in the library
@@ -583,14 +618,33 @@ class Library:
 
 		# Check if root folder exists
 		# Raises RootFolderNotFound when id is invalid
-		root_folder = RootFolders().get_one(root_folder_id, use_cache=False)['folder']
+		RootFolders().get_one(root_folder_id, use_cache=False)
 
 		# Get volume info
 		volume_data = ComicVine().fetch_volume(comicvine_id)
-		volume_data['monitored'] = monitor
-		volume_data['root_folder'] = root_folder_id
+		volume_id = self._insert_volume(volume_data, root_folder_id, monitor)
+
+		logging.info(f'Added volume with comicvine id {comicvine_id} and id {volume_id}')
+		return volume_id
 
-		# Insert volume
+	def _insert_volume(self,
+		volume_data: dict,
+		root_folder_id: int,
+		monitor: bool,
+		folder: str=None
+	) -> int:
+		"""Insert a volume and it's issues into the database
+
+		Args:
+			volume_data (dict): The metadata of the volume, including the issues (output of comicvine.ComicVine().fetch_volume())
+			root_folder_id (int): The id of the rootfolder in which the volume folder is
+			monitor (bool): Wether or not to mark the volume as monitored
+			folder (str, optional): Use this existing folder as the volume folder instead of generating one. Defaults to None.
+
+		Returns:
+			int: The new id of the volume
+		"""
+		cursor = get_db()
 		cursor.execute(
 			"""
 			INSERT INTO volumes(
@@ -617,8 +671,8 @@ class Library:
 				volume_data['volume_number'],
 				volume_data['description'],
 				volume_data['cover'],
-				volume_data['monitored'],
-				volume_data['root_folder'],
+				monitor,
+				root_folder_id,
 				volume_data['date_last_updated'],
 				round(time())
 			)
@@ -626,7 +680,14 @@ class Library:
 		volume_id = cursor.lastrowid
 		
 		# Setup folder
-		create_volume_folder(root_folder, volume_id)
+		if folder is None:
+			root_folder = RootFolders().get_one(root_folder_id, use_cache=False)['folder']
+			create_volume_folder(root_folder, volume_id)
+		else:
+			cursor.execute(
+				"UPDATE volumes SET folder = ? WHERE id = ?;",
+				(folder, volume_id)
+			)
 
 		# Prepare and insert issues
 		issue_list = map(
@@ -655,8 +716,8 @@ class Library:
 				monitored
 			) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
 		""", issue_list)
+		update_wanted(volume_id)
 
-		logging.info(f'Added volume with comicvine id {comicvine_id} and id {volume_id}')
 		return volume_id
 
 	def get_stats(self) -> Dict[str, int]:
@@ -690,6 +751,130 @@ class Library:
 		""")
 		return dict(cursor.fetchone())
 
+	def select_volumes(self, ids: List[int]=None, filter: dict=None) -> List[int]:
+		"""Select volumes in the library based on their id and/or properties
+
+		Args:
+			ids (List[int], optional): Only select volumes with these ids. Ids that don't map to any volume are ignored. Defaults to None.
+			filter (dict, optional): Only select volumes that match. Supported keys are `monitored` (bool) and `root_folder_id` (int). Defaults to None.
+
+		Raises:
+			InvalidKeyValue: The ids or a filter is invalid
+
+		Returns:
+			List[int]: The ids of the selected volumes
+		"""
+		where, args = self.__build_selection(ids, filter, {
+			'monitored': ('monitored = ?', bool),
+			'root_folder_id': ('root_folder = ?', int)
+		})
+		volume_ids = [v[0] for v in get_db().execute(
+			f"SELECT id FROM volumes WHERE {where} ORDER BY id;",
+			args
+		)]
+		return volume_ids
+
+	def select_issues(self, ids: List[int]=None, filter: dict=None) -> List[int]:
+		"""Select issues in the library based on their id and/or properties
+
+		Args:
+			ids (List[int], optional): Only select issues with these ids. Ids that don't map to any issue are ignored. Defaults to None.
+			filter (dict, optional): Only select issues that match. Supported keys are `volume_id` (int), `monitored` (bool) and `downloaded` (bool). Defaults to None.
+
+		Raises:
+			InvalidKeyValue: The ids or a filter is invalid
+
+		Returns:
+			List[int]: The ids of the selected issues
+		"""
+		where, args = self.__build_selection(ids, filter, {
+			'volume_id': ('volume_id = ?', int),
+			'monitored': ('monitored = ?', bool),
+			'downloaded': ('EXISTS (SELECT 1 FROM issues_files WHERE issue_id = issues.id) = ?', bool)
+		})
+		issue_ids = [i[0] for i in get_db().execute(
+			f"SELECT id FROM issues WHERE {where} ORDER BY id;",
+			args
+		)]
+		return issue_ids
+
+	def __build_selection(self,
+		ids: Union[List[int], None],
+		filter: Union[dict, None],
+		filter_keys: Dict[str, Tuple[str, type]]
+	) -> Tuple[str, tuple]:
+		"""Build the WHERE clause for selecting items
+
+		Args:
+			ids (Union[List[int], None]): Only select items with these ids
+			filter (Union[dict, None]): Only select items that match
+			filter_keys (Dict[str, Tuple[str, type]]): The supported filter keys mapped to their condition and value type
+
+		Raises:
+			InvalidKeyValue: The ids or a filter is invalid
+
+		Returns:
+			Tuple[str, tuple]: The WHERE clause and it's arguments
+		"""
+		conditions, args = ['1 = 1'], []
+		if ids is not None:
+			if not isinstance(ids, list) or not all(type(i) == int for i in ids):
+				raise InvalidKeyValue('ids', ids)
+			conditions.append('id IN (SELECT value FROM json_each(?))')
+			args.append(dumps(ids))
+
+		for key, value in (filter or {}).items():
+			if not key in filter_keys or type(value) != filter_keys[key][1]:
+				raise InvalidKeyValue(key, value)
+			conditions.append(filter_keys[key][0])
+			args.append(value)
+
+		return ' AND '.join(conditions), tuple(args)
+
+	def edit_volumes(self, volume_ids: List[int], monitor: bool) -> int:
+		"""Set multiple volumes to monitored or unmonitored at once
+
+		Args:
+			volume_ids (List[int]): The ids of the volumes
+			monitor (bool): Wether or not the volumes should be monitored
+
+		Returns:
+			int: The amount of volumes changed
+		"""
+		logging.info(f'Setting {len(volume_ids)} volumes to {"monitored" if monitor else "unmonitored"}')
+		changed = get_db().execute("""
+			UPDATE volumes
+			SET monitored = ?
+			WHERE id IN (SELECT value FROM json_each(?))
+				AND monitored != ?;
+			""",
+			(monitor, dumps(volume_ids), monitor)
+		).rowcount
+		update_wanted(volume_ids)
+		return changed
+
+	def edit_issues(self, issue_ids: List[int], monitor: bool) -> int:
+		"""Set multiple issues to monitored or unmonitored at once
+
+		Args:
+			issue_ids (List[int]): The ids of the issues
+			monitor (bool): Wether or not the issues should be monitored
+
+		Returns:
+			int: The amount of issues changed
+		"""
+		logging.info(f'Setting {len(issue_ids)} issues to {"monitored" if monitor else "unmonitored"}')
+		changed = get_db().execute("""
+			UPDATE issues
+			SET monitored = ?
+			WHERE id IN (SELECT value FROM json_each(?))
+				AND monitored != ?;
+			""",
+			(monitor, dumps(issue_ids), monitor)
+		).rowcount
+		update_wanted(issue_id=issue_ids)
+		return changed
+
 def search_volumes(query: str) -> List[dict]:
 	"""Search for a volume in the ComicVine database
 
@@ -0,0 +1,104 @@
+#-*- coding: utf-8 -*-
+
+"""This file contains functions regarding the wanted list: the issues that
+are monitored (and of which the volume is monitored), but don't have a file yet
+"""
+
+import logging
+from json import dumps
+from typing import List, Union
+
+from backend.db import get_db
+
+
+def update_wanted(
+	volume_id: Union[int, List[int]]=None,
+	issue_id: Union[int, List[int]]=None
+) -> None:
+	"""Bring the wanted list up to date for a volume, an issue or the whole library.
+	Should be called after something changes that influences if an issue is wanted
+	(files being (un)binded, monitored status changing or issues being added).
+
+	Args:
+		volume_id (Union[int, List[int]], optional): The id of the volume (or a list of ids)
+		to update the issues of. Defaults to None.
+		issue_id (Union[int, List[int]], optional): The id of the issue (or a list of ids) to update.
+		Defaults to None.
+		If both are `None`, the whole library is updated.
+	"""
+	if issue_id is not None:
+		column, ids = 'i.id', issue_id
+	elif volume_id is not None:
+		column, ids = 'i.volume_id', volume_id
+	else:
+		column, ids = None, None
+
+	if column is None:
+		where, args = '1 = 1', ()
+	elif isinstance(ids, list):
+		where, args = f'{column} IN (SELECT value FROM json_each(?))', (dumps(ids),)
+	else:
+		where, args = f'{column} = ?', (ids,)
+	logging.debug(f'Updating wanted list: volume {volume_id}, issue {issue_id}')
+
+	cursor = get_db()
+	cursor.execute(f"""
+		DELETE FROM wanted_issues
+		WHERE issue_id IN (
+			SELECT i.id
+			FROM issues i
+			WHERE {where}
+		);
+		""",
+		args
+	)
+	cursor.execute(f"""
+		INSERT INTO wanted_issues(issue_id, volume_id)
+		SELECT i.id, i.volume_id
+		FROM issues i
+		INNER JOIN volumes v
+		ON i.volume_id = v.id
+		WHERE
+			{where}
+			AND v.monitored = 1
+			AND i.monitored = 1
+			AND NOT EXISTS (
+				SELECT 1
+				FROM issues_files if
+				WHERE if.issue_id = i.id
+			);
+		""",
+		args
+	)
+	return
+
+def get_wanted(offset: int=0) -> List[dict]:
+	"""Get the wanted issues in blocks of 50
+
+	Args:
+		offset (int, optional): The offset of the list. The higher the number, the deeper into the list you go. Defaults to 0.
+
+	Returns:
+		List[dict]: The wanted issues
+	"""
+	result = list(map(
+		dict,
+		get_db('dict').execute("""
+			SELECT
+				i.id, i.volume_id, v.title AS volume_title,
+				i.comicvine_id,
+				i.issue_number, i.calculated_issue_number,
+				i.title, i.date
+			FROM wanted_issues w
+			INNER JOIN issues i
+			ON w.issue_id = i.id
+			INNER JOIN volumes v
+			ON w.volume_id = v.id
+			ORDER BY v.title, v.id, i.calculated_issue_number
+			LIMIT 50
+			OFFSET ?;
+			""",
+			(offset * 50,)
+		)
+	))
+	return result
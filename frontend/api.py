@@ -1,14 +1,23 @@
 #-*- coding: utf-8 -*-
 
 import logging
-from typing import Any, Tuple
+from json import dumps
+from queue import Empty
+from threading import BoundedSemaphore
+from typing import Any, Iterable, Iterator, Tuple
+from zlib import DEFLATED, compressobj
 
-from flask import Blueprint, Flask, request, send_file
+from flask import (Blueprint, Flask, Response, request, send_file,
+                   stream_with_context)
 
+from backend.bandwidth import (add_bandwidth_limit, delete_bandwidth_limit,
+                               get_bandwidth_limit, get_bandwidth_limits)
 from backend.blocklist import (add_to_blocklist, delete_blocklist,
                                delete_blocklist_entry, get_blocklist,
                                get_blocklist_entry)
-from backend.custom_exceptions import (BlocklistEntryNotFound,
+from backend.custom_exceptions import (ArchiveNotFound,
+                                       BandwidthLimitNotFound,
+                                       BlocklistEntryNotFound,
                                        CredentialAlreadyAdded,
                                        CredentialInvalid, CredentialNotFound,
                                        CredentialSourceNotFound,
@@ -18,41 +27,109 @@ from backend.custom_exceptions import (BlocklistEntryNotFound,
                                        InvalidSettingModification,
                                        InvalidSettingValue, IssueNotFound,
                                        KeyNotFound, RootFolderInUse,
-                                       RootFolderNotFound, TaskNotDeletable,
-                                       TaskNotFound, VolumeAlreadyAdded,
-                                       VolumeDownloadedFor, VolumeNotFound)
+                                       RootFolderNotFound, ServerBusy,
+                                       TaskNotDeletable, TaskNotFound,
+                                       TooManyEventStreams,
+                                       VolumeAlreadyAdded, VolumeDownloadedFor,
+                                       VolumeNotFound)
 from backend.db import close_db
 from backend.download import (DownloadHandler, credentials,
                               delete_download_history, get_download_history)
-from backend.naming import mass_rename, preview_mass_rename
+from backend.duplicates import get_duplicates
+from backend.events import event_hub
+from backend.library_import import get_library_import
+from backend.metrics import metrics
+from backend.naming import (mass_rename, preview_mass_rename,
+                            preview_mass_rename_all)
+from backend.retention import get_archive
 from backend.root_folders import RootFolders
 from backend.search import manual_search
-from backend.settings import Settings, about_data, blocklist_reasons
+from backend.settings import (Settings, about_data, blocklist_reasons,
+                              default_settings, private_settings)
 from backend.tasks import (TaskHandler, delete_task_history, get_task_history,
                            get_task_planning, task_library)
 from backend.volumes import Library, search_volumes, ui_vars
+from backend.wanted import get_wanted
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
 
 api = Blueprint('api', __name__)
 root_folders = RootFolders()
 library = Library()
 settings = Settings()
 
+# Responses are sent in chunks of roughly this many bytes when streamed
+stream_chunk_size = 65536
+# Responses smaller than this many bytes are not worth compressing
+compression_min_size = 1024
+
+def _long_request_slot_count(hosting_threads: int) -> int:
+	# Event streams keep their thread, so only share out the remaining ones
+	# and always leave at least one thread free for short requests
+	available = hosting_threads - private_settings['max_event_streams']
+	return max(1, min(
+		int(available * private_settings['long_request_share']),
+		available - 1
+	))
+
+# Limits how many slow requests are handled at the same time
+long_request_slots = BoundedSemaphore(
+	_long_request_slot_count(default_settings['hosting_threads'])
+)
+
 # Create handlers
 handler_context = Flask('handler')
 handler_context.teardown_appcontext(close_db)
 download_handler = DownloadHandler(handler_context)
 task_handler = TaskHandler(handler_context, download_handler)
+event_hub.register('queue', download_handler.get_all)
+event_hub.register('tasks', task_handler.get_all)
 
 def return_api(result: Any, error: str=None, code: int=200) -> Tuple[dict, int]:
 	return {'error': error, 'result': result}, code
 
+def stream_api(result: Iterable, code: int=200) -> Tuple[Response, int]:
+	"""Return a list as an API response, serializing it while it's being sent.
+	The list (e.g. a generator reading from a database cursor) is never
+	completely in memory.
+
+	Args:
+		result (Iterable): The entries of the list
+		code (int, optional): The status code of the response. Defaults to 200.
+
+	Returns:
+		Tuple[Response, int]: The streamed response
+	"""
+	def generate() -> Iterator[str]:
+		chunk = ['{"error":null,"result":[']
+		size = 0
+		for index, entry in enumerate(result):
+			entry = dumps(entry, separators=(',', ':'))
+			chunk.append(',' + entry if index else entry)
+			size += len(entry)
+			if size >= stream_chunk_size:
+				yield ''.join(chunk)
+				chunk, size = [], 0
+		chunk.append(']}')
+		yield ''.join(chunk)
+
+	return Response(
+		stream_with_context(generate()),
+		mimetype='application/json'
+	), code
+
 def error_handler(method):
 	"""Used as decodator. Catches the errors that can occur in the endpoint and returns the correct api error
 	"""
 	def wrapper(*args, **kwargs):
 		try:
 			return method(*args, **kwargs)
-		except (BlocklistEntryNotFound,
+		except (ArchiveNotFound,
+				BandwidthLimitNotFound,
+				BlocklistEntryNotFound,
 				CredentialAlreadyAdded,
 				CredentialInvalid, CredentialNotFound,
 				CredentialSourceNotFound,
@@ -62,9 +139,11 @@ def error_handler(method):
 				InvalidSettingModification,
 				InvalidSettingValue, IssueNotFound,
 				KeyNotFound, RootFolderInUse,
-				RootFolderNotFound, TaskNotDeletable,
-				TaskNotFound, VolumeAlreadyAdded,
-				VolumeDownloadedFor, VolumeNotFound) as e:
+				RootFolderNotFound, ServerBusy,
+				TaskNotDeletable, TaskNotFound,
+				TooManyEventStreams,
+				VolumeAlreadyAdded, VolumeDownloadedFor,
+				VolumeNotFound) as e:
 			return return_api(**e.api_response)
 	
 	wrapper.__name__ = method.__name__
@@ -108,12 +187,11 @@ def extract_key(request, key: str, check_existence: bool=True) -> Any:
 				raise TaskNotFound
 
 		elif key == 'api_key':
-			if not value == settings.get_settings()['api_key']:
+			if not settings.check_api_key(value):
 				raise InvalidKeyValue(key, value)
 
 		elif key == 'password':
-			auth_password = settings.get_settings().get('auth_password', '')
-			if auth_password != '' and value != auth_password:
+			if not settings.check_password(value):
 				raise InvalidKeyValue(key, value)
 
 		elif key == 'sort':
@@ -126,6 +204,14 @@ def extract_key(request, key: str, check_existence: bool=True) -> Any:
 			except (ValueError, TypeError):
 				raise InvalidKeyValue(key, value)
 
+		elif key == 'before':
+			# Keyset of the last entry of the previous page: `{timestamp},{id}`
+			try:
+				timestamp, id = value.split(',')
+				value = (int(timestamp), int(id))
+			except ValueError:
+				raise InvalidKeyValue(key, value)
+
 		elif key == 'reason_id':
 			value = int(value)
 			if not value in blocklist_reasons:
@@ -155,6 +241,94 @@ def extract_key(request, key: str, check_existence: bool=True) -> Any:
 
 	return value
 
+def _compress_stream(chunks: Iterable, encoding: str) -> Iterator[bytes]:
+	"""Compress a streamed response while it's being sent
+
+	Args:
+		chunks (Iterable): The chunks of the response
+		encoding (str): The encoding to compress with (`br` or `gzip`)
+
+	Returns:
+		Iterator[bytes]: The compressed chunks
+	"""
+	if encoding == 'br':
+		compressor = brotli.Compressor()
+		compress, finish = compressor.process, compressor.finish
+	else:
+		compressor = compressobj(6, DEFLATED, 31)
+		compress, finish = compressor.compress, compressor.flush
+
+	for chunk in chunks:
+		if isinstance(chunk, str):
+			chunk = chunk.encode('utf-8')
+		chunk = compress(chunk)
+		if chunk:
+			yield chunk
+	yield finish()
+
+@api.after_request
+def compress_response(response: Response) -> Response:
+	"""Compress JSON responses with the best encoding the client accepts
+	(brotli, if installed, or gzip)
+	"""
+	if (response.mimetype != 'application/json'
+	or response.direct_passthrough
+	or 'Content-Encoding' in response.headers
+	or not 200 <= response.status_code < 300):
+		return response
+
+	response.vary.add('Accept-Encoding')
+	options = ['br', 'gzip'] if brotli is not None else ['gzip']
+	encoding = request.accept_encodings.best_match(options)
+	if encoding is None:
+		return response
+
+	if response.is_streamed:
+		response.response = _compress_stream(response.response, encoding)
+		response.headers.pop('Content-Length', None)
+
+	else:
+		data = response.get_data()
+		if len(data) < compression_min_size:
+			return response
+
+		if encoding == 'br':
+			data = brotli.compress(data)
+		else:
+			compressor = compressobj(6, DEFLATED, 31)
+			data = compressor.compress(data) + compressor.flush()
+		response.set_data(data)
+
+	response.headers['Content-Encoding'] = encoding
+	return response
+
+def set_hosting_threads(hosting_threads: int) -> None:
+	"""Size the limit on slow requests to the amount of hosting threads
+
+	Args:
+		hosting_threads (int): The amount of threads the server handles requests with
+	"""
+	global long_request_slots
+	long_request_slots = BoundedSemaphore(_long_request_slot_count(hosting_threads))
+	return
+
+def long_running(method):
+	"""Used as decorator. Limits how many requests to slow endpoints (e.g. ones
+	that search online) are handled at the same time, so that they can't occupy
+	all hosting threads. Requests over the limit are refused with a 503.
+	"""
+	def wrapper(*args, **kwargs):
+		slots = long_request_slots
+		if not slots.acquire(blocking=False):
+			raise ServerBusy
+		try:
+			return method(*args, **kwargs)
+		finally:
+			slots.release()
+
+	wrapper.__name__ = method.__name__
+	return wrapper
+
 #=====================
 # Authentication function and endpoints
 #=====================
@@ -208,6 +382,15 @@ def api_auth_check():
 def api_about():
 	return return_api(about_data)
 
+@api.route('/system/metrics', methods=['GET'])
+@error_handler
+@auth
+def api_metrics():
+	return Response(
+		metrics.export(),
+		content_type='text/plain; version=0.0.4; charset=utf-8'
+	), 200
+
 @api.route('/system/tasks', methods=['GET','POST'])
 @error_handler
 @auth
@@ -227,6 +410,17 @@ def api_tasks():
 				task_instance = task(volume_id, issue_id)
 			else:
 				task_instance = task(volume_id)
+
+		elif task.action == 'find_duplicates':
+			volume_id = extract_key(request, 'volume_id', False)
+			task_instance = task(volume_id)
+
+		elif task.action == 'library_import_scan':
+			root_folder_id = extract_key(request, 'root_folder_id', False)
+			if root_folder_id is not None:
+				root_folders.get_one(root_folder_id)
+			task_instance = task(root_folder_id)
+
 		else:
 			task_instance = task()
 
@@ -238,14 +432,23 @@ def api_tasks():
 @auth
 def api_task_history():
 	if request.method == 'GET':
+		before = extract_key(request, 'before', False)
+		# Deprecated, only used when before isn't given
 		offset = extract_key(request, 'offset', False)
-		tasks = get_task_history(offset)
+		tasks = get_task_history(before, offset)
 		return return_api(tasks)
 	
 	elif request.method == 'DELETE':
 		delete_task_history()
 		return return_api({})
 
+@api.route('/system/tasks/history/archive', methods=['GET'])
+@error_handler
+@auth
+def api_task_history_archive():
+	archive = get_archive('task_history')
+	return send_file(archive, 'application/gzip', as_attachment=True), 200
+
 @api.route('/system/tasks/planning', methods=['GET'])
 @error_handler
 @auth
@@ -315,6 +518,38 @@ def api_settings_service_preference():
 		settings.set_service_preference(data['order'])
 		return return_api({})
 
+@api.route('/settings/bandwidth', methods=['GET', 'POST'])
+@error_handler
+@auth
+def api_settings_bandwidth():
+	if request.method == 'GET':
+		result = get_bandwidth_limits()
+		return return_api(result)
+
+	elif request.method == 'POST':
+		data: dict = request.get_json()
+		if not 'speed_limit' in data:
+			raise KeyNotFound('speed_limit')
+		result = add_bandwidth_limit(
+			data['speed_limit'],
+			data.get('source'),
+			data.get('start_time'),
+			data.get('end_time')
+		)
+		return return_api(result, code=201)
+
+@api.route('/settings/bandwidth/<int:id>', methods=['GET', 'DELETE'])
+@error_handler
+@auth
+def api_settings_bandwidth_limit(id: int):
+	if request.method == 'GET':
+		result = get_bandwidth_limit(id)
+		return return_api(result)
+
+	elif request.method == 'DELETE':
+		delete_bandwidth_limit(id)
+		return return_api({})
+
 @api.route('/rootfolder', methods=['GET','POST'])
 @error_handler
 @auth
@@ -348,12 +583,80 @@ def api_rootfolder_id(id: int):
 @api.route('/volumes/search', methods=['GET'])
 @error_handler
 @auth
+@long_running
 def api_volumes_search():
 	query = extract_key(request, 'query')
 	search_results = search_volumes(query)
 	return return_api(search_results)
 
-@api.route('/volumes', methods=['GET','POST'])
+def _bulk_edit(edit_info: dict, volumes: bool) -> dict:
+	"""Apply the edits of a bulk edit request to volumes or issues.
+	Monitoring is applied directly, any other action is done in a task.
+
+	Args:
+		edit_info (dict): The body of the request
+		volumes (bool): Wether the request is about volumes (`True`) or issues (`False`)
+
+	Raises:
+		KeyNotFound: No ids or filter given
+		InvalidKeyValue: A value is invalid
+		RootFolderNotFound: The root folder to move to doesn't exist
+
+	Returns:
+		dict: A summary of what is done
+	"""
+	if not isinstance(edit_info, dict):
+		raise InvalidKeyValue('body', edit_info)
+	if not 'ids' in edit_info and not 'filter' in edit_info:
+		raise KeyNotFound('ids')
+	if 'filter' in edit_info and not isinstance(edit_info['filter'], dict):
+		raise InvalidKeyValue('filter', edit_info['filter'])
+
+	for key in ('monitor', 'refresh', 'rename', 'search'):
+		if key in edit_info and not isinstance(edit_info[key], bool):
+			raise InvalidKeyValue(key, edit_info[key])
+
+	root_folder_id = edit_info.get('root_folder_id')
+	if volumes and root_folder_id is not None:
+		if type(root_folder_id) != int:
+			raise InvalidKeyValue('root_folder_id', root_folder_id)
+		root_folders.get_one(root_folder_id)
+
+	if volumes:
+		ids = library.select_volumes(edit_info.get('ids'), edit_info.get('filter'))
+	else:
+		ids = library.select_issues(edit_info.get('ids'), edit_info.get('filter'))
+
+	result = {
+		'selected': len(ids),
+		'changed': 0,
+		'task_id': None
+	}
+	if not ids:
+		return result
+
+	if 'monitor' in edit_info:
+		if volumes:
+			result['changed'] = library.edit_volumes(ids, edit_info['monitor'])
+		else:
+			result['changed'] = library.edit_issues(ids, edit_info['monitor'])
+
+	task_args = {
+		'root_folder_id': root_folder_id if volumes else None,
+		'refresh': edit_info.get('refresh', False) and volumes,
+		'rename': edit_info.get('rename', False),
+		'search': edit_info.get('search', False)
+	}
+	if any(task_args.values()):
+		if volumes:
+			task = task_library['mass_edit'](volume_ids=ids, **task_args)
+		else:
+			task = task_library['mass_edit'](issue_ids=ids, **task_args)
+		result['task_id'] = task_handler.add(task)
+
+	return result
+
+@api.route('/volumes', methods=['GET','POST','PUT'])
 @error_handler
 @auth
 def api_volumes():
@@ -361,11 +664,11 @@ def api_volumes():
 		query = extract_key(request, 'query', False)
 		sort = extract_key(request, 'sort', False)
 		if query:
-			volumes = library.search(query, sort)
+			volumes = library.iter_search(query, sort)
 		else:
-			volumes = library.get_volumes(sort)
+			volumes = library.iter_volumes(sort)
 
-		return return_api(volumes)
+		return stream_api(volumes)
 
 	elif request.method == 'POST':
 		comicvine_id = extract_key(request, 'comicvine_id')
@@ -376,6 +679,10 @@ def api_volumes():
 		volume_info = library.get_volume(volume_id).get_info()
 		return return_api(volume_info, code=201)
 
+	elif request.method == 'PUT':
+		result = _bulk_edit(request.get_json(), volumes=True)
+		return return_api(result)
+
 @api.route('/volumes/stats', methods=['GET'])
 @error_handler
 @auth
@@ -403,6 +710,14 @@ def api_volume(id: int):
 		volume.delete(delete_folder=delete_folder)
 		return return_api({})
 
+@api.route('/volumes/<int:id>/duplicates', methods=['GET'])
+@error_handler
+@auth
+def api_volume_duplicates(id: int):
+	library.get_volume(id)
+	result = get_duplicates(id)
+	return return_api(result)
+
 @api.route('/volumes/<int:id>/cover', methods=['GET'])
 @error_handler
 @auth
@@ -410,6 +725,20 @@ def api_volume_cover(id: int):
 	cover = library.get_volume(id).get_cover()
 	return send_file(cover, 'image/jpeg'), 200
 
+@api.route('/duplicates', methods=['GET'])
+@error_handler
+@auth
+def api_duplicates():
+	result = get_duplicates()
+	return return_api(result)
+
+@api.route('/issues', methods=['PUT'])
+@error_handler
+@auth
+def api_issues_bulk():
+	result = _bulk_edit(request.get_json(), volumes=False)
+	return return_api(result)
+
 @api.route('/issues/<int:id>', methods=['GET','PUT'])
 @error_handler
 @auth
@@ -431,12 +760,64 @@ def api_issues(id: int):
 		result = issue.get_info()
 		return return_api(result)
 
+@api.route('/wanted', methods=['GET'])
+@error_handler
+@auth
+def api_wanted():
+	offset = extract_key(request, 'offset', False)
+	result = get_wanted(offset)
+	return return_api(result)
+
+#=====================
+# Library import
+#=====================
+@api.route('/libraryimport', methods=['GET','POST'])
+@error_handler
+@auth
+def api_library_import():
+	if request.method == 'GET':
+		offset = extract_key(request, 'offset', False)
+		result = get_library_import(offset)
+		return return_api(result)
+
+	elif request.method == 'POST':
+		data = request.get_json()
+		if not isinstance(data, dict):
+			raise InvalidKeyValue('body', data)
+
+		entries = data.get('entries')
+		if not isinstance(entries, list) or not entries:
+			raise KeyNotFound('entries')
+		for entry in entries:
+			if (not isinstance(entry, dict)
+			or type(entry.get('id')) != int
+			or type(entry.get('comicvine_id')) != int):
+				raise InvalidKeyValue('entries', entry)
+
+		monitor = data.get('monitor', True)
+		if not isinstance(monitor, bool):
+			raise InvalidKeyValue('monitor', monitor)
+
+		task = task_library['library_import'](entries, monitor)
+		result = task_handler.add(task)
+		return return_api({'id': result}, code=201)
+
 #=====================
 # Renaming
 #=====================
+@api.route('/rename', methods=['GET'])
+@error_handler
+@auth
+@long_running
+def api_rename_all():
+	offset = extract_key(request, 'offset', False)
+	result = preview_mass_rename_all(offset)
+	return return_api(result)
+
 @api.route('/volumes/<int:id>/rename', methods=['GET','POST'])
 @error_handler
 @auth
+@long_running
 def api_rename(id: int):
 	library.get_volume(id)
 
@@ -451,8 +832,9 @@ def api_rename(id: int):
 @api.route('/issues/<int:id>/rename', methods=['GET','POST'])
 @error_handler
 @auth
+@long_running
 def api_rename_issue(id: int):
-	volume_id = library.get_issue(id).get_info()['volume_id']
+	volume_id = library.get_issue(id).volume_id
 
 	if request.method == 'GET':
 		result = preview_mass_rename(volume_id, id)
@@ -468,6 +850,7 @@ def api_rename_issue(id: int):
 @api.route('/volumes/<int:id>/manualsearch', methods=['GET'])
 @error_handler
 @auth
+@long_running
 def api_volume_manual_search(id: int):
 	library.get_volume(id)
 	result = manual_search(id)
@@ -485,10 +868,11 @@ def api_volume_download(id: int):
 @api.route('/issues/<int:id>/manualsearch', methods=['GET'])
 @error_handler
 @auth
+@long_running
 def api_issue_manual_search(id: int):
-	issue_info = library.get_issue(id).get_info()
+	issue = library.get_issue(id)
 	result = manual_search(
-		issue_info['volume_id'],
+		issue.volume_id,
 		id
 	)
 	return return_api(result)
@@ -498,8 +882,8 @@ def api_issue_manual_search(id: int):
 @auth
 def api_issue_download(id: int):
 	link = extract_key(request, 'link')
-	issue_info = library.get_issue(id).get_info()
-	result = download_handler.add(link, issue_info['volume_id'], id)
+	issue = library.get_issue(id)
+	result = download_handler.add(link, issue.volume_id, id)
 	return return_api(result, code=201)
 
 @api.route('/activity/queue', methods=['GET'])
@@ -526,14 +910,23 @@ def api_delete_download(download_id: int):
 @auth
 def api_download_history():
 	if request.method == 'GET':
+		before = extract_key(request, 'before', False)
+		# Deprecated, only used when before isn't given
 		offset = extract_key(request, 'offset', False)
-		result = get_download_history(offset)
+		result = get_download_history(before, offset)
 		return return_api(result)
 
 	elif request.method == 'DELETE':
 		delete_download_history()
 		return return_api({})
 
+@api.route('/activity/history/archive', methods=['GET'])
+@error_handler
+@auth
+def api_download_history_archive():
+	archive = get_archive('download_history')
+	return send_file(archive, 'application/gzip', as_attachment=True), 200
+
 @api.route('/activity/folder', methods=['DELETE'])
 @error_handler
 @auth
@@ -541,6 +934,32 @@ def api_empty_download_folder():
 	download_handler.empty_download_folder()
 	return return_api({})
 
+@api.route('/events', methods=['GET'])
+@error_handler
+@auth
+def api_events():
+	client = event_hub.subscribe()
+
+	def stream():
+		try:
+			yield 'retry: 5000\n\n'
+			while True:
+				try:
+					event, data = client.get(timeout=15)
+				except Empty:
+					# Keep the connection alive and notice when the client is gone
+					yield ': keep-alive\n\n'
+					continue
+				yield f'event: {event}\ndata: {dumps(data)}\n\n'
+		finally:
+			event_hub.unsubscribe(client)
+
+	return Response(
+		stream(),
+		mimetype='text/event-stream',
+		headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+	), 200
+
 #=====================
 # Blocklist
 #=====================
@@ -549,8 +968,10 @@ def api_empty_download_folder():
 @auth
 def api_blocklist():
 	if request.method == 'GET':
+		before = extract_key(request, 'before', False)
+		# Deprecated, only used when before isn't given
 		offset = extract_key(request, 'offset', False)
-		result = get_blocklist(offset)
+		result = get_blocklist(before, offset)
 		return return_api(result)
 	
 	elif request.method == 'POST':
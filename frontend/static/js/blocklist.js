@@ -1,11 +1,15 @@
-var offset = 0;
+// The keyset (`{timestamp},{id}`) that each page starts after
+var pages = [null];
+var page = 0;
 
 function fillList(api_key) {
-	fetch(`${url_base}/api/blocklist?api_key=${api_key}&offset=${offset}`)
+	fetch(`${url_base}/api/blocklist?api_key=${api_key}${pages[page] ? `&before=${pages[page]}` : ''}`)
 	.then(response => response.json())
 	.then(json => {
 		const table = document.querySelector('#blocklist');
 		table.innerHTML = '';
+		const last = json.result[json.result.length - 1];
+		pages[page + 1] = last ? `${last.added_at},${last.id}` : null;
 		json.result.forEach(obj => {
 			const entry = document.createElement('tr');
 			entry.classList.add('list-entry');
@@ -60,22 +64,23 @@ function clearList(api_key) {
 	fetch(`${url_base}/api/blocklist?api_key=${api_key}`, {
 		'method': 'DELETE'
 	});
-	offset = 0;
+	pages = [null];
+	page = 0;
 	document.querySelector('#page-number').innerText = 'Page 1';
 	document.querySelector('#blocklist').innerHTML = '';
 };
 
 function reduceOffset(api_key) {
-	if (offset === 0) return;
-	offset--;
-	document.querySelector('#page-number').innerText = `Page ${offset + 1}`;
+	if (page === 0) return;
+	page--;
+	document.querySelector('#page-number').innerText = `Page ${page + 1}`;
 	fillList(api_key);
 };
 
 function increaseOffset(api_key) {
-	if (document.querySelector('#blocklist').innerHTML === '') return;
-	offset++;
-	document.querySelector('#page-number').innerText = `Page ${offset + 1}`;
+	if (!pages[page + 1]) return;
+	page++;
+	document.querySelector('#page-number').innerText = `Page ${page + 1}`;
 	fillList(api_key);
 };
 
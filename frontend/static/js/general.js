@@ -92,6 +92,17 @@ function spinButtons(result, id) {
 	};
 };
 
+function showTaskQueue(tasks, id) {
+	const table = document.querySelector('#task-queue');
+	table.innerHTML = '';
+	if (tasks.length >= 1) {
+		const entry = document.createElement('p');
+		entry.innerText = tasks[0].message;
+		table.appendChild(entry);
+	};
+	spinButtons(tasks, id);
+};
+
 function fillTaskQueue(api_key, id) {
 	fetch(`${url_base}/api/system/tasks?api_key=${api_key}`, {
 		'priority': 'low'
@@ -100,21 +111,53 @@ function fillTaskQueue(api_key, id) {
 		if (!response.ok) return Promise.reject(response.status);
 		return response.json();
 	})
-	.then(json => {
-		const table = document.querySelector('#task-queue');
-		table.innerHTML = '';
-		if (json.result.length >= 1) {
-			const entry = document.createElement('p');
-			entry.innerText = json.result[0].message;
-			table.appendChild(entry);
-		};
-		spinButtons(json.result, id);
-	})
+	.then(json => showTaskQueue(json.result, id))
 	.catch(e => {
 		if (e === 401) window.location.href = `${url_base}/login?redirect=${window.location.pathname}`;
 	});
 };
 
+//
+// Event stream
+//
+let event_stream = null;
+const event_stream_fallbacks = [];
+function listenToEvents(api_key, handlers, fallback) {
+	// handlers: {'event_name': data => {...}}
+	// fallback: called when no event stream can be used (e.g. too many are open)
+	if (!window.EventSource) {
+		fallback();
+		return;
+	};
+	if (event_stream === null) {
+		event_stream = new EventSource(`${url_base}/api/events?api_key=${api_key}`);
+		event_stream.onerror = e => {
+			// When the stream is refused, it's closed instead of reconnecting
+			if (event_stream.readyState !== EventSource.CLOSED) return;
+			event_stream_fallbacks.forEach(f => f());
+			event_stream_fallbacks.length = 0;
+		};
+	} else if (event_stream.readyState === EventSource.CLOSED) {
+		fallback();
+		return;
+	};
+
+	for (const [event, handler] of Object.entries(handlers))
+		event_stream.addEventListener(event, e => handler(JSON.parse(e.data)));
+	event_stream_fallbacks.push(fallback);
+};
+
+function applyEvent(entries, type, data) {
+	// Apply a *_state, *_added, *_changed or *_removed event to a list of entries
+	if (type === 'state') return data;
+	if (type === 'added') {
+		const { index, ...entry } = data;
+		return [...entries.slice(0, index), entry, ...entries.slice(index)];
+	};
+	if (type === 'removed') return entries.filter(e => e.id !== data.id);
+	return entries.map(e => e.id === data.id ? Object.assign(e, data) : e);
+};
+
 //
 // Nav
 //
@@ -161,8 +204,18 @@ if (volume_id === null) mapButtons(volume_id);
 
 usingApiKey()
 .then(api_key => {
-	setTimeout(() => fillTaskQueue(api_key, volume_id), 200);
-	setInterval(() => fillTaskQueue(api_key, volume_id), 2000);
+	let tasks = [];
+	const handlers = {};
+	['state', 'added', 'changed', 'removed'].forEach(type => {
+		handlers[`tasks_${type}`] = data => {
+			tasks = applyEvent(tasks, type, data);
+			showTaskQueue(tasks, volume_id);
+		};
+	});
+	listenToEvents(api_key, handlers, () => {
+		fillTaskQueue(api_key, volume_id);
+		setInterval(() => fillTaskQueue(api_key, volume_id), 2000);
+	});
 })
 
 addEventListener('#toggle-nav', 'click', showNav)
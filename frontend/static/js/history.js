@@ -1,11 +1,15 @@
-var offset = 0;
+// The keyset (`{timestamp},{id}`) that each page starts after
+var pages = [null];
+var page = 0;
 
 function fillHistory(api_key) {
-	fetch(`${url_base}/api/activity/history?api_key=${api_key}&offset=${offset}`)
+	fetch(`${url_base}/api/activity/history?api_key=${api_key}${pages[page] ? `&before=${pages[page]}` : ''}`)
 	.then(response => response.json())
 	.then(json => {
 		const table = document.querySelector('#history');
 		table.innerHTML = '';
+		const last = json.result[json.result.length - 1];
+		pages[page + 1] = last ? `${last.downloaded_at},${last.id}` : null;
 		json.result.forEach(obj => {
 			const entry = document.createElement('tr');
 			entry.classList.add('history-entry');
@@ -33,22 +37,23 @@ function clearHistory(api_key) {
 	fetch(`${url_base}/api/activity/history?api_key=${api_key}`, {
 		'method': 'DELETE'
 	});
-	offset = 0;
+	pages = [null];
+	page = 0;
 	document.querySelector('#page-number').innerText = 'Page 1';
 	document.querySelector('#history').innerHTML = '';
 };
 
 function reduceOffset(api_key) {
-	if (offset === 0) return;
-	offset--;
-	document.querySelector('#page-number').innerText = `Page ${offset + 1}`;
+	if (page === 0) return;
+	page--;
+	document.querySelector('#page-number').innerText = `Page ${page + 1}`;
 	fillHistory(api_key);
 };
 
 function increaseOffset(api_key) {
-	if (document.querySelector('#history').innerHTML === '') return;
-	offset++;
-	document.querySelector('#page-number').innerText = `Page ${offset + 1}`;
+	if (!pages[page + 1]) return;
+	page++;
+	document.querySelector('#page-number').innerText = `Page ${page + 1}`;
 	fillHistory(api_key);
 };
 
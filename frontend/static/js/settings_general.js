@@ -5,10 +5,15 @@ function fillSettings(api_key) {
 		document.querySelector('#bind-address-input').value = json.result.host;
 		document.querySelector('#port-input').value = json.result.port;
 		document.querySelector('#url-base-input').value = json.result.url_base;
+		document.querySelector('#hosting-threads-input').value = json.result.hosting_threads;
+		document.querySelector('#connection-limit-input').value = json.result.connection_limit;
+		document.querySelector('#channel-timeout-input').value = json.result.channel_timeout;
 		document.querySelector('#password-input').value = json.result.auth_password;
 		document.querySelector('#api-input').value = api_key;
 		document.querySelector('#cv-input').value = json.result.comicvine_api_key;
 		document.querySelector('#log-level-input').value = json.result.log_level;
+		document.querySelector('#download-history-retention-input').value = json.result.download_history_retention;
+		document.querySelector('#task-history-retention-input').value = json.result.task_history_retention;
 	});
 	
 };
@@ -18,9 +23,14 @@ function saveSettings(api_key) {
 		'host': document.querySelector('#bind-address-input').value,
 		'port': document.querySelector('#port-input').value,
 		'url_base': document.querySelector('#url-base-input').value,
+		'hosting_threads': document.querySelector('#hosting-threads-input').value,
+		'connection_limit': document.querySelector('#connection-limit-input').value,
+		'channel_timeout': document.querySelector('#channel-timeout-input').value,
 		'auth_password': document.querySelector('#password-input').value,
 		'comicvine_api_key': document.querySelector('#cv-input').value,
-		'log_level': document.querySelector('#log-level-input').value
+		'log_level': document.querySelector('#log-level-input').value,
+		'download_history_retention': document.querySelector('#download-history-retention-input').value,
+		'task_history_retention': document.querySelector('#task-history-retention-input').value
 	};
 	fetch(`${url_base}/api/settings?api_key=${api_key}`, {
 		'method': 'PUT',
@@ -8,7 +8,9 @@ function fillSettings(api_key) {
 		document.querySelector('#volume-folder-naming-input').value = json.result.volume_folder_naming;
 		document.querySelector('#file-naming-input').value = json.result.file_naming;
 		document.querySelector('#file-naming-tpb-input').value = json.result.file_naming_tpb;
+		document.querySelector('#import-mode-input').value = json.result.import_mode;
 		document.querySelector('#unzip-input').checked = json.result.unzip;
+		document.querySelector('#hardlink-duplicates-input').checked = json.result.hardlink_duplicates;
 	});
 };
 
@@ -19,7 +21,9 @@ function saveSettings(api_key) {
 		'volume_folder_naming': document.querySelector('#volume-folder-naming-input').value,
 		'file_naming': document.querySelector('#file-naming-input').value,
 		'file_naming_tpb': document.querySelector('#file-naming-tpb-input').value,
-		'unzip': document.querySelector('#unzip-input').checked
+		'import_mode': document.querySelector('#import-mode-input').value,
+		'unzip': document.querySelector('#unzip-input').checked,
+		'hardlink_duplicates': document.querySelector('#hardlink-duplicates-input').checked
 	};
 	fetch(`${url_base}/api/settings?api_key=${api_key}`, {
 		'method': 'PUT',
@@ -0,0 +1,32 @@
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from backend.db import (DBConnection, Singleton, close_db, set_db_location,
+                        setup_db)
+from Kapowarr import _create_app
+
+class DBTestCase(unittest.TestCase):
+	"""Test case with a fresh database in a temporary folder
+	and an app context, for each test
+	"""
+	def setUp(self) -> None:
+		self.folder = TemporaryDirectory()
+		set_db_location(join(self.folder.name, 'Kapowarr.db'))
+		self.app = _create_app()
+		self.context = self.app.app_context()
+		self.context.push()
+		setup_db()
+		return
+
+	def tearDown(self) -> None:
+		close_db()
+		self.context.pop()
+		# The connections are cached per thread, so close them
+		# to make the next test connect to its own database
+		for key, instance in list(Singleton._instances.items()):
+			if isinstance(instance, DBConnection):
+				instance.close()
+				del Singleton._instances[key]
+		self.folder.cleanup()
+		return
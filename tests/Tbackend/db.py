@@ -0,0 +1,100 @@
+from ast import Attribute, Call, Constant, parse, walk
+from os import listdir
+from os.path import dirname, join
+from re import IGNORECASE, compile, findall, match, search
+from sqlite3 import ProgrammingError
+from typing import List, Tuple
+
+from backend.db import get_db
+
+from . import DBTestCase
+
+backend_folder = join(dirname(dirname(dirname(__file__))), 'backend')
+
+# Tables that grow with the library or over time
+large_tables = (
+	'volumes', 'issues', 'files', 'issues_files', 'wanted_issues',
+	'download_history', 'task_history', 'blocklist'
+)
+
+# Statements with a condition that still need to read the whole table
+full_scans_allowed = {
+	# All volume folders are needed to recognise the files that are already imported
+	'SELECT folder FROM volumes WHERE folder IS NOT NULL',
+	# All wanted issues are needed to know which volumes to search for
+	'SELECT id, title FROM volumes WHERE id IN (SELECT volume_id FROM wanted_issues)'
+}
+
+keywords = {
+	'WHERE', 'ON', 'INNER', 'LEFT', 'JOIN', 'GROUP', 'ORDER',
+	'LIMIT', 'SET', 'USING', 'AS', 'CROSS', 'NATURAL'
+}
+table_regex = compile(r'(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', IGNORECASE)
+bindings_regex = compile(r'uses (\d+)')
+
+def _get_statements() -> List[Tuple[str, int, str]]:
+	"""Find the SQL statements in the backend. Only statements
+	that are a plain string (not an f-string) are found.
+
+	Returns:
+		List[Tuple[str, int, str]]: The file, line number and statement
+	"""
+	result = []
+	for file in sorted(listdir(backend_folder)):
+		if not file.endswith('.py'):
+			continue
+		with open(join(backend_folder, file)) as f:
+			tree = parse(f.read())
+		for node in walk(tree):
+			if (isinstance(node, Call)
+			and isinstance(node.func, Attribute)
+			and node.func.attr in ('execute', 'executemany')
+			and node.args
+			and isinstance(node.args[0], Constant)
+			and isinstance(node.args[0].value, str)
+			and match(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', node.args[0].value, IGNORECASE)):
+				result.append((file, node.lineno, ' '.join(node.args[0].value.split())))
+	return result
+
+class query_plans(DBTestCase):
+	def explain(self, statement: str) -> List[str]:
+		cursor = get_db()
+		bindings = 0
+		while True:
+			try:
+				return [
+					r[3] for r in cursor.execute(
+						'EXPLAIN QUERY PLAN ' + statement,
+						(None,) * bindings
+					)
+				]
+			except ProgrammingError as e:
+				bindings = int(bindings_regex.search(str(e)).group(1))
+
+	def test_no_full_scans(self):
+		self.longMessage = False
+		statements = _get_statements()
+		self.assertTrue(statements, 'No statements found')
+
+		for file, line, statement in statements:
+			if (not search(r'\b(WHERE|LIMIT)\b', statement, IGNORECASE)
+			or any(statement.startswith(s) for s in full_scans_allowed)):
+				# Meant to go over the whole table
+				continue
+
+			tables = {}
+			for table, alias in findall(table_regex, statement):
+				tables[table] = table
+				if alias and alias.upper() not in keywords:
+					tables[alias] = table
+
+			for step in self.explain(statement):
+				scan = match(r'SCAN (?:TABLE )?(\w+)', step)
+				if not scan or 'INDEX' in step:
+					continue
+				table = tables.get(scan.group(1), scan.group(1))
+				self.assertNotIn(
+					table, large_tables,
+					f"{file}:{line} scans the whole {table} table: '{statement}'"
+				)
+		return
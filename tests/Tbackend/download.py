@@ -0,0 +1,231 @@
+from os.path import join
+from time import time
+from unittest.mock import patch
+
+from backend.blocklist import add_to_blocklist
+from backend.db import get_db
+from backend.download import (DOWNLOADING_STATE, FAILED_STATE, DirectDownload,
+                              DownloadHandler, PendingDownload,
+                              _cache_downloads, _extract_download_links,
+                              _get_cached_downloads, invalidate_link_cache)
+from backend.settings import private_settings
+
+from . import DBTestCase
+
+class FakeDownload:
+	def __init__(self, folder: str, name: str, state: str) -> None:
+		self.link = f'https://example.com/{name}'
+		self.file = join(folder, name + '.cbz')
+		self.title = name
+		self.source = 'getcomics'
+		self.size = -1
+		self.progress = 0.0
+		self.speed = 0.0
+		self.state = state
+		return
+
+class retry_corrupt(DBTestCase):
+	def setUp(self) -> None:
+		super().setUp()
+		cursor = get_db()
+		cursor.execute("INSERT INTO root_folders(id, folder) VALUES (1, ?);", (self.folder.name,))
+		cursor.execute("INSERT INTO volumes(id, comicvine_id, title, root_folder) VALUES (1, 1, 'Volume', 1);")
+
+		self.handler = DownloadHandler(self.app)
+		self.handler.queue = []
+		self.handler.importing = []
+		return
+
+	def entry(self, id: int, db_id: int, name: str, state: str) -> dict:
+		instance = FakeDownload(self.folder.name, name, state)
+		return {
+			'name': name,
+			'link': instance.link,
+			'instance': instance,
+			'original_link': 'https://getcomics.org/page',
+			'volume_id': 1,
+			'issue_id': None,
+			'id': id,
+			'db_id': db_id,
+			'thread': None
+		}
+
+	def retry(self, download: dict) -> None:
+		retry_download = {
+			'name': download['name'],
+			'link': 'https://example.com/mirror',
+			'instance': FakeDownload(self.folder.name, download['name'], DOWNLOADING_STATE)
+		}
+		with patch('backend.download._extract_download_links', return_value=([retry_download], False)), \
+		patch('backend.download.add_to_blocklist'):
+			self.handler._DownloadHandler__retry_corrupt(download, self.handler.queue)
+		return
+
+	def queue_rows(self) -> list:
+		return [r[0] for r in get_db().execute("SELECT id FROM download_queue;")]
+
+	def test_with_siblings(self):
+		cursor = get_db()
+		db_id = cursor.execute(
+			"INSERT INTO download_queue(link, volume_id, issue_id) VALUES ('https://getcomics.org/page', 1, NULL);"
+		).lastrowid
+		corrupt = self.entry(1, db_id, 'Part 1', FAILED_STATE)
+		sibling = self.entry(2, db_id, 'Part 2', DOWNLOADING_STATE)
+		self.handler.queue.append(sibling)
+
+		self.retry(corrupt)
+
+		self.assertEqual(self.queue_rows(), [db_id])
+		self.assertEqual(
+			[e['db_id'] for e in self.handler.queue],
+			[db_id, db_id]
+		)
+		return
+
+	def test_without_siblings(self):
+		cursor = get_db()
+		db_id = cursor.execute(
+			"INSERT INTO download_queue(link, volume_id, issue_id) VALUES ('https://getcomics.org/page', 1, NULL);"
+		).lastrowid
+		corrupt = self.entry(1, db_id, 'Part 1', FAILED_STATE)
+
+		self.retry(corrupt)
+
+		rows = self.queue_rows()
+		self.assertEqual(len(rows), 1)
+		self.assertEqual([e['db_id'] for e in self.handler.queue], rows)
+		return
+
+class resolve_pending(DBTestCase):
+	page = 'https://getcomics.org/page'
+
+	def setUp(self) -> None:
+		super().setUp()
+		cursor = get_db()
+		cursor.execute("INSERT INTO root_folders(id, folder) VALUES (1, ?);", (self.folder.name,))
+		cursor.execute("INSERT INTO volumes(id, comicvine_id, title, root_folder) VALUES (1, 1, 'Volume', 1);")
+		cursor.executemany(
+			"INSERT INTO download_queue(id, link, volume_id, issue_id) VALUES (?, ?, 1, NULL);",
+			((1, self.page), (2, 'https://getcomics.org/other-page'))
+		)
+
+		self.handler = DownloadHandler(self.app)
+		self.pending = {
+			'name': self.page,
+			'link': self.page,
+			'instance': PendingDownload(self.page),
+			'original_link': self.page,
+			'volume_id': 1,
+			'issue_id': None,
+			'id': 1,
+			'db_id': 1,
+			'thread': None
+		}
+		self.next = {
+			'name': 'Other',
+			'link': 'https://example.com/other',
+			'instance': FakeDownload(self.folder.name, 'Other', DOWNLOADING_STATE),
+			'original_link': 'https://getcomics.org/other-page',
+			'volume_id': 1,
+			'issue_id': None,
+			'id': 2,
+			'db_id': 2,
+			'thread': None
+		}
+		self.handler.queue = [self.pending, self.next]
+		self.handler.importing = []
+		return
+
+	def test_resolving_fails(self):
+		with patch('backend.download._extract_download_links', side_effect=ConnectionError), \
+		patch('backend.download.add_to_blocklist') as blocklist, \
+		patch.object(self.handler, '_process_queue') as process_queue:
+			self.handler._DownloadHandler__run_download(self.pending)
+
+		self.assertEqual(self.pending['instance'].state, FAILED_STATE)
+		self.assertEqual(self.handler.queue, [self.next])
+		self.assertEqual(
+			[r[0] for r in get_db().execute("SELECT id FROM download_queue;")],
+			[2]
+		)
+		blocklist.assert_not_called()
+		process_queue.assert_called()
+
+class link_cache(DBTestCase):
+	page = 'https://getcomics.org/dc/batman-1'
+
+	def setUp(self) -> None:
+		super().setUp()
+		cursor = get_db()
+		cursor.execute("INSERT INTO root_folders(id, folder) VALUES (1, ?);", (self.folder.name,))
+		cursor.execute("INSERT INTO volumes(id, comicvine_id, title, root_folder) VALUES (1, 1, 'Batman', 1);")
+
+		instance = DirectDownload(
+			link='https://example.com/batman-1.cbz',
+			filename_body='Batman 1',
+			source='getcomics',
+			mirrors=['https://mirror.example.com/batman-1.cbz'],
+			_resolved={'extension': '.cbz', 'size': 1000}
+		)
+		_cache_downloads(self.page, [{
+			'name': 'Batman 1',
+			'link': 'https://getcomics.org/dls/batman-1',
+			'instance': instance
+		}])
+		return
+
+	def test_hit(self):
+		with patch('backend.download.get') as get:
+			downloads, limit_reached = _extract_download_links(self.page, 1)
+			get.assert_not_called()
+
+		self.assertFalse(limit_reached)
+		self.assertEqual(len(downloads), 1)
+		self.assertEqual(downloads[0]['name'], 'Batman 1')
+		self.assertEqual(downloads[0]['link'], 'https://getcomics.org/dls/batman-1')
+		instance = downloads[0]['instance']
+		self.assertIsInstance(instance, DirectDownload)
+		self.assertEqual(instance.link, 'https://example.com/batman-1.cbz')
+		self.assertEqual(instance.mirrors, ['https://mirror.example.com/batman-1.cbz'])
+		self.assertEqual(instance.size, 1000)
+		self.assertTrue(instance.file.endswith('.cbz'))
+
+	def cached_pages(self) -> list:
+		return [r[0] for r in get_db().execute("SELECT page_link FROM download_link_cache ORDER BY page_link;")]
+
+	def cache_other_page(self) -> None:
+		_cache_downloads('https://getcomics.org/dc/batman-2', [])
+		return
+
+	def test_expiry(self):
+		expired = time() + private_settings['download_link_cache_ttl'] + 1
+		with patch('backend.download.time', return_value=expired):
+			self.assertIsNone(_get_cached_downloads(self.page))
+			# Reading doesn't remove the page, caching another page does
+			self.assertIn(self.page, self.cached_pages())
+			self.cache_other_page()
+			self.assertEqual(self.cached_pages(), ['https://getcomics.org/dc/batman-2'])
+
+	def test_expiry_while_queued(self):
+		get_db().execute(
+			"INSERT INTO download_queue(link, volume_id, issue_id) VALUES (?, 1, NULL);",
+			(self.page,)
+		)
+		expired = time() + private_settings['download_link_cache_ttl'] + 1
+		with patch('backend.download.time', return_value=expired):
+			self.cache_other_page()
+		self.assertIn(self.page, self.cached_pages())
+
+	def test_invalidate(self):
+		invalidate_link_cache(self.page)
+		self.assertIsNone(_get_cached_downloads(self.page))
+
+	def test_blocklisted_link(self):
+		add_to_blocklist('https://getcomics.org/dls/batman-1', 1)
+		self.assertIsNone(_get_cached_downloads(self.page))
+		self.assertIsNone(
+			get_db().execute(
+				"SELECT 1 FROM download_link_cache WHERE page_link = ?;",
+				(self.page,)
+			).fetchone()
+		)
@@ -0,0 +1,39 @@
+from os import stat
+from os.path import join
+
+from backend.db import get_db
+from backend.duplicates import hash_files
+from backend.duplicates import link_duplicates as ld
+
+from . import DBTestCase
+
+class link_duplicates(DBTestCase):
+	def setUp(self) -> None:
+		super().setUp()
+		self.files = [join(self.folder.name, f'{i}.cbz') for i in range(3)]
+		for f in self.files:
+			with open(f, 'wb') as file:
+				file.write(b'comic' * 1000)
+		get_db().executemany(
+			"INSERT INTO files(filepath) VALUES (?);",
+			((f,) for f in self.files)
+		)
+		hash_files()
+		return
+
+	def test_link(self):
+		self.assertEqual(ld(), 2 * 5000)
+		inodes = set(stat(f).st_ino for f in self.files)
+		self.assertEqual(len(inodes), 1)
+
+	def test_changed_after_hashing(self):
+		# Same size, different content
+		with open(self.files[2], 'r+b') as file:
+			file.seek(2500)
+			file.write(b'COMIC')
+
+		self.assertEqual(ld(), 5000)
+		self.assertEqual(stat(self.files[0]).st_ino, stat(self.files[1]).st_ino)
+		self.assertNotEqual(stat(self.files[0]).st_ino, stat(self.files[2]).st_ino)
+		with open(self.files[2], 'rb') as file:
+			self.assertEqual(file.read(2505)[-5:], b'COMIC')
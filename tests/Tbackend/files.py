@@ -1,7 +1,14 @@
 from typing import Dict
 import unittest
+from os import link, listdir, makedirs, stat, write
+from os.path import isdir, join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
 
+from backend.files import copy_file as cf
 from backend.files import extract_filename_data as ef
+from backend.files import link_file as lf
+from backend.files import move_folder as mf
 
 class extract_filename_data(unittest.TestCase):
 	def run_cases(self, cases: Dict[str, dict]):
@@ -88,3 +95,117 @@ class extract_filename_data(unittest.TestCase):
 				{'series': 'Silver Surfer - Rebirth', 'year': 2022, 'volume_number': 2, 'special_version': 'tpb', 'issue_number': None, 'annual': False}
 		}
 		self.run_cases(cases)
+
+class move_folder(unittest.TestCase):
+	def setUp(self) -> None:
+		self.folder = TemporaryDirectory()
+		self.before = join(self.folder.name, 'before')
+		self.after = join(self.folder.name, 'root', 'after')
+		makedirs(join(self.before, 'sub'))
+		for f in ('a.cbz', join('sub', 'b.cbz')):
+			with open(join(self.before, f), 'w') as file:
+				file.write(f)
+		return
+
+	def tearDown(self) -> None:
+		self.folder.cleanup()
+		return
+
+	def test_new_destination(self):
+		mf(self.before, self.after)
+		self.assertFalse(isdir(self.before))
+		self.assertEqual(sorted(listdir(self.after)), ['a.cbz', 'sub'])
+		self.assertEqual(listdir(join(self.after, 'sub')), ['b.cbz'])
+
+	def test_existing_destination(self):
+		makedirs(join(self.after, 'sub'))
+		with open(join(self.after, 'c.cbz'), 'w') as file:
+			file.write('c.cbz')
+
+		mf(self.before, self.after)
+		self.assertFalse(isdir(self.before))
+		self.assertEqual(sorted(listdir(self.after)), ['a.cbz', 'c.cbz', 'sub'])
+		self.assertEqual(listdir(join(self.after, 'sub')), ['b.cbz'])
+
+	def test_conflicting_destination(self):
+		makedirs(self.after)
+		with open(join(self.after, 'a.cbz'), 'w') as file:
+			file.write('other')
+
+		self.assertRaises(FileExistsError, mf, self.before, self.after)
+		self.assertEqual(sorted(listdir(self.before)), ['a.cbz', 'sub'])
+		with open(join(self.after, 'a.cbz')) as file:
+			self.assertEqual(file.read(), 'other')
+
+class copy_file(unittest.TestCase):
+	def setUp(self) -> None:
+		self.folder = TemporaryDirectory()
+		self.before = join(self.folder.name, 'before.cbz')
+		self.after = join(self.folder.name, 'after.cbz')
+		self.content = bytes(range(256)) * 1000
+		with open(self.before, 'wb') as file:
+			file.write(self.content)
+		return
+
+	def tearDown(self) -> None:
+		self.folder.cleanup()
+		return
+
+	def test_copy(self):
+		cf(self.before, self.after)
+		with open(self.after, 'rb') as file:
+			self.assertEqual(file.read(), self.content)
+
+	def test_short_writes(self):
+		# Copying through python, where each write only writes part of the data
+		with patch('backend.files.copy_file_range', None), \
+		patch('backend.files.sendfile', None), \
+		patch('backend.files.ioctl', None), \
+		patch('backend.files.write', side_effect=lambda fd, data: write(fd, data[:1000])):
+			cf(self.before, self.after)
+		with open(self.after, 'rb') as file:
+			self.assertEqual(file.read(), self.content)
+
+class link_file(unittest.TestCase):
+	def setUp(self) -> None:
+		self.folder = TemporaryDirectory()
+		self.before = join(self.folder.name, 'download.cbz')
+		self.after = join(self.folder.name, 'library', 'Issue 1.cbz')
+		makedirs(join(self.folder.name, 'library'))
+		with open(self.before, 'w') as file:
+			file.write('new')
+		return
+
+	def tearDown(self) -> None:
+		self.folder.cleanup()
+		return
+
+	def read(self, filepath: str) -> str:
+		with open(filepath) as file:
+			return file.read()
+
+	def test_link(self):
+		lf(self.before, self.after)
+		self.assertEqual(stat(self.before).st_ino, stat(self.after).st_ino)
+		self.assertEqual(listdir(join(self.folder.name, 'library')), ['Issue 1.cbz'])
+
+	def test_same_file(self):
+		lf(self.before, self.before)
+		self.assertEqual(self.read(self.before), 'new')
+
+	def test_already_linked(self):
+		link(self.before, self.after)
+		lf(self.before, self.after)
+		self.assertEqual(self.read(self.before), 'new')
+		self.assertEqual(self.read(self.after), 'new')
+
+	def test_replace(self):
+		# The file at the destination is linked to another file, which should be left alone
+		other = join(self.folder.name, 'other.cbz')
+		with open(other, 'w') as file:
+			file.write('old')
+		link(other, self.after)
+
+		lf(self.before, self.after)
+		self.assertEqual(self.read(self.after), 'new')
+		self.assertEqual(self.read(other), 'old')
@@ -0,0 +1,96 @@
+from os import makedirs
+from os.path import isfile, join
+from sqlite3 import IntegrityError
+from unittest.mock import patch
+
+from backend.db import get_db
+from backend.files import rename_file
+from backend.naming import mass_rename as mr
+
+from . import DBTestCase
+
+class mass_rename(DBTestCase):
+	def setUp(self) -> None:
+		super().setUp()
+		self.volume_folder = join(self.folder.name, 'Volume')
+		self.new_folder = join(self.folder.name, 'New Volume')
+		makedirs(self.volume_folder)
+		self.renames = []
+		for name in ('1', '2', '3'):
+			before = join(self.volume_folder, name + '.cbz')
+			with open(before, 'w') as f:
+				f.write(name)
+			self.renames.append({
+				'before': before,
+				'after': join(self.new_folder, f'Volume {name}.cbz')
+			})
+
+		cursor = get_db()
+		cursor.execute("INSERT INTO root_folders(id, folder) VALUES (1, ?);", (self.folder.name,))
+		cursor.execute(
+			"INSERT INTO volumes(id, comicvine_id, title, root_folder, folder) VALUES (1, 1, 'Volume', 1, ?);",
+			(self.volume_folder,)
+		)
+		cursor.executemany(
+			"INSERT INTO files(filepath) VALUES (?);",
+			((r['before'],) for r in self.renames)
+		)
+		cursor.connection.commit()
+		return
+
+	def rename(self) -> None:
+		with patch('backend.naming.preview_mass_rename', return_value=self.renames):
+			mr(1)
+		return
+
+	def assertNotRenamed(self) -> None:
+		for r in self.renames:
+			self.assertTrue(isfile(r['before']))
+			self.assertFalse(isfile(r['after']))
+
+		cursor = get_db()
+		self.assertEqual(
+			cursor.execute("SELECT folder FROM volumes WHERE id = 1;").fetchone()[0],
+			self.volume_folder
+		)
+		self.assertEqual(
+			[f[0] for f in cursor.execute("SELECT filepath FROM files WHERE filepath LIKE ? ORDER BY id;", (self.volume_folder + '%',))],
+			[r['before'] for r in self.renames]
+		)
+		return
+
+	def test_success(self):
+		self.rename()
+		for r in self.renames:
+			self.assertFalse(isfile(r['before']))
+			self.assertTrue(isfile(r['after']))
+
+		cursor = get_db()
+		self.assertEqual(
+			cursor.execute("SELECT folder FROM volumes WHERE id = 1;").fetchone()[0],
+			self.new_folder
+		)
+		self.assertEqual(
+			[f[0] for f in cursor.execute("SELECT filepath FROM files ORDER BY id;")],
+			[r['after'] for r in self.renames]
+		)
+
+	def test_failed_move(self):
+		calls = []
+		def failing_rename(before, after):
+			calls.append(before)
+			if len(calls) == 3:
+				raise OSError('Move failed')
+			rename_file(before, after)
+
+		with patch('backend.naming.rename_file', side_effect=failing_rename):
+			self.assertRaises(OSError, self.rename)
+		self.assertNotRenamed()
+
+	def test_failed_database_update(self):
+		# The last new filepath is already taken in the database,
+		# so the update fails after the volume folder is already changed
+		get_db().execute("INSERT INTO files(filepath) VALUES (?);", (self.renames[-1]['after'],))
+
+		self.assertRaises(IntegrityError, self.rename)
+		self.assertNotRenamed()
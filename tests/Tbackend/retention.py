@@ -0,0 +1,141 @@
+from gzip import open as gzip_open
+from json import loads
+from time import time
+
+from backend.custom_exceptions import ArchiveNotFound
+from backend.db import get_db
+from backend.download import get_download_history as gdh
+from backend.retention import get_archive
+from backend.retention import prune_download_history as pdh
+from backend.retention import prune_task_history as pth
+from backend.tasks import get_task_history as gth
+
+from . import DBTestCase
+
+day = 86400
+
+def read_archive(table: str) -> list:
+	with gzip_open(get_archive(table), 'rt', encoding='utf-8') as f:
+		return [loads(l) for l in f]
+
+class get_download_history(DBTestCase):
+	def setUp(self) -> None:
+		super().setUp()
+		# Entries share their timestamp in groups of three,
+		# so that a block can end halfway through a group
+		get_db().executemany(
+			"INSERT INTO download_history(original_link, title, downloaded_at) VALUES (?, ?, ?);",
+			((f'https://getcomics.org/{i}', f'Title {i}', 1000 + i // 3) for i in range(130))
+		)
+		return
+
+	def test_blocks(self):
+		expected = [
+			r[0] for r in get_db().execute(
+				"SELECT id FROM download_history ORDER BY downloaded_at DESC, id DESC;"
+			)
+		]
+
+		result = []
+		block = gdh()
+		while block:
+			self.assertLessEqual(len(block), 50)
+			result += [e['id'] for e in block]
+			block = gdh((block[-1]['downloaded_at'], block[-1]['id']))
+
+		self.assertEqual(result, expected)
+
+	def test_offset(self):
+		expected = [
+			r[0] for r in get_db().execute(
+				"SELECT id FROM download_history ORDER BY downloaded_at DESC, id DESC;"
+			)
+		]
+		self.assertEqual([e['id'] for e in gdh(offset=1)], expected[50:100])
+
+		# The keyset takes precedence
+		first = gdh()
+		self.assertEqual(
+			[e['id'] for e in gdh((first[-1]['downloaded_at'], first[-1]['id']), 2)],
+			expected[50:100]
+		)
+
+class get_task_history(DBTestCase):
+	def setUp(self) -> None:
+		super().setUp()
+		get_db().executemany(
+			"INSERT INTO task_history(task_name, display_title, run_at) VALUES (?, ?, ?);",
+			(('search_all', 'Search All', 1000 + i // 4) for i in range(110))
+		)
+		return
+
+	def test_blocks(self):
+		expected = [
+			r[0] for r in get_db().execute(
+				"SELECT id FROM task_history ORDER BY run_at DESC, id DESC;"
+			)
+		]
+
+		result = []
+		block = gth()
+		while block:
+			self.assertLessEqual(len(block), 50)
+			result += [e['id'] for e in block]
+			block = gth((block[-1]['run_at'], block[-1]['id']))
+
+		self.assertEqual(result, expected)
+
+class prune_download_history(DBTestCase):
+	def test_prune(self):
+		now = round(time())
+		get_db().executemany(
+			"INSERT INTO download_history(original_link, title, downloaded_at) VALUES (?, ?, ?);",
+			(
+				('https://getcomics.org/old-1', 'Old 1', now - 40 * day),
+				('https://getcomics.org/new', 'New', now - 10 * day),
+				('https://getcomics.org/old-2', 'Old 2', now - 31 * day)
+			)
+		)
+		self.assertRaises(ArchiveNotFound, get_archive, 'download_history')
+
+		self.assertEqual(pdh(30), 2)
+		self.assertEqual(
+			[r[0] for r in get_db().execute("SELECT title FROM download_history;")],
+			['New']
+		)
+		self.assertEqual(
+			[e['title'] for e in read_archive('download_history')],
+			['Old 1', 'Old 2']
+		)
+
+		# Archiving again adds to the archive
+		self.assertEqual(pdh(5), 1)
+		self.assertEqual(
+			[e['title'] for e in read_archive('download_history')],
+			['Old 1', 'Old 2', 'New']
+		)
+		self.assertEqual(pdh(5), 0)
+
+class prune_task_history(DBTestCase):
+	def test_prune(self):
+		now = round(time())
+		get_db().executemany(
+			"INSERT INTO task_history(task_name, display_title, run_at) VALUES (?, ?, ?);",
+			(
+				('search_all', 'Search All', now - 100 * day),
+				('update_all', 'Update All', now - 95 * day),
+				('search_all', 'Search All', now - 92 * day),
+				('update_all', 'Update All', now - 1 * day)
+			)
+		)
+
+		# The last run of each task is kept, even when it's too old
+		self.assertEqual(pth(90), 2)
+		self.assertEqual(
+			get_db().execute("SELECT task_name, run_at FROM task_history ORDER BY run_at;").fetchall(),
+			[('search_all', now - 92 * day), ('update_all', now - 1 * day)]
+		)
+		self.assertEqual(
+			[(e['task_name'], e['run_at']) for e in read_archive('task_history')],
+			[('search_all', now - 100 * day), ('update_all', now - 95 * day)]
+		)
@@ -0,0 +1,59 @@
+from backend.db import get_db
+from backend.wanted import update_wanted as uw
+
+from . import DBTestCase
+
+class update_wanted(DBTestCase):
+	def setUp(self) -> None:
+		super().setUp()
+		cursor = get_db()
+		cursor.execute("INSERT INTO root_folders(id, folder) VALUES (1, ?);", (self.folder.name,))
+		cursor.executemany(
+			"INSERT INTO volumes(id, comicvine_id, title, monitored, root_folder) VALUES (?, ?, ?, ?, 1);",
+			((1, 1, 'Volume 1', 1), (2, 2, 'Volume 2', 1), (3, 3, 'Volume 3', 0))
+		)
+		# Volume 1: 1 is wanted, 2 isn't monitored, 3 has a file
+		# Volume 2: 4 and 5 are wanted
+		# Volume 3: 6 isn't wanted, as the volume isn't monitored
+		cursor.executemany(
+			"INSERT INTO issues(id, volume_id, comicvine_id, issue_number, calculated_issue_number, monitored) VALUES (?, ?, ?, ?, ?, ?);",
+			(
+				(1, 1, 11, '1', 1.0, 1),
+				(2, 1, 12, '2', 2.0, 0),
+				(3, 1, 13, '3', 3.0, 1),
+				(4, 2, 14, '1', 1.0, 1),
+				(5, 2, 15, '2', 2.0, 1),
+				(6, 3, 16, '1', 1.0, 1)
+			)
+		)
+		cursor.execute("INSERT INTO files(id, filepath) VALUES (1, '/comics/Volume 1/3.cbz');")
+		cursor.execute("INSERT INTO issues_files(file_id, issue_id) VALUES (1, 3);")
+		return
+
+	def wanted(self) -> list:
+		return [r[0] for r in get_db().execute("SELECT issue_id FROM wanted_issues ORDER BY issue_id;")]
+
+	def test_library(self):
+		uw()
+		self.assertEqual(self.wanted(), [1, 4, 5])
+
+	def test_volume_id(self):
+		uw(volume_id=1)
+		self.assertEqual(self.wanted(), [1])
+
+	def test_volume_ids(self):
+		uw(volume_id=[1, 2, 3])
+		self.assertEqual(self.wanted(), [1, 4, 5])
+
+	def test_issue_id(self):
+		uw()
+		get_db().execute("UPDATE issues SET monitored = 0 WHERE id = 4;")
+		uw(issue_id=4)
+		self.assertEqual(self.wanted(), [1, 5])
+
+	def test_issue_ids(self):
+		uw()
+		get_db().execute("UPDATE issues SET monitored = 0 WHERE id IN (1, 5);")
+		get_db().execute("UPDATE issues SET monitored = 1 WHERE id = 2;")
+		uw(issue_id=[1, 2, 5])
+		self.assertEqual(self.wanted(), [2, 4])
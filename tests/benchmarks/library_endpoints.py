@@ -0,0 +1,116 @@
+#-*- coding: utf-8 -*-
+
+"""Measure the response size and latency of the library endpoints, with and
+without compression. Not part of the test suite. Run from the root folder of the project:
+
+	python3 -m tests.benchmarks.library_endpoints --volumes 2000 --issues 50
+"""
+
+from argparse import ArgumentParser
+from os.path import join
+from statistics import median
+from sys import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List, Tuple
+
+path.insert(0, '.')
+
+from backend.db import get_db, set_db_location, setup_db
+from frontend.ui import ui_vars
+from Kapowarr import _create_app
+
+ENCODINGS = ('identity', 'gzip', 'br')
+
+def _fill_library(volumes: int, issues: int, root_folder: str='/comics') -> None:
+	"""Fill the database with fake volumes and issues
+
+	Args:
+		volumes (int): The amount of volumes to add
+		issues (int): The amount of issues to add per volume
+		root_folder (str, optional): The root folder of the volumes. Defaults to '/comics'.
+	"""
+	cursor = get_db()
+	cursor.execute("INSERT INTO root_folders(folder) VALUES (?);", (root_folder,))
+	cursor.executemany("""
+		INSERT INTO volumes(
+			comicvine_id, title, year, publisher,
+			description, monitored, root_folder, folder
+		) VALUES (?, ?, 2000, 'Publisher', ?, 1, 1, ?);
+		""",
+		(
+			(v, f'Volume {v}', 'Description of the volume. ' * 20, join(root_folder, f'Volume {v}'))
+			for v in range(1, volumes + 1)
+		)
+	)
+	cursor.executemany("""
+		INSERT INTO issues(
+			volume_id, comicvine_id,
+			issue_number, calculated_issue_number,
+			title, description
+		) VALUES (?, ?, ?, ?, ?, ?);
+		""",
+		(
+			(v, v * 100000 + i, str(i), float(i), f'Issue {i}', 'Description of the issue. ' * 5)
+			for v in range(1, volumes + 1)
+			for i in range(1, issues + 1)
+		)
+	)
+	cursor.connection.commit()
+	return
+
+def _measure(client, url: str, encoding: str, runs: int) -> Tuple[int, float]:
+	"""Request an endpoint multiple times
+
+	Args:
+		client (FlaskClient): The test client to make the requests with
+		url (str): The url to request
+		encoding (str): The value of the Accept-Encoding header
+		runs (int): How often to request the url
+
+	Returns:
+		Tuple[int, float]: The size of the response in bytes and the median latency in ms
+	"""
+	timings: List[float] = []
+	for _ in range(runs):
+		start = perf_counter()
+		response = client.get(url, headers={'Accept-Encoding': encoding})
+		size = len(response.get_data())
+		timings.append((perf_counter() - start) * 1000)
+	return size, median(timings)
+
+def run_benchmarks(volumes: int, issues: int, runs: int) -> None:
+	with TemporaryDirectory() as folder:
+		set_db_location(join(folder, 'Kapowarr.db'))
+		app = _create_app()
+		ui_vars['url_base'] = ''
+		with app.app_context():
+			setup_db()
+			_fill_library(volumes, issues)
+			api_key = get_db().execute(
+				"SELECT value FROM config WHERE key = 'api_key' LIMIT 1;"
+			).fetchone()[0]
+
+		endpoints = {
+			'GET /api/volumes': f'/api/volumes?api_key={api_key}',
+			'GET /api/volumes?query': f'/api/volumes?query=volume 1&api_key={api_key}',
+			'GET /api/volumes/<id>': f'/api/volumes/1?api_key={api_key}',
+			'GET /api/volumes/stats': f'/api/volumes/stats?api_key={api_key}'
+		}
+
+		client = app.test_client()
+		print(f'{volumes} volumes, {issues} issues per volume, {runs} runs')
+		print(f'{"Endpoint":<26}{"Encoding":<10}{"Size (bytes)":>14}{"Median (ms)":>13}')
+		for name, url in endpoints.items():
+			for encoding in ENCODINGS:
+				size, latency = _measure(client, url, encoding, runs)
+				print(f'{name:<26}{encoding:<10}{size:>14}{latency:>13.1f}')
+	return
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='Benchmark the library endpoints of the API')
+	parser.add_argument('--volumes', type=int, default=1000, help='The amount of volumes in the library')
+	parser.add_argument('--issues', type=int, default=25, help='The amount of issues per volume')
+	parser.add_argument('--runs', type=int, default=5, help='How often to request each endpoint')
+	args = parser.parse_args()
+	run_benchmarks(args.volumes, args.issues, args.runs)
@@ -0,0 +1,161 @@
+#-*- coding: utf-8 -*-
+
+"""Simulate many clients that have the web-UI open, while an `UpdateAll` task
+is running, and measure how the server holds up. ComicVine is replaced by a
+fake that takes some time to respond. Not part of the test suite. Run from the
+root folder of the project:
+
+	python3 -m tests.benchmarks.load --clients 50 --duration 20 --threads 10
+"""
+
+from argparse import ArgumentParser
+from os.path import join
+from statistics import median, quantiles
+from sys import path
+from tempfile import TemporaryDirectory
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep
+from typing import Dict, List
+
+path.insert(0, '.')
+
+from requests import Session
+from waitress.server import create_server
+
+import backend.volumes
+from backend.db import get_db, set_db_location, setup_db
+from frontend.api import set_hosting_threads, task_handler
+from frontend.ui import ui_vars
+from Kapowarr import _create_app
+from tests.benchmarks.library_endpoints import _fill_library
+
+# Endpoints that a dashboard polls
+DASHBOARD_ENDPOINTS = (
+	'/api/volumes',
+	'/api/volumes/stats',
+	'/api/system/tasks',
+	'/api/activity/queue'
+)
+# Endpoint that is slow (it searches online)
+SLOW_ENDPOINT = '/api/volumes/search?query=Volume'
+
+class _FakeComicVine:
+	"""Stands in for backend.comicvine.ComicVine, with a delay per request
+	"""
+	delay = 0.5
+
+	def fetch_volumes(self, ids: List[str]) -> List[dict]:
+		sleep(self.delay * (len(ids) // 100 + 1))
+		return [{
+			'comicvine_id': int(i), 'title': f'Volume {i}', 'year': 2000,
+			'publisher': 'Publisher', 'volume_number': 1,
+			'description': 'Updated', 'cover': None,
+			'date_last_updated': str(perf_counter()), 'issue_count': 0
+		} for i in ids]
+
+	def fetch_issues(self, ids: List[str]) -> List[dict]:
+		sleep(self.delay * (len(ids) // 50 + 1))
+		return []
+
+	def search_volumes(self, query: str) -> List[dict]:
+		sleep(self.delay * 4)
+		return []
+
+def _client(base_url: str, api_key: str, stop: Event, slow: bool, results: Dict[str, List[float]], lock: Lock) -> None:
+	"""Poll the dashboard endpoints until told to stop
+
+	Args:
+		base_url (str): The url of the server
+		api_key (str): The api key
+		stop (Event): Set when the client should stop
+		slow (bool): Wether this client also requests the slow endpoint
+		results (Dict[str, List[float]]): Where to store the latencies per endpoint (status 5xx gets stored under `{endpoint} 5xx`)
+		lock (Lock): Lock for `results`
+	"""
+	ssn = Session()
+	endpoints = DASHBOARD_ENDPOINTS + ((SLOW_ENDPOINT,) if slow else ())
+	while not stop.is_set():
+		for endpoint in endpoints:
+			start = perf_counter()
+			try:
+				response = ssn.get(
+					base_url + endpoint,
+					params={'api_key': api_key},
+					timeout=30
+				)
+				key = endpoint if response.status_code < 500 else f'{endpoint} {response.status_code}'
+			except Exception:
+				key = f'{endpoint} failed'
+			with lock:
+				results.setdefault(key, []).append(perf_counter() - start)
+		sleep(1)
+	return
+
+def run_load_test(clients: int, slow_clients: int, duration: int, threads: int, volumes: int) -> None:
+	with TemporaryDirectory() as folder:
+		set_db_location(join(folder, 'Kapowarr.db'))
+		app = _create_app()
+		ui_vars['url_base'] = ''
+		backend.volumes.ComicVine = _FakeComicVine
+		with app.app_context():
+			setup_db()
+			_fill_library(volumes, 10, join(folder, 'comics'))
+			api_key = get_db().execute(
+				"SELECT value FROM config WHERE key = 'api_key' LIMIT 1;"
+			).fetchone()[0]
+
+		set_hosting_threads(threads)
+		server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+		base_url = f'http://127.0.0.1:{server.effective_port}'
+		Thread(target=server.run, name='Load Test Server', daemon=True).start()
+
+		# Keep an UpdateAll running for the whole test
+		stop = Event()
+		def update_all() -> None:
+			while not stop.is_set():
+				with app.app_context():
+					get_db().execute("UPDATE volumes SET last_cv_fetch = 0;")
+					get_db().connection.commit()
+				with task_handler.context():
+					backend.volumes.refresh_and_scan()
+		Thread(target=update_all, name='Load Test Update All', daemon=True).start()
+
+		results: Dict[str, List[float]] = {}
+		lock = Lock()
+		client_threads = [
+			Thread(
+				target=_client,
+				args=(base_url, api_key, stop, c < slow_clients, results, lock),
+				daemon=True
+			)
+			for c in range(clients)
+		]
+		start = perf_counter()
+		for t in client_threads:
+			t.start()
+		sleep(duration)
+		stop.set()
+		for t in client_threads:
+			t.join()
+		elapsed = perf_counter() - start
+		server.close()
+
+	print(f'{clients} clients ({slow_clients} also searching), {threads} threads, {volumes} volumes, {elapsed:.1f}s')
+	print(f'{"Endpoint":<40}{"Requests":>10}{"p50 (ms)":>10}{"p95 (ms)":>10}')
+	total = 0
+	for key, timings in sorted(results.items()):
+		total += len(timings)
+		p95 = quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+		print(f'{key:<40}{len(timings):>10}{median(timings) * 1000:>10.1f}{p95 * 1000:>10.1f}')
+	print(f'Throughput: {total / elapsed:.1f} requests/s')
+	return
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='Load test the web server while an UpdateAll is running')
+	parser.add_argument('--clients', type=int, default=30, help='The amount of clients polling the dashboard')
+	parser.add_argument('--slow-clients', type=int, default=10, help='The amount of those clients that also search (slow endpoint)')
+	parser.add_argument('--duration', type=int, default=15, help='How long to run the test in seconds')
+	parser.add_argument('--threads', type=int, default=10, help='The amount of hosting threads')
+	parser.add_argument('--volumes', type=int, default=500, help='The amount of volumes in the library')
+	args = parser.parse_args()
+	run_load_test(args.clients, args.slow_clients, args.duration, args.threads, args.volumes)
@@ -0,0 +1,130 @@
+#-*- coding: utf-8 -*-
+
+"""Measure the speed of the Mega downloader with different amounts of
+connections, against a local fake Mega server that limits the speed per
+connection like Mega does. Not part of the test suite. Run from the root
+folder of the project:
+
+	python3 -m tests.benchmarks.mega --size 64 --bandwidth 20 --connections 1 2 4 8
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import urandom
+from os.path import getsize, join
+from re import fullmatch
+from struct import unpack
+from sys import path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter, sleep
+from typing import List
+
+path.insert(0, '.')
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+from backend.lib.mega import (EMPTY_IV, Mega, _chunk_mac, a32_to_str,
+                              get_chunks, str_to_a32)
+
+def _encrypt_file(size: int) -> tuple:
+	"""Create a random file and encrypt it like Mega does
+
+	Args:
+		size (int): The size of the file in bytes
+
+	Returns:
+		tuple: The encrypted data, the key, the iv and the meta mac
+	"""
+	data = urandom(size)
+	k = unpack('>4I', urandom(16))
+	iv = unpack('>2I', urandom(8)) + (0, 0)
+	k_str = a32_to_str(k)
+	mac_iv = a32_to_str([iv[0], iv[1], iv[0], iv[1]])
+
+	mac_encryptor = AES.new(k_str, AES.MODE_CBC, EMPTY_IV)
+	offset = 0
+	for chunk_size in get_chunks(size):
+		mac_bytes = mac_encryptor.encrypt(
+			_chunk_mac(k_str, mac_iv, data[offset:offset + chunk_size])
+		)
+		offset += chunk_size
+	file_mac = str_to_a32(mac_bytes)
+	meta_mac = (file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3])
+
+	encrypted = AES.new(k_str, AES.MODE_CTR, counter=Counter.new(
+		128, initial_value=((iv[0] << 32) + iv[1]) << 64
+	)).encrypt(data)
+	return encrypted, k, iv, meta_mac
+
+def _make_handler(encrypted: bytes, bandwidth: float) -> type:
+	class FakeMegaHandler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def log_message(self, *args) -> None:
+			return
+
+		def do_GET(self) -> None:
+			match = fullmatch(r'/file(?:/(\d+)-(\d+))?', self.path)
+			if not match:
+				self.send_error(404)
+				return
+			start = int(match.group(1) or 0)
+			end = int(match.group(2) or len(encrypted) - 1)
+			body = memoryview(encrypted)[start:end + 1]
+
+			self.send_response(200)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			# Limit the speed of this connection
+			block = 0x10000
+			try:
+				for i in range(0, len(body), block):
+					self.wfile.write(body[i:i + block])
+					sleep(block / (bandwidth * 1024 * 1024))
+			except ConnectionError:
+				# Download was stopped
+				pass
+			return
+
+	return FakeMegaHandler
+
+def run_benchmark(size: int, bandwidth: float, connections: List[int]) -> None:
+	encrypted, k, iv, meta_mac = _encrypt_file(size * 1024 * 1024)
+	server = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(encrypted, bandwidth))
+	server.daemon_threads = True
+	Thread(target=server.serve_forever, name='Fake Mega Server', daemon=True).start()
+	url = f'http://127.0.0.1:{server.server_port}/file'
+
+	print(f'{size} MB file, {bandwidth} MB/s per connection')
+	print(f'{"Connections":>12}{"Time (s)":>10}{"MB/s":>10}')
+	with TemporaryDirectory() as folder:
+		for connection_count in connections:
+			mega = Mega.__new__(Mega)
+			mega.downloading = False
+			mega.progress = 0.0
+			mega.speed = 0.0
+			mega.size = len(encrypted)
+			mega.timeout = 160
+			mega.file_id = 'benchmark'
+			mega.k, mega.iv, mega.meta_mac = k, iv, meta_mac
+			mega._api_request = lambda data: {'g': url}
+
+			filename = join(folder, f'{connection_count}.bin')
+			start = perf_counter()
+			mega.download_url(filename, connection_count)
+			elapsed = perf_counter() - start
+			assert getsize(filename) == len(encrypted)
+			print(f'{connection_count:>12}{elapsed:>10.2f}{size / elapsed:>10.1f}')
+
+	server.shutdown()
+	return
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='Benchmark the Mega downloader against a fake Mega server')
+	parser.add_argument('--size', type=int, default=64, help='The size of the file in MB')
+	parser.add_argument('--bandwidth', type=float, default=20.0, help='The speed limit per connection in MB/s')
+	parser.add_argument('--connections', type=int, nargs='+', default=[1, 2, 4, 8], help='The amounts of connections to test')
+	args = parser.parse_args()
+	run_benchmark(args.size, args.bandwidth, args.connections)